@@ -1,19 +1,38 @@
 
 from flask import Flask
 from config import Config
+from .assets import init_static_assets
 from .database import DatabaseManager
+from .instrumentation import init_instrumentation
+from .sessions import init_sessions
 
 def create_app():
     """Crea e configura l'istanza dell'applicazione Flask."""
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    # Le connessioni prese dal pool durante una richiesta vengono restituite al termine
+    app.teardown_appcontext(DatabaseManager.release_connections)
+
     # Inizializza il database
     with app.app_context():
         DatabaseManager.init_database()
 
+    # Sessioni lato server: il cookie contiene solo un identificativo opaco
+    init_sessions(app)
+
+    # Metriche e profilazione delle richieste (disattivate per impostazione predefinita)
+    init_instrumentation(app)
+
+    # File statici con l'impronta del contenuto nell'URL, memorizzabili a lungo dai browser
+    init_static_assets(app)
+
     # Registra le route (Blueprint)
     from . import routes
     app.register_blueprint(routes.main)
 
+    # Registra i comandi da riga di comando (flask migra, ...)
+    from .cli import register_commands
+    register_commands(app)
+
     return app
\ No newline at end of file
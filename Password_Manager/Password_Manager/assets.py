@@ -0,0 +1,67 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, Response, request
+
+from config import Config
+
+# Impronte dei file statici: percorso -> (mtime in ns, impronta del contenuto)
+_fingerprints: Dict[str, Tuple[int, str]] = {}
+_fingerprints_lock = threading.Lock()
+
+
+def init_static_assets(app: Flask) -> None:
+    """
+    Aggiunge a ogni url_for('static', ...) l'impronta del contenuto del file (?v=...).
+    I file richiesti con l'impronta corrente vengono serviti con una cache lunga e
+    `immutable`: un file modificato cambia impronta e quindi URL, senza dover
+    svuotare la cache dei browser.
+    """
+    def add_fingerprint(endpoint: str, values: dict) -> None:
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = static_fingerprint(app, values['filename'])
+            if fingerprint is not None:
+                values['v'] = fingerprint
+
+    def cache_fingerprinted(response: Response) -> Response:
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+        version = request.args.get('v')
+        if version is not None and version == static_fingerprint(app, request.view_args.get('filename', '')):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = Config.STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    app.url_defaults(add_fingerprint)
+    app.after_request(cache_fingerprinted)
+
+
+def static_fingerprint(app: Flask, filename: str) -> Optional[str]:
+    """
+    Impronta (SHA-256 troncato) del file statico indicato, o None se non esiste.
+    Il contenuto viene riletto solo quando cambia la data di modifica del file.
+    """
+    path = os.path.realpath(os.path.join(app.static_folder, filename))
+    if not path.startswith(os.path.realpath(app.static_folder) + os.sep):
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(path, 'rb') as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return None
+    with _fingerprints_lock:
+        _fingerprints[path] = (mtime, fingerprint)
+    return fingerprint
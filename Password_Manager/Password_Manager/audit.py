@@ -0,0 +1,74 @@
+import logging
+from typing import Iterator, NamedTuple
+
+from config import Config
+from .database import DatabaseManager
+from .core.cryptography import CipherContext
+from .core.strength import PasswordStrength, StrengthReport
+from .services import PasswordService
+
+
+class AuditFinding(NamedTuple):
+    """Esito del controllo di una voce del vault (senza la password in chiaro)"""
+    id: int
+    nome_sito: str
+    username_sito: str
+    report: StrengthReport
+    reused: bool  # la stessa password è usata anche in altre voci
+    stale: bool  # non modificata da più di PASSWORD_MAX_AGE_DAYS giorni
+    
+    @property
+    def has_issues(self) -> bool:
+        return self.report.is_weak or self.report.is_breached or self.reused or self.stale
+
+
+class VaultAuditService:
+    """
+    Controllo di sicurezza dell'intero vault: robustezza di ogni password, presenza
+    nel corpus locale delle violazioni, riutilizzi ed età.
+    
+    Le voci sono lette e decifrate a blocchi di AUDIT_BATCH_SIZE in ordine di id e i
+    risultati sono restituiti man mano, così la memoria usata non dipende dalla
+    dimensione del vault e le password in chiaro non vengono mai accumulate.
+    """
+    
+    @staticmethod
+    def audit_vault(user_id: int, master_key: bytes) -> Iterator[AuditFinding]:
+        """
+        Controlla tutte le voci dell'utente; le voci non decifrabili vengono saltate.
+        Solleva ValueError o OSError se il corpus delle violazioni non è leggibile.
+        """
+        cipher = CipherContext(master_key)
+        # I riutilizzi si ricavano dalle impronte con una sola aggregazione, prima di decifrare
+        reused = PasswordService.get_reused_fingerprints(user_id)
+        conn = DatabaseManager.get_connection(user_id)
+        last_id = 0
+        unreadable = 0
+        
+        while True:
+            with conn:
+                rows = conn.execute(
+                    "SELECT id, nome_sito, username_sito, metadati_cifrati, password_sito_encrypted, impronta_password, "
+                    "data_modifica < datetime('now', ?) AS vecchia "
+                    "FROM password_salvate WHERE utente_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (f'-{Config.PASSWORD_MAX_AGE_DAYS} days', user_id, last_id, Config.AUDIT_BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            
+            for row in rows:
+                try:
+                    site_name, site_username = PasswordService.entry_metadata(row, cipher)
+                    site_password = cipher.decrypt(row['password_sito_encrypted'])
+                except ValueError:
+                    unreadable += 1
+                    continue
+                # Fuori dal try: un corpus delle violazioni danneggiato o illeggibile interrompe
+                # il controllo (ValueError/OSError) invece di passare per voci non decifrabili
+                report = PasswordStrength.check(site_password)
+                yield AuditFinding(row['id'], site_name, site_username, report,
+                                   row['impronta_password'] in reused, bool(row['vecchia']))
+        
+        if unreadable:
+            logging.warning(f"Controllo del vault dell'utente {user_id}: {unreadable} voci non decifrabili saltate")
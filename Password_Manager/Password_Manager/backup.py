@@ -0,0 +1,408 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import secrets
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from config import Config
+from .core.cryptography import NONCE_LENGTH, CryptographyManager
+from .core.kdf import KeyDerivation
+from .database import MAIN_SHARD, DatabaseManager
+from .shards import shard_label
+
+# Intestazione del manifest di ogni backup
+BACKUP_FORMAT = 'password-manager-backup'
+BACKUP_VERSION = 1
+# Testo noto cifrato nel manifest: una passphrase sbagliata viene rifiutata prima di leggere i dati
+BACKUP_CHECK = b'password-manager-backup-check'
+MANIFEST_NAME = 'manifest.json'
+
+# Impronta di una pagina del database: SHA-256 troncato, per riconoscere le pagine cambiate
+PAGE_DIGEST_LENGTH = 16
+# Impronte per blocco nel file delle impronte
+DIGESTS_PER_CHUNK = 65536
+
+# Lunghezza di un blocco nei file dei dati (0 chiude il file) e numero di pagina di un record
+_CHUNK_HEADER = struct.Struct('>I')
+_PAGE_NUMBER = struct.Struct('>I')
+
+
+class BackupInfo(NamedTuple):
+    """Backup presente in BACKUP_DIRECTORY, come descritto dal suo manifest"""
+    name: str
+    kind: str  # 'completo' o 'incrementale'
+    base: Optional[str]  # backup precedente della catena (None per un completo)
+    created: str
+    compressed: bool
+    encryption: Optional[Dict]  # KDF, salt e testo di verifica; None se il backup non è cifrato
+    shards: Dict[str, Dict]  # per shard: pagine, dimensione delle pagine, pagine salvate, sha256
+
+
+class BackupService:
+    """
+    Backup online dei database (principale e shard) a pagine, senza fermare il servizio.
+
+    Ogni shard viene copiato con l'API di backup di SQLite in un unico passo: in modalità WAL
+    la copia legge un'istantanea e non blocca le scritture. (Una copia a più passi ricomincia
+    da capo a ogni scrittura di un'altra connessione e su un database attivo non finirebbe
+    mai.) Dalla copia si salvano tutte le pagine (backup completo) o solo quelle cambiate
+    rispetto al backup precedente, riconosciute dalle impronte salvate con esso (backup
+    incrementale). Le pagine sono scritte a blocchi,
+    compressi con zlib e cifrati con AES-GCM usando una chiave derivata dalla passphrase.
+
+    Un backup è una cartella in BACKUP_DIRECTORY con un manifest; il ripristino a un backup
+    ricostruisce i file applicando in ordine la catena dal completo su cui si basa, e li
+    verifica con lo SHA-256 del manifest e con `PRAGMA integrity_check`.
+    """
+
+    @staticmethod
+    def create(passphrase: Optional[str], full: bool = False) -> BackupInfo:
+        """
+        Esegue un backup di tutti gli shard: incrementale rispetto all'ultimo, se esiste e la
+        catena è più corta di BACKUP_MAX_CHAIN, altrimenti (o con `full`) completo.
+        Senza passphrase il backup è solo compresso. Solleva ValueError se la passphrase
+        non apre l'ultimo backup da cui partire, o se manca e quel backup è cifrato.
+        """
+        base = None
+        backups = BackupService.list_backups()
+        if not full and backups:
+            try:
+                if len(BackupService._chain(backups[-1].name)) < Config.BACKUP_MAX_CHAIN:
+                    base = backups[-1]
+            except ValueError as e:
+                logging.warning(f"Catena dell'ultimo backup non utilizzabile, si esegue un backup completo: {e}")
+        if base is not None and base.encryption is not None and not passphrase:
+            # Le impronte delle pagine del backup di partenza sono cifrate: senza passphrase
+            # non si possono leggere, e il backup in chiaro deve partire da uno completo
+            raise ValueError(f"L'ultimo backup {base.name} è cifrato: un backup senza cifratura "
+                             f"deve essere completo")
+        base_key = BackupService._open_key(base, passphrase) if base else None
+
+        encryption = None
+        archive_key = None
+        if passphrase:
+            salt = CryptographyManager.generate_salt()
+            algorithm, params = KeyDerivation.default_algorithm(), KeyDerivation.default_params()
+            archive_key = BackupService._derive_key(passphrase, salt, algorithm, params)
+            nonce = secrets.token_bytes(NONCE_LENGTH)
+            encryption = {
+                'kdf': {'algoritmo': algorithm, 'parametri': params},
+                'salt': base64.b64encode(salt).decode(),
+                'verifica': base64.b64encode(nonce + archive_key.encrypt(nonce, BACKUP_CHECK, b'verifica')).decode(),
+            }
+
+        # Microsecondi nel nome: due backup nello stesso secondo non si sovrappongono e
+        # l'ordine alfabetico resta quello cronologico
+        name = datetime.now().strftime('%Y%m%d-%H%M%S-%f') + ('-incrementale' if base else '-completo')
+        directory = os.path.join(Config.BACKUP_DIRECTORY, name)
+        temp_directory = directory + '.tmp'
+        os.makedirs(temp_directory)
+
+        def backup_shard(shard: str) -> Tuple[str, Dict]:
+            base_digests = None
+            if base is not None and shard_label(shard) in base.shards:
+                base_digests = BackupService._read_digests(base, shard_label(shard), base_key)
+            return shard_label(shard), BackupService._backup_shard(shard, temp_directory, archive_key, base_digests)
+
+        try:
+            with ThreadPoolExecutor(max_workers=Config.DB_MAINTENANCE_WORKERS, thread_name_prefix='backup') as executor:
+                shards = dict(executor.map(backup_shard, DatabaseManager.list_shards()))
+
+            manifest = {
+                'formato': BACKUP_FORMAT,
+                'versione': BACKUP_VERSION,
+                'tipo': 'incrementale' if base else 'completo',
+                'base': base.name if base else None,
+                'data': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'compressione': Config.BACKUP_COMPRESSION_LEVEL > 0,
+                'cifratura': encryption,
+                'shard': shards,
+            }
+            with open(os.path.join(temp_directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+            # Solo una cartella completa di manifest diventa visibile come backup
+            os.rename(temp_directory, directory)
+        except BaseException:
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            raise
+
+        return BackupService._info(name, manifest)
+
+    @staticmethod
+    def list_backups() -> List[BackupInfo]:
+        """Backup completati, dal più vecchio al più recente"""
+        if not os.path.isdir(Config.BACKUP_DIRECTORY):
+            return []
+        backups = []
+        for name in sorted(os.listdir(Config.BACKUP_DIRECTORY)):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                backups.append(BackupService._info(name, BackupService._read_manifest(name)))
+            except (OSError, ValueError):
+                continue
+        return backups
+
+    @staticmethod
+    def restore(name: str, destination: str, passphrase: Optional[str]) -> List[str]:
+        """
+        Ricostruisce in `destination` i database com'erano al backup `name`, con la stessa
+        disposizione di DATABASE e DB_SHARD_DIRECTORY, e li verifica. Non tocca i database in
+        uso: i file ripristinati vanno sostituiti a servizio fermo. Restituisce i percorsi creati.
+        Solleva ValueError se la catena è incompleta, la passphrase è errata o la verifica fallisce.
+        """
+        chain = BackupService._chain(name)
+        keys = [BackupService._open_key(backup, passphrase) for backup in chain]
+        target = chain[-1]
+
+        paths = {}
+        for label in target.shards:
+            shard = MAIN_SHARD if label == shard_label(MAIN_SHARD) else label
+            if shard == MAIN_SHARD:
+                path = os.path.join(destination, os.path.basename(Config.DATABASE))
+            else:
+                path = os.path.join(destination, os.path.basename(Config.DB_SHARD_DIRECTORY), f'{shard}.db')
+            if os.path.exists(path):
+                raise ValueError(f"{path} esiste già: scegliere una destinazione vuota")
+            paths[label] = path
+
+        for label, path in paths.items():
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w+b') as output:
+                # Uno shard assente da un backup intermedio era stato eliminato: si riparte da vuoto
+                for backup, key in zip(chain, keys):
+                    if label not in backup.shards:
+                        output.truncate(0)
+                        continue
+                    page_size = backup.shards[label]['dimensione_pagina']
+                    for page_number, page in BackupService._read_pages(backup, label, key):
+                        output.seek(page_number * page_size)
+                        output.write(page)
+                    output.truncate(backup.shards[label]['pagine'] * page_size)
+            BackupService._verify_file(path, target.shards[label]['sha256'])
+
+        return list(paths.values())
+
+    @staticmethod
+    def verify(name: str, passphrase: Optional[str]) -> int:
+        """Ripristina il backup in una cartella temporanea per verificarlo; restituisce i database controllati"""
+        with tempfile.TemporaryDirectory(prefix='verifica-backup-') as destination:
+            return len(BackupService.restore(name, destination, passphrase))
+
+    @staticmethod
+    def _backup_shard(shard: str, directory: str, archive_key: Optional[AESGCM],
+                      base_digests: Optional[List[bytes]]) -> Dict:
+        """Copia online di uno shard e salvataggio delle sue pagine (tutte o solo quelle cambiate)"""
+        label = shard_label(shard)
+        copy_path = os.path.join(directory, f'.{label}.copia.db')
+        source = DatabaseManager.open_connection(DatabaseManager.shard_path(shard))
+        copy = sqlite3.connect(copy_path)
+        try:
+            source.backup(copy)
+            # Tutto nel file principale, senza WAL: il file è l'immagine esatta delle pagine
+            copy.execute('PRAGMA journal_mode = DELETE')
+            page_size = copy.execute('PRAGMA page_size').fetchone()[0]
+        finally:
+            copy.close()
+            source.close()
+
+        digests: List[bytes] = []
+        file_hash = hashlib.sha256()
+        saved = 0
+
+        def changed_pages() -> Iterator[bytes]:
+            nonlocal saved
+            with open(copy_path, 'rb') as f:
+                page_number = 0
+                while True:
+                    page = f.read(page_size)
+                    if not page:
+                        break
+                    file_hash.update(page)
+                    digest = hashlib.sha256(page).digest()[:PAGE_DIGEST_LENGTH]
+                    digests.append(digest)
+                    if base_digests is None or page_number >= len(base_digests) or base_digests[page_number] != digest:
+                        saved += 1
+                        yield _PAGE_NUMBER.pack(page_number) + page
+                    page_number += 1
+
+        try:
+            data_file = f'{label}.pagine'
+            BackupService._write_stream(
+                os.path.join(directory, data_file), data_file, archive_key,
+                _batched(changed_pages(), Config.BACKUP_CHUNK_PAGES)
+            )
+            BackupService._write_stream(
+                os.path.join(directory, f'{label}.impronte'), f'{label}.impronte', archive_key,
+                _batched(iter(digests), DIGESTS_PER_CHUNK)
+            )
+        finally:
+            os.remove(copy_path)
+
+        return {
+            'file': data_file,
+            'pagine': len(digests),
+            'dimensione_pagina': page_size,
+            'pagine_salvate': saved,
+            'sha256': file_hash.hexdigest(),
+        }
+
+    @staticmethod
+    def _write_stream(path: str, name: str, key: Optional[AESGCM], chunks: Iterable[bytes]) -> None:
+        """
+        Scrive blocchi compressi ed eventualmente cifrati, ciascuno preceduto dalla lunghezza.
+        Nome del file e indice del blocco sono dati autenticati: blocchi scambiati o spostati
+        da un altro file vengono rifiutati.
+        """
+        with open(path, 'wb') as f:
+            for index, chunk in enumerate(chunks):
+                if Config.BACKUP_COMPRESSION_LEVEL > 0:
+                    chunk = zlib.compress(chunk, Config.BACKUP_COMPRESSION_LEVEL)
+                if key is not None:
+                    nonce = secrets.token_bytes(NONCE_LENGTH)
+                    chunk = nonce + key.encrypt(nonce, chunk, f'{name}:{index}'.encode())
+                f.write(_CHUNK_HEADER.pack(len(chunk)) + chunk)
+            # Terminatore: un file troncato si riconosce anche senza cifratura
+            f.write(_CHUNK_HEADER.pack(0))
+
+    @staticmethod
+    def _read_stream(path: str, name: str, key: Optional[AESGCM], compressed: bool) -> Iterator[bytes]:
+        """Legge i blocchi scritti da _write_stream"""
+        with open(path, 'rb') as f:
+            index = 0
+            while True:
+                chunk = BackupService._read_exact(f, _CHUNK_HEADER.size)
+                length = _CHUNK_HEADER.unpack(chunk)[0]
+                if length == 0:
+                    return
+                chunk = BackupService._read_exact(f, length)
+                try:
+                    if key is not None:
+                        chunk = key.decrypt(chunk[:NONCE_LENGTH], chunk[NONCE_LENGTH:], f'{name}:{index}'.encode())
+                    if compressed:
+                        chunk = zlib.decompress(chunk)
+                except Exception as e:
+                    raise ValueError(f"Blocco {index} di {name} danneggiato o alterato") from e
+                yield chunk
+                index += 1
+
+    @staticmethod
+    def _read_exact(f: BinaryIO, length: int) -> bytes:
+        data = f.read(length)
+        if len(data) != length:
+            raise ValueError(f"File di backup troncato: {f.name}")
+        return data
+
+    @staticmethod
+    def _read_pages(backup: BackupInfo, label: str, key: Optional[AESGCM]) -> Iterator[Tuple[int, bytes]]:
+        """Pagine di uno shard salvate in un backup, come coppie (numero di pagina, contenuto)"""
+        data_file = backup.shards[label]['file']
+        record_size = _PAGE_NUMBER.size + backup.shards[label]['dimensione_pagina']
+        path = os.path.join(Config.BACKUP_DIRECTORY, backup.name, data_file)
+        for chunk in BackupService._read_stream(path, data_file, key, backup.compressed):
+            for offset in range(0, len(chunk), record_size):
+                yield _PAGE_NUMBER.unpack_from(chunk, offset)[0], chunk[offset + _PAGE_NUMBER.size:offset + record_size]
+
+    @staticmethod
+    def _read_digests(backup: BackupInfo, label: str, key: Optional[AESGCM]) -> List[bytes]:
+        """Impronte delle pagine di uno shard com'erano al momento del backup"""
+        path = os.path.join(Config.BACKUP_DIRECTORY, backup.name, f'{label}.impronte')
+        digests = []
+        for chunk in BackupService._read_stream(path, f'{label}.impronte', key, backup.compressed):
+            digests.extend(chunk[offset:offset + PAGE_DIGEST_LENGTH] for offset in range(0, len(chunk), PAGE_DIGEST_LENGTH))
+        return digests
+
+    @staticmethod
+    def _verify_file(path: str, expected_sha256: str) -> None:
+        """Confronta il file ricostruito con l'originale e ne controlla l'integrità con SQLite"""
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                file_hash.update(block)
+        if file_hash.hexdigest() != expected_sha256:
+            raise ValueError(f"{path}: il contenuto ripristinato non corrisponde al backup")
+
+        conn = sqlite3.connect(path)
+        try:
+            problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        finally:
+            conn.close()
+        if problems != ['ok']:
+            raise ValueError(f"{path}: verifica di integrità fallita: {'; '.join(problems[:5])}")
+
+    @staticmethod
+    def _chain(name: str) -> List[BackupInfo]:
+        """Backup da applicare in ordine per ricostruire `name`, a partire dal completo"""
+        chain = []
+        current: Optional[str] = name
+        while current is not None:
+            try:
+                info = BackupService._info(current, BackupService._read_manifest(current))
+            except OSError as e:
+                raise ValueError(f"Backup {current} mancante: la catena di {name} è incompleta") from e
+            chain.append(info)
+            current = info.base
+        return chain[::-1]
+
+    @staticmethod
+    def _open_key(backup: BackupInfo, passphrase: Optional[str]) -> Optional[AESGCM]:
+        """Chiave di un backup cifrato, verificata con il testo noto del manifest"""
+        encryption = backup.encryption
+        if encryption is None:
+            return None
+        if not passphrase:
+            raise ValueError(f"Il backup {backup.name} è cifrato: serve la passphrase")
+        key = BackupService._derive_key(
+            passphrase, base64.b64decode(encryption['salt']),
+            encryption['kdf']['algoritmo'], encryption['kdf']['parametri']
+        )
+        check = base64.b64decode(encryption['verifica'])
+        try:
+            key.decrypt(check[:NONCE_LENGTH], check[NONCE_LENGTH:], b'verifica')
+        except Exception as e:
+            raise ValueError(f"Passphrase non valida per il backup {backup.name}") from e
+        return key
+
+    @staticmethod
+    def _derive_key(passphrase: str, salt: bytes, algorithm: str, params: Dict[str, int]) -> AESGCM:
+        return AESGCM(base64.urlsafe_b64decode(CryptographyManager.derive_key(passphrase, salt, algorithm, params)))
+
+    @staticmethod
+    def _read_manifest(name: str) -> Dict:
+        with open(os.path.join(Config.BACKUP_DIRECTORY, name, MANIFEST_NAME), encoding='utf-8') as f:
+            try:
+                manifest = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Manifest del backup {name} non valido") from e
+        if manifest.get('formato') != BACKUP_FORMAT or manifest.get('versione') != BACKUP_VERSION:
+            raise ValueError(f"Formato del backup {name} non supportato")
+        return manifest
+
+    @staticmethod
+    def _info(name: str, manifest: Dict) -> BackupInfo:
+        return BackupInfo(name, manifest['tipo'], manifest['base'], manifest['data'],
+                          manifest['compressione'], manifest['cifratura'], manifest['shard'])
+
+
+def _batched(items: Iterator[bytes], size: int) -> Iterator[bytes]:
+    """Raggruppa i record in blocchi di `size` elementi"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield b''.join(batch)
+            batch = []
+    if batch:
+        yield b''.join(batch)
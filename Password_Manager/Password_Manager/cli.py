@@ -0,0 +1,296 @@
+import csv
+import os
+import time
+from typing import Tuple
+
+import click
+from flask import Flask
+
+from config import Config
+from .core.auth_pool import AuthWorkerPool
+from .core.kdf import KDF_ALGORITHMS, KeyDerivation
+from .core.password_generator import PasswordGenerator
+from .core.passphrase_generator import SEPARATORS, PassphraseGenerator
+from .core.strength import BreachCorpus
+from .database import MAIN_SHARD, SHARD_MODES, DatabaseManager
+from .migrations import MIGRATIONS, MigrationManager
+from .audit import VaultAuditService
+from .backup import BackupService
+from .rekey import RekeyService
+from .services import UserManager
+from .shards import ShardMaintenance, ShardMigrationService, shard_label
+from .transfer import VaultTransferService
+
+
+def unlock_vault(username: str, password: str) -> Tuple[int, bytes]:
+    """Verifica le credenziali e restituisce id dell'utente e chiave del vault."""
+    user = UserManager.get_user_by_username(username)
+    if not user or not AuthWorkerPool.check_password_hash(user['password_hash'], password):
+        raise click.ClickException('Username o password master non validi.')
+    if RekeyService.has_pending(user['id']):
+        raise click.ClickException('Cambio della password master in sospeso: accedere dal sito per completarlo.')
+    return user['id'], UserManager.get_master_key(user['id'], password)
+
+
+def register_commands(app: Flask) -> None:
+    """Registra i comandi di amministrazione disponibili tramite `flask`."""
+
+    @app.cli.command('migra')
+    def migra():
+        """Porta lo schema del database principale e di tutti gli shard all'ultima versione."""
+        for shard in DatabaseManager.list_shards():
+            conn = DatabaseManager.open_connection(DatabaseManager.shard_path(shard))
+            try:
+                applied = MigrationManager.apply_migrations(conn)
+            finally:
+                conn.close()
+            if applied:
+                click.echo(f"{shard_label(shard)}: migrazioni applicate: {', '.join(map(str, applied))}")
+            else:
+                click.echo(f"{shard_label(shard)}: già aggiornato.")
+
+    @app.cli.command('versione-schema')
+    def versione_schema():
+        """Mostra la versione corrente dello schema del database."""
+        conn = DatabaseManager.get_connection()
+        MigrationManager.ensure_version_table(conn)
+        current = MigrationManager.current_version(conn)
+        click.echo(f"Versione schema: {current} (ultima disponibile: {MIGRATIONS[-1].version})")
+
+    @app.cli.command('calibra-kdf')
+    @click.option('--algoritmo', type=click.Choice(sorted(KDF_ALGORITHMS)), default=KeyDerivation.default_algorithm(),
+                  show_default=True, help='Algoritmo di derivazione da calibrare.')
+    @click.option('--obiettivo-ms', type=float, default=250.0, show_default=True,
+                  help='Latenza desiderata per una derivazione su questa macchina.')
+    @click.option('--memoria-kib', type=int, default=65536, show_default=True,
+                  help='Memoria per derivazione (solo argon2id).')
+    @click.option('--corsie', type=int, default=4, show_default=True,
+                  help='Parallelismo (solo argon2id).')
+    def calibra_kdf(algoritmo, obiettivo_ms, memoria_kib, corsie):
+        """Sceglie i costi della KDF che rispettano la latenza obiettivo su questo host."""
+        params = KeyDerivation.calibrate(algoritmo, obiettivo_ms, memory_kib=memoria_kib, lanes=corsie)
+        elapsed = KeyDerivation.measure(algoritmo, params)
+        click.echo(f"Derivazione misurata: {elapsed:.0f} ms (obiettivo {obiettivo_ms:.0f} ms)")
+        click.echo('Impostare in config.py:')
+        click.echo(f"    KDF_ALGORITHM = '{algoritmo}'")
+        click.echo(f"    KDF_PARAMS = {params!r}")
+
+    @app.cli.command('importa')
+    @click.argument('username')
+    @click.argument('file', type=click.File('r', encoding='utf-8-sig', lazy=False))
+    @click.option('--formato', type=click.Choice(['csv', 'json']), default='csv', show_default=True,
+                  help='csv da un altro gestore, json per un\'esportazione cifrata.')
+    @click.password_option('--password-master', prompt='Password master', confirmation_prompt=False)
+    def importa(username, file, formato, password_master):
+        """Importa nel vault di USERNAME le voci contenute in FILE."""
+        user_id, master_key = unlock_vault(username, password_master)
+        try:
+            if formato == 'json':
+                passphrase = click.prompt('Passphrase dell\'esportazione', hide_input=True)
+                result = VaultTransferService.import_encrypted(user_id, file, master_key, passphrase)
+            else:
+                result = VaultTransferService.import_csv(user_id, file, master_key)
+        except (ValueError, csv.Error) as e:
+            raise click.ClickException(f'Importazione non riuscita: {e}')
+        click.echo(f"Voci importate: {result.imported}, righe saltate: {result.skipped}")
+
+    @app.cli.command('esporta')
+    @click.argument('username')
+    @click.argument('file', type=click.File('w', encoding='utf-8', atomic=True))
+    @click.password_option('--password-master', prompt='Password master', confirmation_prompt=False)
+    @click.password_option('--passphrase', prompt='Passphrase dell\'esportazione')
+    def esporta(username, file, password_master, passphrase):
+        """Esporta in FILE il vault di USERNAME, cifrato con una passphrase."""
+        if len(passphrase) < Config.MIN_PASSWORD_LENGTH:
+            raise click.ClickException(f'La passphrase deve essere di almeno {Config.MIN_PASSWORD_LENGTH} caratteri.')
+        user_id, master_key = unlock_vault(username, password_master)
+        for chunk in VaultTransferService.export_encrypted(user_id, master_key, passphrase):
+            file.write(chunk)
+        click.echo('Esportazione completata.')
+
+    @app.cli.command('genera-password')
+    @click.option('--quantita', type=click.IntRange(1, Config.PASSWORD_BATCH_MAX), default=1, show_default=True,
+                  help='Numero di password da generare.')
+    @click.option('--lunghezza', type=click.IntRange(4, Config.MAX_PASSWORD_LENGTH), default=16, show_default=True)
+    @click.option('--speciali/--senza-speciali', default=True, show_default=True, help='Caratteri speciali.')
+    @click.option('--maiuscole/--senza-maiuscole', default=True, show_default=True, help='Lettere maiuscole.')
+    @click.option('--numeri/--senza-numeri', default=True, show_default=True, help='Cifre.')
+    @click.option('--output', type=click.File('w', atomic=True), default='-',
+                  help='File di destinazione (default: standard output).')
+    def genera_password(quantita, lunghezza, speciali, maiuscole, numeri, output):
+        """Genera password casuali, una per riga."""
+        passwords = PasswordGenerator.generate_batch(quantita, lunghezza, speciali, maiuscole, numeri)
+        output.write('\n'.join(passwords) + '\n')
+
+    @app.cli.command('genera-passphrase')
+    @click.option('--parole', type=click.IntRange(Config.PASSPHRASE_MIN_WORDS, Config.PASSPHRASE_MAX_WORDS),
+                  default=Config.PASSPHRASE_DEFAULT_WORDS, show_default=True, help='Numero di parole.')
+    @click.option('--separatore', type=click.Choice(SEPARATORS), default='-', show_default=True)
+    @click.option('--maiuscole', is_flag=True, help='Iniziali maiuscole.')
+    @click.option('--numero', is_flag=True, help='Aggiunge una cifra a una parola casuale.')
+    @click.option('--quantita', type=click.IntRange(1, Config.PASSWORD_BATCH_MAX), default=1, show_default=True)
+    def genera_passphrase(parole, separatore, maiuscole, numero, quantita):
+        """Genera passphrase in stile diceware, una per riga, e ne mostra l'entropia."""
+        for _ in range(quantita):
+            passphrase = PassphraseGenerator.generate(parole, separatore, maiuscole, numero)
+            click.echo(passphrase.text)
+        click.echo(f"Entropia: {passphrase.entropy_bits:.1f} bit per passphrase", err=True)
+
+    @app.cli.command('prepara-corpus-violazioni')
+    @click.argument('dump', type=click.File('r', encoding='ascii', lazy=False))
+    def prepara_corpus_violazioni(dump):
+        """
+        Converte DUMP, un elenco di hash SHA-1 ordinati per hash (formato Have I Been Pwned,
+        righe HASH:OCCORRENZE), nel corpus binario usato per la verifica delle password.
+        """
+        try:
+            written = BreachCorpus.build(dump, Config.BREACH_CORPUS_PATH)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Corpus creato in {Config.BREACH_CORPUS_PATH}: {written} hash")
+
+    @app.cli.command('controlla-vault')
+    @click.argument('username')
+    @click.password_option('--password-master', prompt='Password master', confirmation_prompt=False)
+    @click.option('--tutte', is_flag=True, help='Mostra anche le voci senza problemi.')
+    def controlla_vault(username, password_master, tutte):
+        """Controlla robustezza, violazioni note, riutilizzi ed età delle password di USERNAME."""
+        user_id, master_key = unlock_vault(username, password_master)
+        total = flagged = 0
+        try:
+            for finding in VaultAuditService.audit_vault(user_id, master_key):
+                total += 1
+                report = finding.report
+                if finding.has_issues:
+                    flagged += 1
+                elif not tutte:
+                    continue
+                breaches = '-' if report.breach_count is None else report.breach_count
+                notes = [note for note, present in (('riutilizzata', finding.reused), ('vecchia', finding.stale)) if present]
+                click.echo(f"{finding.id}\t{finding.nome_sito}\t{finding.username_sito}\t"
+                           f"{report.label} ({report.entropy_bits:.0f} bit)\tviolazioni: {breaches}\t{', '.join(notes)}")
+        except (ValueError, OSError) as e:
+            raise click.ClickException(f"Controllo interrotto: {e}")
+        click.echo(f"Voci controllate: {total}, da rivedere: {flagged}", err=True)
+
+    @app.cli.command('dividi-database')
+    @click.option('--modalita', type=click.Choice([mode for mode in SHARD_MODES if mode != 'nessuno']),
+                  help='utente: un file per vault; hash: DB_SHARD_COUNT file condivisi (default: DB_SHARD_MODE).')
+    def dividi_database(modalita):
+        """Sposta negli shard i vault ancora nel database principale (a servizio fermo)."""
+        modalita = modalita or Config.DB_SHARD_MODE
+        if modalita == 'nessuno':
+            raise click.ClickException('Indicare --modalita utente o hash, o impostare DB_SHARD_MODE.')
+        if modalita != Config.DB_SHARD_MODE:
+            click.echo(f"Attenzione: i nuovi utenti seguono DB_SHARD_MODE ('{Config.DB_SHARD_MODE}').", err=True)
+
+        def progress(done: int, total: int) -> None:
+            if done % 100 == 0 or done == total:
+                click.echo(f"Utenti elaborati: {done}/{total}", err=True)
+
+        result = ShardMigrationService.split_database(modalita, progress)
+        click.echo(f"Utenti spostati: {result.moved_users}, voci spostate: {result.moved_entries}")
+        if result.failed_users:
+            raise click.ClickException(
+                f"Utenti rimasti nel database principale: {', '.join(map(str, result.failed_users))}"
+            )
+        click.echo('Eseguire `flask manutenzione-shard vacuum` per recuperare lo spazio nel database principale.')
+
+    @app.cli.command('sposta-utente')
+    @click.argument('username')
+    @click.argument('shard')
+    def sposta_utente(username, shard):
+        """Sposta il vault di USERNAME nello SHARD indicato ('principale' per il database principale)."""
+        user_id = DatabaseManager.find_user_id(username)
+        if user_id is None:
+            raise click.ClickException('Utente non trovato.')
+        target = MAIN_SHARD if shard == shard_label(MAIN_SHARD) else shard
+        if os.path.basename(target) != target or target.startswith('.'):
+            raise click.ClickException('Nome dello shard non valido.')
+        try:
+            moved = ShardMigrationService.move_user(user_id, target)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Vault di {username} nello shard {shard_label(target)}: {moved} voci spostate")
+
+    @app.cli.command('manutenzione-shard')
+    @click.argument('operazione', type=click.Choice(['backup', 'vacuum', 'verifica']))
+    @click.option('--destinazione', default='backup', show_default=True,
+                  help='Cartella in cui creare i backup (una sottocartella per esecuzione).')
+    @click.option('--worker', type=click.IntRange(1), default=Config.DB_MAINTENANCE_WORKERS, show_default=True,
+                  help='Shard elaborati in parallelo.')
+    def manutenzione_shard(operazione, destinazione, worker):
+        """Esegue backup, vacuum o verifica dell'integrità su tutti gli shard in parallelo."""
+        if operazione == 'backup':
+            operation = ShardMaintenance.backup(os.path.join(destinazione, time.strftime('%Y%m%d-%H%M%S')))
+        elif operazione == 'vacuum':
+            operation = ShardMaintenance.vacuum
+        else:
+            operation = ShardMaintenance.check
+        results = ShardMaintenance.run(operation, workers=worker)
+        for result in results:
+            click.echo(f"{shard_label(result.shard)}\t{'ok' if result.ok else 'ERRORE'}\t{result.detail}")
+        failed = sum(1 for result in results if not result.ok)
+        if failed:
+            raise click.ClickException(f"Operazione non riuscita su {failed} shard su {len(results)}.")
+
+    @app.cli.command('backup')
+    @click.option('--completo', is_flag=True, help='Backup completo anche se è possibile uno incrementale.')
+    @click.option('--passphrase', envvar='PASSWORD_MANAGER_BACKUP_PASSPHRASE', default='',
+                  help='Cifra il backup (anche dalla variabile PASSWORD_MANAGER_BACKUP_PASSPHRASE; chiesta se assente).')
+    @click.option('--senza-cifratura', is_flag=True,
+                  help='Backup solo compresso: contiene comunque username e sessioni.')
+    def backup(completo, passphrase, senza_cifratura):
+        """Backup online di tutti i database, incrementale rispetto all'ultimo quando possibile."""
+        if senza_cifratura:
+            passphrase = None
+        elif not passphrase:
+            passphrase = click.prompt('Passphrase del backup', hide_input=True, confirmation_prompt=True)
+        if passphrase is not None and len(passphrase) < Config.MIN_PASSWORD_LENGTH:
+            raise click.ClickException(f'La passphrase deve essere di almeno {Config.MIN_PASSWORD_LENGTH} caratteri.')
+        try:
+            info = BackupService.create(passphrase, full=completo)
+        except ValueError as e:
+            raise click.ClickException(f'Backup non riuscito: {e}')
+        saved = sum(shard['pagine_salvate'] for shard in info.shards.values())
+        total = sum(shard['pagine'] for shard in info.shards.values())
+        click.echo(f"Backup {info.kind} {info.name}: {len(info.shards)} database, {saved} pagine salvate su {total}")
+
+    @app.cli.command('elenca-backup')
+    def elenca_backup():
+        """Elenca i backup disponibili, dal più vecchio al più recente."""
+        for info in BackupService.list_backups():
+            details = f"base {info.base}" if info.base else 'completo'
+            click.echo(f"{info.name}\t{info.created}\t{details}\t{'cifrato' if info.encryption else 'non cifrato'}")
+
+    @app.cli.command('ripristina-backup')
+    @click.argument('nome')
+    @click.argument('destinazione', type=click.Path(file_okay=False))
+    @click.option('--passphrase', envvar='PASSWORD_MANAGER_BACKUP_PASSPHRASE', default='',
+                  help='Passphrase dei backup cifrati (anche dalla variabile PASSWORD_MANAGER_BACKUP_PASSPHRASE).')
+    def ripristina_backup(nome, destinazione, passphrase):
+        """Ricostruisce e verifica in DESTINAZIONE i database com'erano al backup NOME."""
+        try:
+            paths = BackupService.restore(nome, destinazione, passphrase or None)
+        except ValueError as e:
+            raise click.ClickException(f'Ripristino non riuscito: {e}')
+        for path in paths:
+            click.echo(path)
+        click.echo('Database ripristinati e verificati: sostituirli a quelli in uso a servizio fermo.')
+
+    @app.cli.command('verifica-backup')
+    @click.argument('nome', required=False)
+    @click.option('--passphrase', envvar='PASSWORD_MANAGER_BACKUP_PASSPHRASE', default='',
+                  help='Passphrase dei backup cifrati (anche dalla variabile PASSWORD_MANAGER_BACKUP_PASSPHRASE).')
+    def verifica_backup(nome, passphrase):
+        """Prova il ripristino del backup NOME (default: l'ultimo) in una cartella temporanea."""
+        if nome is None:
+            backups = BackupService.list_backups()
+            if not backups:
+                raise click.ClickException('Nessun backup disponibile.')
+            nome = backups[-1].name
+        try:
+            checked = BackupService.verify(nome, passphrase or None)
+        except ValueError as e:
+            raise click.ClickException(f'Verifica del backup {nome} non riuscita: {e}')
+        click.echo(f"Backup {nome} verificato: {checked} database ripristinabili")
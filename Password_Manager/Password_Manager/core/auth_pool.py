@@ -0,0 +1,109 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config import Config
+from . import metrics
+from .kdf import KeyDerivation
+
+
+class AuthBusyError(RuntimeError):
+    """Troppe operazioni di autenticazione in attesa: la richiesta va ritentata più tardi"""
+
+
+class AuthWorkerPool:
+    """
+    Esegue hash delle password e derivazione delle chiavi in un pool di processi.
+    
+    Sono operazioni CPU-bound volutamente lente: eseguirle in processi separati le
+    distribuisce sui core e non trattiene il GIL dei thread che servono le richieste.
+    Il numero di operazioni in coda è limitato; oltre il limite si solleva AuthBusyError.
+    """
+    
+    _executor: Optional[ProcessPoolExecutor] = None
+    _lock = threading.Lock()
+    _slots: Optional[threading.BoundedSemaphore] = None
+    
+    @staticmethod
+    def _get_executor() -> ProcessPoolExecutor:
+        with AuthWorkerPool._lock:
+            if AuthWorkerPool._executor is None:
+                AuthWorkerPool._executor = ProcessPoolExecutor(max_workers=Config.AUTH_WORKERS)
+                AuthWorkerPool._slots = threading.BoundedSemaphore(Config.AUTH_MAX_PENDING)
+            return AuthWorkerPool._executor
+    
+    @staticmethod
+    def submit(function: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Accoda un'operazione nel pool e ne restituisce il Future.
+        Solleva AuthBusyError se la coda resta piena oltre AUTH_QUEUE_TIMEOUT.
+        """
+        if Config.AUTH_WORKERS <= 0:
+            # Pool disattivato: esecuzione diretta nel thread chiamante
+            future: Future = Future()
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        
+        executor = AuthWorkerPool._get_executor()
+        slots = AuthWorkerPool._slots
+        if not slots.acquire(timeout=Config.AUTH_QUEUE_TIMEOUT):
+            raise AuthBusyError("Troppe richieste di autenticazione in corso")
+        try:
+            future = executor.submit(function, *args, **kwargs)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+    
+    @staticmethod
+    def run(function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Esegue un'operazione nel pool attendendone il risultato"""
+        return AuthWorkerPool.submit(function, *args, **kwargs).result()
+    
+    @staticmethod
+    @metrics.instrumented('hash', 'password_manager_password_hashes_total')
+    def check_password_hash(password_hash: str, password: str) -> bool:
+        """Verifica una password contro il suo hash di login"""
+        return AuthWorkerPool.run(check_password_hash, password_hash, password)
+    
+    @staticmethod
+    @metrics.instrumented('hash', 'password_manager_password_hashes_total')
+    def generate_password_hash(password: str) -> str:
+        """Calcola l'hash di login di una password con il metodo configurato"""
+        return AuthWorkerPool.run(generate_password_hash, password, Config.PASSWORD_HASH_METHOD)
+    
+    @staticmethod
+    @metrics.instrumented('kdf', 'password_manager_kdf_calls_total')
+    def derive_key(password: str, salt: bytes, algorithm: Optional[str] = None,
+                   params: Optional[Dict[str, int]] = None) -> bytes:
+        """Deriva una chiave dalla password (vedi KeyDerivation.derive)"""
+        # Algoritmo e costi vanno risolti qui: il processo di lavoro potrebbe avere un'altra Config
+        algorithm = algorithm or KeyDerivation.default_algorithm()
+        params = params if params is not None else KeyDerivation.default_params()
+        return AuthWorkerPool.run(KeyDerivation.derive, password, salt, algorithm, params)
+    
+    @staticmethod
+    def shutdown() -> None:
+        """Termina i processi del pool"""
+        with AuthWorkerPool._lock:
+            if AuthWorkerPool._executor is not None:
+                AuthWorkerPool._executor.shutdown()
+            AuthWorkerPool._executor = None
+    
+    @staticmethod
+    def _reset_after_fork() -> None:
+        # Un processo figlio non può usare il pool del padre: ne creerà uno proprio
+        AuthWorkerPool._executor = None
+        AuthWorkerPool._slots = None
+        AuthWorkerPool._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=AuthWorkerPool._reset_after_fork)
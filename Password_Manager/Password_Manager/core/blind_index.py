@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import unicodedata
+from typing import List, Set
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Lunghezza dei token salvati: 128 bit bastano a rendere trascurabili le collisioni nel vault di un utente
+TOKEN_LENGTH = 16
+# Lunghezza degli n-grammi per la ricerca di sottostringhe
+NGRAM_LENGTH = 3
+
+# Prefissi che distinguono i tipi di token, così uno stesso testo produce token diversi
+_EXACT_SITE = b'sito:'
+_EXACT_USERNAME = b'utente:'
+_NGRAM = b'ngramma:'
+_PREFIX = b'prefisso:'
+_PASSWORD = b'password:'
+
+
+class BlindIndex:
+    """
+    Indice cieco per cercare nei metadati cifrati del vault.
+
+    Ogni voce è indicizzata con token HMAC calcolati con una chiave derivata dalla
+    chiave del vault: uguaglianza esatta di nome sito e username, n-grammi (per le
+    sottostringhe) e prefissi più corti di un n-gramma. Nel database finiscono solo i
+    token, che senza la chiave non rivelano il testo da cui sono stati calcolati.
+    """
+
+    def __init__(self, master_key: bytes):
+        self._key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'password-manager/blind-index/v1',
+        ).derive(base64.urlsafe_b64decode(master_key))
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Forma canonica usata per indicizzare e cercare: ricerca senza distinzione di maiuscole"""
+        return unicodedata.normalize('NFKC', text).casefold().strip()
+
+    def entry_tokens(self, site_name: str, site_username: str) -> Set[bytes]:
+        """Token con cui indicizzare una voce"""
+        site_name = self.normalize(site_name)
+        site_username = self.normalize(site_username)
+        tokens = {self._token(_EXACT_SITE, site_name), self._token(_EXACT_USERNAME, site_username)}
+        for text in (site_name, site_username):
+            tokens.update(self._token(_NGRAM, ngram) for ngram in self._ngrams(text))
+            tokens.update(self._token(_PREFIX, text[:length]) for length in range(1, min(len(text), NGRAM_LENGTH - 1) + 1))
+        return tokens
+
+    def search_tokens(self, search: str) -> List[bytes]:
+        """
+        Token che una voce deve avere tutti per corrispondere alla ricerca: gli n-grammi
+        della stringa cercata, o il prefisso se è più corta di un n-gramma.
+        Gli n-grammi possono dare falsi positivi, da scartare dopo aver decifrato i metadati.
+        """
+        search = self.normalize(search)
+        if len(search) < NGRAM_LENGTH:
+            return [self._token(_PREFIX, search)]
+        return sorted({self._token(_NGRAM, ngram) for ngram in self._ngrams(search)})
+
+    def site_token(self, site_name: str) -> bytes:
+        """Token di uguaglianza esatta sul nome del sito"""
+        return self._token(_EXACT_SITE, self.normalize(site_name))
+
+    def password_fingerprint(self, password: str) -> bytes:
+        """
+        Impronta della password: uguale per password identiche nello stesso vault, così i
+        riutilizzi si trovano con un GROUP BY senza decifrare nulla. Non si normalizza:
+        password che differiscono anche solo per una maiuscola sono diverse.
+        """
+        return self._token(_PASSWORD, password)
+
+    def _token(self, kind: bytes, text: str) -> bytes:
+        return hmac.new(self._key, kind + text.encode(), hashlib.sha256).digest()[:TOKEN_LENGTH]
+
+    @staticmethod
+    def _ngrams(text: str) -> Set[str]:
+        return {text[i:i + NGRAM_LENGTH] for i in range(len(text) - NGRAM_LENGTH + 1)}
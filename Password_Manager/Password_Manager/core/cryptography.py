@@ -1,16 +1,29 @@
 
 import base64
+import json
+from typing import Dict, Optional, Tuple, Union
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.fernet import Fernet
 import secrets
 
 from config import Config
+from . import metrics
+from .kdf import KeyDerivation
+
+# Valore cifrato come salvato nel database: bytes nel formato compatto versionato,
+# str nel vecchio formato (token Fernet codificato una seconda volta in base64)
+EncryptedValue = Union[str, bytes]
+
+# Primo byte del formato compatto: AES-256-GCM, nonce di 12 byte, tag in coda
+FORMAT_AES_GCM_V2 = 0x02
+NONCE_LENGTH = 12
 
 
 class CryptographyManager:
     """
-    Gestisce la crittografia delle password utilizzando PBKDF2 con SHA512 e Fernet
+    Gestisce la crittografia delle password: derivazione delle chiavi e cifratura delle voci
     """
     
     @staticmethod
@@ -19,36 +32,104 @@ class CryptographyManager:
         return secrets.token_bytes(Config.SALT_LENGTH)
     
     @staticmethod
-    def derive_key(password: str, salt: bytes) -> bytes:
+    def derive_key(password: str, salt: bytes, algorithm: Optional[str] = None,
+                   params: Optional[Dict[str, int]] = None) -> bytes:
         """
-        Deriva una chiave utilizzando PBKDF2 con SHA512
+        Deriva una chiave dalla password con l'algoritmo e i costi indicati
+        (quelli configurati per i nuovi utenti se omessi)
         """
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA512(),
-            length=32,
-            salt=salt,
-            iterations=Config.PBKDF2_ITERATIONS,
-        )
-        return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+        return KeyDerivation.derive(password, salt, algorithm, params)
+    
+    @staticmethod
+    def generate_data_key() -> bytes:
+        """Genera una chiave dati casuale con cui cifrare le password del vault"""
+        return Fernet.generate_key()
+    
+    @staticmethod
+    def wrap_key(data_key: bytes, key_encryption_key: bytes) -> bytes:
+        """Cifra la chiave dati con la chiave derivata dalla password master"""
+        return CipherContext(key_encryption_key).encrypt(data_key.decode())
     
     @staticmethod
-    def encrypt_password(password: str, master_key: bytes) -> str:
+    def unwrap_key(wrapped_key: EncryptedValue, key_encryption_key: bytes) -> bytes:
         """
-        Crittografa una password usando Fernet
+        Decifra la chiave dati con la chiave derivata dalla password master
         """
-        fernet = Fernet(master_key)
-        encrypted_password = fernet.encrypt(password.encode())
-        return base64.urlsafe_b64encode(encrypted_password).decode()
+        return CipherContext(key_encryption_key).decrypt(wrapped_key).encode()
     
     @staticmethod
-    def decrypt_password(encrypted_password: str, master_key: bytes) -> str:
+    def encrypt_password(password: str, master_key: bytes) -> bytes:
         """
-        Decrittografa una password usando Fernet
+        Crittografa una password nel formato compatto (AES-GCM)
         """
+        return CipherContext(master_key).encrypt(password)
+    
+    @staticmethod
+    def decrypt_password(encrypted_password: EncryptedValue, master_key: bytes) -> str:
+        """
+        Decrittografa una password, nel formato compatto o in quello legacy Fernet
+        """
+        return CipherContext(master_key).decrypt(encrypted_password)
+
+
+class CipherContext:
+    """
+    Cifrario legato a una singola chiave, da creare una volta e riutilizzare
+    per cifrare o decifrare molte password (es. durante una ri-crittografia).
+    
+    Scrive nel formato compatto versionato (1 byte di versione + nonce + testo
+    cifrato AES-GCM, salvato come BLOB) e legge in modo trasparente anche il
+    formato legacy Fernet codificato due volte in base64.
+    """
+    
+    def __init__(self, master_key: bytes):
+        self._fernet = Fernet(master_key)
+        # Sottochiave dedicata ad AES-GCM, per non usare lo stesso materiale con due algoritmi
+        self._aesgcm = AESGCM(HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'password-manager/aes-gcm/v2',
+        ).derive(base64.urlsafe_b64decode(master_key)))
+    
+    @metrics.instrumented('crypto', 'password_manager_encrypts_total')
+    def encrypt(self, password: str) -> bytes:
+        """Crittografa una password nel formato compatto"""
+        nonce = secrets.token_bytes(NONCE_LENGTH)
+        return bytes((FORMAT_AES_GCM_V2,)) + nonce + self._aesgcm.encrypt(nonce, password.encode(), None)
+    
+    @metrics.instrumented('crypto', 'password_manager_decrypts_total')
+    def decrypt(self, encrypted_password: EncryptedValue) -> str:
+        """Decrittografa una password in uno dei formati supportati"""
         try:
-            fernet = Fernet(master_key)
-            encrypted_data = base64.urlsafe_b64decode(encrypted_password.encode())
-            decrypted_password = fernet.decrypt(encrypted_data)
-            return decrypted_password.decode()
+            if isinstance(encrypted_password, str):
+                return self._decrypt_legacy(encrypted_password)
+            
+            if encrypted_password[:1] != bytes((FORMAT_AES_GCM_V2,)):
+                raise ValueError("Formato di cifratura sconosciuto")
+            nonce = encrypted_password[1:1 + NONCE_LENGTH]
+            return self._aesgcm.decrypt(nonce, encrypted_password[1 + NONCE_LENGTH:], None).decode()
         except Exception as e:
-            raise ValueError("Impossibile decrittografare la password") from e
\ No newline at end of file
+            raise ValueError("Impossibile decrittografare la password") from e
+    
+    def encrypt_metadata(self, site_name: str, site_username: str) -> bytes:
+        """Crittografa insieme nome del sito e username di una voce"""
+        return self.encrypt(json.dumps([site_name, site_username]))
+    
+    def decrypt_metadata(self, encrypted_metadata: bytes) -> Tuple[str, str]:
+        """Decrittografa i metadati di una voce: (nome del sito, username)"""
+        try:
+            site_name, site_username = json.loads(self.decrypt(encrypted_metadata))
+        except (TypeError, json.JSONDecodeError) as e:
+            raise ValueError("Metadati cifrati non validi") from e
+        return site_name, site_username
+    
+    def _decrypt_legacy(self, encrypted_password: str) -> str:
+        """Decrittografa il vecchio formato: token Fernet codificato di nuovo in base64"""
+        encrypted_data = base64.urlsafe_b64decode(encrypted_password.encode())
+        return self._fernet.decrypt(encrypted_data).decode()
+    
+    @staticmethod
+    def is_legacy(encrypted_password: EncryptedValue) -> bool:
+        """Indica se un valore cifrato è nel formato legacy e va migrato"""
+        return isinstance(encrypted_password, str)
@@ -0,0 +1,160 @@
+import base64
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+try:
+    # Argon2id è disponibile solo con cryptography >= 44
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:
+    Argon2id = None
+
+from config import Config
+
+KEY_LENGTH = 32
+
+
+def _derive_pbkdf2_sha512(password: bytes, salt: bytes, iterations: int) -> bytes:
+    return PBKDF2HMAC(
+        algorithm=hashes.SHA512(),
+        length=KEY_LENGTH,
+        salt=salt,
+        iterations=iterations,
+    ).derive(password)
+
+
+def _derive_scrypt(password: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return Scrypt(salt=salt, length=KEY_LENGTH, n=n, r=r, p=p).derive(password)
+
+
+def _derive_argon2id(password: bytes, salt: bytes, iterations: int, memory_cost: int, lanes: int) -> bytes:
+    return Argon2id(
+        salt=salt,
+        length=KEY_LENGTH,
+        iterations=iterations,
+        lanes=lanes,
+        memory_cost=memory_cost,
+    ).derive(password)
+
+
+def _derivation_cost(algorithm: str, params: Dict[str, int]) -> Tuple[int, int]:
+    """Stima del costo di una derivazione: (lavoro in unità dell'algoritmo, memoria in byte)"""
+    if algorithm == 'scrypt':
+        return params['n'] * params['r'] * params['p'], 128 * params['n'] * params['r']
+    if algorithm == 'argon2id':
+        return params['iterations'] * params['memory_cost'], params['memory_cost'] * 1024
+    return params['iterations'], 0
+
+
+# Algoritmi supportati: nome salvato nel database -> funzione di derivazione
+KDF_ALGORITHMS: Dict[str, Callable[..., bytes]] = {
+    'pbkdf2_sha512': _derive_pbkdf2_sha512,
+    'scrypt': _derive_scrypt,
+}
+if Argon2id is not None:
+    KDF_ALGORITHMS['argon2id'] = _derive_argon2id
+
+
+class KeyDerivation:
+    """
+    Derivazione delle chiavi dalla password master con algoritmo e costi configurabili.
+    Algoritmo e parametri sono salvati per utente, così i costi possono cambiare nel tempo.
+    """
+    
+    @staticmethod
+    def default_algorithm() -> str:
+        """Algoritmo usato per i nuovi utenti e per l'aggiornamento al login"""
+        return Config.KDF_ALGORITHM
+    
+    @staticmethod
+    def default_params() -> Dict[str, int]:
+        """Parametri di costo usati per i nuovi utenti e per l'aggiornamento al login"""
+        return dict(Config.KDF_PARAMS)
+    
+    @staticmethod
+    def validate(algorithm: object, params: object) -> None:
+        """
+        Controlla algoritmo e parametri provenienti dall'esterno prima di derivare: l'algoritmo
+        deve essere supportato, ogni parametro un intero tra 1 e KDF_MAX_COST_FACTOR volte
+        quello di riferimento, il lavoro complessivo entro lo stesso fattore e la memoria
+        entro KDF_MAX_MEMORY. Solleva ValueError altrimenti.
+        """
+        if not isinstance(algorithm, str) or algorithm not in KDF_ALGORITHMS:
+            raise ValueError(f"Algoritmo di derivazione non supportato: {algorithm}")
+        if algorithm == KeyDerivation.default_algorithm():
+            reference = KeyDerivation.default_params()
+        else:
+            reference = Config.KDF_REFERENCE_PARAMS[algorithm]
+        if not isinstance(params, dict) or set(params) != set(reference):
+            raise ValueError(f"Parametri di derivazione non validi per {algorithm}")
+        
+        factor = Config.KDF_MAX_COST_FACTOR
+        for name, value in params.items():
+            if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= reference[name] * factor:
+                raise ValueError(f"Parametro di derivazione fuori dai limiti: {name}={value!r}")
+        if algorithm == 'scrypt' and (params['n'] < 2 or params['n'] & (params['n'] - 1)):
+            raise ValueError("Il parametro n di scrypt deve essere una potenza di 2")
+        if algorithm == 'argon2id' and params['memory_cost'] < 8 * params['lanes']:
+            raise ValueError("Argon2id richiede almeno 8 KiB di memoria per corsia")
+        
+        work, memory = _derivation_cost(algorithm, params)
+        if work > _derivation_cost(algorithm, reference)[0] * factor:
+            raise ValueError(f"Costo di derivazione troppo alto (oltre {factor} volte quello configurato)")
+        if memory > Config.KDF_MAX_MEMORY:
+            raise ValueError(f"Memoria richiesta dalla derivazione troppo alta: {memory} byte")
+    
+    @staticmethod
+    def derive(password: str, salt: bytes, algorithm: Optional[str] = None,
+               params: Optional[Dict[str, int]] = None) -> bytes:
+        """
+        Deriva una chiave Fernet (32 byte codificati in base64) dalla password
+        """
+        algorithm = algorithm or KeyDerivation.default_algorithm()
+        params = params if params is not None else KeyDerivation.default_params()
+        
+        derive_function = KDF_ALGORITHMS.get(algorithm)
+        if derive_function is None:
+            raise ValueError(f"Algoritmo di derivazione non supportato: {algorithm}")
+        return base64.urlsafe_b64encode(derive_function(password.encode(), salt, **params))
+    
+    @staticmethod
+    def measure(algorithm: str, params: Dict[str, int], rounds: int = 3) -> float:
+        """Misura il tempo medio di una derivazione, in millisecondi"""
+        salt = bytes(Config.SALT_LENGTH)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            KeyDerivation.derive('calibrazione', salt, algorithm, params)
+        return (time.perf_counter() - start) * 1000 / rounds
+    
+    @staticmethod
+    def calibrate(algorithm: str, target_ms: float, memory_kib: int = 65536, lanes: int = 4) -> Dict[str, int]:
+        """
+        Sceglie i parametri di costo che si avvicinano di più alla latenza obiettivo
+        sulla macchina corrente senza superarla (almeno il costo minimo).
+        """
+        if algorithm == 'pbkdf2_sha512':
+            # Il costo è lineare nelle iterazioni: si misura un campione e si scala
+            sample = 10_000
+            elapsed = KeyDerivation.measure(algorithm, {'iterations': sample})
+            return {'iterations': max(sample, int(sample * target_ms / elapsed))}
+        
+        if algorithm == 'scrypt':
+            # n deve essere una potenza di 2: si raddoppia finché si resta nell'obiettivo
+            params = {'n': 2 ** 12, 'r': 8, 'p': 1}
+            while KeyDerivation.measure(algorithm, dict(params, n=params['n'] * 2)) <= target_ms:
+                params['n'] *= 2
+            return params
+        
+        if algorithm == 'argon2id':
+            if algorithm not in KDF_ALGORITHMS:
+                raise ValueError("Argon2id richiede cryptography >= 44")
+            # Memoria e parallelismo fissati, si aumentano i passaggi
+            params = {'iterations': 1, 'memory_cost': memory_kib, 'lanes': lanes}
+            while KeyDerivation.measure(algorithm, dict(params, iterations=params['iterations'] + 1)) <= target_ms:
+                params['iterations'] += 1
+            return params
+        
+        raise ValueError(f"Algoritmo di derivazione non supportato: {algorithm}")
@@ -0,0 +1,202 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from config import Config
+
+# Limiti superiori (secondi) degli istogrammi delle durate
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Descrizioni delle metriche esposte, nel formato testuale di Prometheus
+METRIC_HELP = {
+    'password_manager_requests_total': 'Richieste servite per endpoint e codice di stato',
+    'password_manager_request_duration_seconds': 'Durata delle richieste per endpoint',
+    'password_manager_phase_duration_seconds': 'Tempo speso in ogni fase durante una singola richiesta',
+    'password_manager_phase_seconds_total': 'Tempo totale speso in ogni fase, anche fuori dalle richieste',
+    'password_manager_decrypts_total': 'Decifrature di password e metadati',
+    'password_manager_encrypts_total': 'Cifrature di password e metadati',
+    'password_manager_kdf_calls_total': 'Derivazioni di chiavi dalla password master',
+    'password_manager_password_hashes_total': 'Calcoli e verifiche degli hash di login',
+    'password_manager_db_connections_opened_total': 'Connessioni SQLite aperte',
+    'password_manager_db_pool_acquisitions_total': 'Connessioni prese dal pool durante le richieste',
+    'password_manager_db_queries_total': 'Istruzioni SQL eseguite',
+    'password_manager_cache_requests_total': 'Letture dalle cache in memoria, per cache ed esito',
+}
+
+# Tempi per fase della richiesta in corso (None fuori da una richiesta strumentata)
+_request_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    'request_phases', default=None
+)
+# Il dizionario di una richiesta può essere aggiornato anche dai thread a cui delega lavoro
+_phases_lock = threading.Lock()
+
+LabelSet = Tuple[Tuple[str, str], ...]
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+class Histogram:
+    """Istogramma cumulativo a bucket fissi, come quelli di Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Contatori e istogrammi in memoria del processo corrente.
+
+    Con più worker ogni processo ha i propri valori: Prometheus li raccoglie da
+    ciascun worker e li somma, come per qualsiasi servizio pre-fork.
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, LabelSet], float] = {}
+        self._histograms: Dict[Tuple[str, LabelSet], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Tutte le metriche nel formato di esposizione testuale di Prometheus"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, list(h.counts), h.sum, h.buckets) for key, h in self._histograms.items()),
+                key=lambda item: item[0]
+            )
+
+        lines: List[str] = []
+        described = set()
+
+        def describe(name: str, kind: str) -> None:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {METRIC_HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value:g}')
+
+        for (name, labels), counts, total, buckets in histograms:
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def enabled() -> bool:
+    """Indica se la raccolta delle metriche è attiva (METRICS_ENABLED)"""
+    return Config.METRICS_ENABLED
+
+
+def instrumented(phase: str, counter: Optional[str] = None) -> Callable[[F], F]:
+    """
+    Decoratore che attribuisce la durata della funzione a una fase ('kdf', 'crypto', 'db',
+    ...) della richiesta in corso e del totale del processo, e incrementa `counter`.
+    A metriche disattivate aggiunge solo il controllo del flag a ogni chiamata.
+    """
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not Config.METRICS_ENABLED:
+                return function(*args, **kwargs)
+            if counter is not None:
+                registry.increment(counter)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_phase(phase, time.perf_counter() - start)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    """Attribuisce a una fase un tempo misurato altrove"""
+    phases = _request_phases.get()
+    if phases is not None:
+        with _phases_lock:
+            phases[phase] = phases.get(phase, 0.0) + seconds
+    registry.increment('password_manager_phase_seconds_total', seconds, phase=phase)
+
+
+def propagate(function: F) -> F:
+    """
+    Lega `function` al contesto corrente, così che eseguita in un altro thread (pool di
+    thread, run_in_executor) attribuisca le sue fasi alla richiesta che l'ha delegata.
+    Ogni chiamata usa una copia del contesto: le copie possono girare in parallelo e
+    condividono il dizionario dei tempi. Le fasi eseguite in parallelo si sommano.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper  # type: ignore[return-value]
+
+
+def increment(name: str, amount: float = 1, **labels: str) -> None:
+    """Incrementa un contatore, se le metriche sono attive"""
+    if Config.METRICS_ENABLED:
+        registry.increment(name, amount, **labels)
+
+
+def start_request() -> contextvars.Token:
+    """Inizia a raccogliere i tempi per fase della richiesta corrente"""
+    return _request_phases.set({})
+
+
+def finish_request(token: contextvars.Token) -> Dict[str, float]:
+    """Conclude la raccolta e restituisce i tempi per fase della richiesta"""
+    phases = _request_phases.get() or {}
+    _request_phases.reset(token)
+    with _phases_lock:
+        phases = dict(phases)
+    for phase, seconds in phases.items():
+        registry.observe('password_manager_phase_duration_seconds', seconds, phase=phase)
+    return phases
@@ -0,0 +1,116 @@
+import math
+import mmap
+import secrets
+import threading
+from array import array
+from typing import NamedTuple, Optional
+
+from config import Config
+
+# Separatori ammessi tra le parole (la stringa vuota le unisce direttamente)
+SEPARATORS = ('-', ' ', '.', '_', '')
+
+
+class Passphrase(NamedTuple):
+    """Passphrase generata con la relativa entropia"""
+    text: str
+    entropy_bits: float
+
+
+class Wordlist:
+    """
+    Elenco di parole letto da un file di testo con una parola per riga.
+    
+    Il file viene mappato in memoria solo al primo utilizzo: le pagine restano nella
+    cache del sistema operativo e sono condivise da tutti i processi worker. In memoria
+    privata c'è solo l'indice degli inizi riga, un array di interi (circa 4 byte a parola).
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._offsets: Optional[array] = None
+        self._lock = threading.Lock()
+    
+    def _load(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                return
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            
+            offsets = array('I', [0])
+            position = data.find(b'\n')
+            while position != -1:
+                offsets.append(position + 1)
+                position = data.find(b'\n', position + 1)
+            # Senza newline finale l'ultima parola termina a fine file
+            if offsets[-1] != len(data):
+                offsets.append(len(data) + 1)
+            if len(offsets) < 2:
+                raise ValueError(f"Elenco di parole vuoto: {self.path}")
+            
+            self._offsets = offsets
+            self._map = data
+    
+    def __len__(self) -> int:
+        if self._map is None:
+            self._load()
+        return len(self._offsets) - 1
+    
+    def __getitem__(self, index: int) -> str:
+        if self._map is None:
+            self._load()
+        return self._map[self._offsets[index]:self._offsets[index + 1] - 1].decode().strip()
+
+
+class PassphraseGenerator:
+    """Generatore di passphrase in stile diceware"""
+    
+    _wordlist: Optional[Wordlist] = None
+    _lock = threading.Lock()
+    
+    @classmethod
+    def wordlist(cls) -> Wordlist:
+        """Elenco di parole configurato (PASSPHRASE_WORDLIST), caricato al primo utilizzo"""
+        with cls._lock:
+            if cls._wordlist is None or cls._wordlist.path != Config.PASSPHRASE_WORDLIST:
+                cls._wordlist = Wordlist(Config.PASSPHRASE_WORDLIST)
+            return cls._wordlist
+    
+    @classmethod
+    def generate(
+        cls,
+        words: Optional[int] = None,
+        separator: str = '-',
+        capitalize: bool = False,
+        add_number: bool = False
+    ) -> Passphrase:
+        """
+        Genera una passphrase di `words` parole scelte in modo uniforme con il CSPRNG.
+        Con `add_number` una cifra casuale viene aggiunta a una parola casuale.
+        """
+        if separator not in SEPARATORS:
+            raise ValueError(f"Separatore non ammesso: {separator!r}")
+        words = max(Config.PASSPHRASE_MIN_WORDS, min(words or Config.PASSPHRASE_DEFAULT_WORDS, Config.PASSPHRASE_MAX_WORDS))
+        wordlist = cls.wordlist()
+        
+        chosen = [wordlist[secrets.randbelow(len(wordlist))] for _ in range(words)]
+        if capitalize:
+            chosen = [word.capitalize() for word in chosen]
+        if add_number:
+            position = secrets.randbelow(words)
+            chosen[position] += str(secrets.randbelow(10))
+        
+        return Passphrase(separator.join(chosen), cls.entropy_bits(words, add_number))
+    
+    @classmethod
+    def entropy_bits(cls, words: int, add_number: bool = False) -> float:
+        """
+        Entropia in bit di una passphrase, supponendo che l'attaccante conosca l'elenco
+        di parole e le opzioni usate: le maiuscole iniziali non aggiungono nulla
+        """
+        entropy = words * math.log2(len(cls.wordlist()))
+        if add_number:
+            entropy += math.log2(10 * words)
+        return entropy
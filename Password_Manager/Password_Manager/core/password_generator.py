@@ -1,7 +1,18 @@
-import random
+import functools
+import secrets
 import string
+from typing import FrozenSet, List, NamedTuple, Tuple
 from config import Config
 
+
+class Alphabet(NamedTuple):
+    """Alfabeto precalcolato per una combinazione di opzioni del generatore"""
+    classes: Tuple[FrozenSet[str], ...]  # classi di caratteri che ogni password deve contenere
+    table: bytes  # byte casuale -> carattere, per bytes.translate
+    rejected: bytes  # byte casuali da scartare perché introdurrebbero una distorsione
+    acceptance: float  # frazione dei byte casuali accettati
+
+
 class PasswordGenerator:
     """Generatore di password sicure con opzioni configurabili"""
     
@@ -18,27 +29,67 @@ class PasswordGenerator:
         """
         Genera una password casuale sicura
         """
+        return cls.generate_batch(1, length, use_special_chars, use_uppercase, use_numbers)[0]
+    
+    @classmethod
+    def generate_batch(
+        cls,
+        count: int,
+        length: int = 16,
+        use_special_chars: bool = True,
+        use_uppercase: bool = True,
+        use_numbers: bool = True
+    ) -> List[str]:
+        """
+        Genera `count` password casuali da un unico buffer di byte del CSPRNG.
+        
+        I byte sono convertiti in caratteri tutti insieme con bytes.translate; quelli oltre
+        l'ultimo multiplo della dimensione dell'alfabeto vengono scartati (rejection sampling),
+        così ogni carattere è equiprobabile. Le password che non contengono almeno un
+        carattere per ogni classe scelta vengono scartate per intero.
+        """
         length = max(4, min(length, Config.MAX_PASSWORD_LENGTH))
+        count = max(0, min(count, Config.PASSWORD_BATCH_MAX))
+        alphabet = cls._alphabet(use_special_chars, use_uppercase, use_numbers)
         
-        chars = string.ascii_lowercase
-        required_chars = [random.choice(string.ascii_lowercase)]
+        passwords: List[str] = []
+        pending = ''
+        while len(passwords) < count:
+            # Byte sufficienti per le password mancanti, tenendo conto di quelli scartati
+            missing = (count - len(passwords)) * length - len(pending)
+            random_bytes = secrets.token_bytes(int(missing / alphabet.acceptance) + 64)
+            chars = pending + random_bytes.translate(alphabet.table, alphabet.rejected).decode('ascii')
+            
+            usable = len(chars) - len(chars) % length
+            for start in range(0, usable, length):
+                candidate = chars[start:start + length]
+                if all(not char_class.isdisjoint(candidate) for char_class in alphabet.classes):
+                    passwords.append(candidate)
+                    if len(passwords) == count:
+                        break
+            pending = chars[usable:]
         
+        return passwords
+    
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _alphabet(cls, use_special_chars: bool, use_uppercase: bool, use_numbers: bool) -> Alphabet:
+        """Costruisce (una sola volta per combinazione di opzioni) la tabella dell'alfabeto"""
+        classes = [string.ascii_lowercase]
         if use_uppercase:
-            chars += string.ascii_uppercase
-            required_chars.append(random.choice(string.ascii_uppercase))
-        
+            classes.append(string.ascii_uppercase)
         if use_numbers:
-            chars += string.digits
-            required_chars.append(random.choice(string.digits))
-        
+            classes.append(string.digits)
         if use_special_chars:
-            chars += cls.SPECIAL_CHARS
-            required_chars.append(random.choice(cls.SPECIAL_CHARS))
-        
-        remaining_length = length - len(required_chars)
-        additional_chars = [random.choice(chars) for _ in range(remaining_length)]
-        
-        password_chars = required_chars + additional_chars
-        random.shuffle(password_chars)
+            classes.append(cls.SPECIAL_CHARS)
         
-        return ''.join(password_chars)
\ No newline at end of file
+        chars = ''.join(classes)
+        # Solo i byte sotto l'ultimo multiplo di len(chars) si distribuiscono uniformemente
+        limit = 256 - 256 % len(chars)
+        table = bytes(ord(chars[value % len(chars)]) if value < limit else 0 for value in range(256))
+        return Alphabet(
+            classes=tuple(frozenset(char_class) for char_class in classes),
+            table=table,
+            rejected=bytes(range(limit, 256)),
+            acceptance=limit / 256,
+        )
@@ -0,0 +1,190 @@
+import hashlib
+import math
+import mmap
+import os
+import string
+import struct
+import threading
+from typing import NamedTuple, Optional, TextIO
+
+from config import Config
+
+# Record del corpus delle violazioni: SHA-1 binario (20 byte) + occorrenze (uint32 big endian)
+BREACH_RECORD = struct.Struct('>20sI')
+
+# Soglie di entropia (bit) dei punteggi da 0 a 4 e relative valutazioni
+SCORE_THRESHOLDS = (28, 36, 60, 80)
+SCORE_LABELS = ('molto debole', 'debole', 'discreta', 'forte', 'molto forte')
+
+
+class StrengthReport(NamedTuple):
+    """Esito della verifica di una password"""
+    entropy_bits: float
+    score: int
+    breach_count: Optional[int]  # None se il corpus delle violazioni non è disponibile
+    
+    @property
+    def label(self) -> str:
+        return SCORE_LABELS[self.score]
+    
+    @property
+    def is_weak(self) -> bool:
+        return self.score < Config.MIN_PASSWORD_SCORE
+    
+    @property
+    def is_breached(self) -> bool:
+        return bool(self.breach_count)
+
+
+class BreachCorpus:
+    """
+    Corpus locale di hash SHA-1 di password trapelate (formato dei dump di Have I Been Pwned).
+    
+    Il file binario contiene record di dimensione fissa ordinati per hash: viene mappato in
+    memoria e interrogato con una ricerca binaria, quindi ogni verifica legge solo una
+    trentina di pagine anche con centinaia di milioni di hash, e le pagine sono condivise
+    tra i processi. Il file si prepara dal dump testuale con `build`.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._records = 0
+        self._lock = threading.Lock()
+    
+    def _load(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                return
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(data) % BREACH_RECORD.size:
+                data.close()
+                raise ValueError(f"Corpus delle violazioni danneggiato: {self.path}")
+            self._records = len(data) // BREACH_RECORD.size
+            self._map = data
+    
+    def __len__(self) -> int:
+        if self._map is None:
+            self._load()
+        return self._records
+    
+    def count(self, password: str) -> int:
+        """Numero di volte in cui la password compare nelle violazioni (0 se assente)"""
+        if self._map is None:
+            self._load()
+        digest = hashlib.sha1(password.encode()).digest()
+        size = BREACH_RECORD.size
+        
+        low, high = 0, self._records
+        while low < high:
+            middle = (low + high) // 2
+            if self._map[middle * size:middle * size + 20] < digest:
+                low = middle + 1
+            else:
+                high = middle
+        
+        if low < self._records:
+            found, occurrences = BREACH_RECORD.unpack_from(self._map, low * size)
+            if found == digest:
+                return occurrences
+        return 0
+    
+    @staticmethod
+    def build(source: TextIO, destination: str) -> int:
+        """
+        Converte un dump testuale ordinato per hash (righe `SHA1:OCCORRENZE`) nel formato
+        binario, in streaming. Il file di destinazione viene sostituito solo a conversione
+        riuscita. Restituisce il numero di hash scritti.
+        """
+        temp_path = f'{destination}.{os.getpid()}.tmp'
+        written = 0
+        previous = b''
+        try:
+            with open(temp_path, 'wb', buffering=1024 * 1024) as out:
+                for line_number, line in enumerate(source, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    hex_digest, _, occurrences = line.partition(':')
+                    try:
+                        digest = bytes.fromhex(hex_digest)
+                        occurrences = min(int(occurrences or 1), 0xFFFFFFFF)
+                    except ValueError as e:
+                        raise ValueError(f"Riga {line_number} non valida: {line[:60]}") from e
+                    if len(digest) != 20:
+                        raise ValueError(f"Riga {line_number}: non è un hash SHA-1")
+                    if digest <= previous:
+                        raise ValueError(f"Riga {line_number}: il dump deve essere ordinato per hash e senza duplicati")
+                    out.write(BREACH_RECORD.pack(digest, occurrences))
+                    previous = digest
+                    written += 1
+            os.replace(temp_path, destination)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return written
+
+
+class PasswordStrength:
+    """Stima della robustezza delle password e verifica nel corpus delle violazioni"""
+    
+    _corpus: Optional[BreachCorpus] = None
+    _lock = threading.Lock()
+    
+    @classmethod
+    def corpus(cls) -> Optional[BreachCorpus]:
+        """Corpus configurato (BREACH_CORPUS_PATH), o None se non è stato preparato"""
+        path = Config.BREACH_CORPUS_PATH
+        if not path or not os.path.exists(path):
+            return None
+        with cls._lock:
+            if cls._corpus is None or cls._corpus.path != path:
+                cls._corpus = BreachCorpus(path)
+            return cls._corpus
+    
+    @staticmethod
+    def estimate_entropy(password: str) -> float:
+        """
+        Stima l'entropia in bit: dimensione dell'insieme di caratteri usato elevata alla
+        lunghezza, dove caratteri ripetuti e sequenze (abc, 321) contano solo in minima parte
+        """
+        if not password:
+            return 0.0
+        
+        pool = 0
+        if any(char in string.ascii_lowercase for char in password):
+            pool += 26
+        if any(char in string.ascii_uppercase for char in password):
+            pool += 26
+        if any(char in string.digits for char in password):
+            pool += 10
+        if any(ord(char) <= 127 and not char.isalnum() for char in password):
+            pool += 33
+        if any(ord(char) > 127 for char in password):
+            pool += 100
+        
+        effective_length = 1.0
+        previous_step = None
+        for previous, char in zip(password, password[1:]):
+            step = ord(char) - ord(previous)
+            if step == 0 or (abs(step) == 1 and step == previous_step):
+                effective_length += 0.25
+            else:
+                effective_length += 1
+            previous_step = step
+        
+        return effective_length * math.log2(pool)
+    
+    @classmethod
+    def check(cls, password: str) -> StrengthReport:
+        """Verifica una password: entropia stimata, punteggio da 0 a 4 e presenza nelle violazioni"""
+        entropy = cls.estimate_entropy(password)
+        score = sum(1 for threshold in SCORE_THRESHOLDS if entropy >= threshold)
+        
+        corpus = cls.corpus()
+        breach_count = corpus.count(password) if corpus is not None else None
+        if breach_count:
+            # Una password già trapelata è tra le prime provate in un attacco a dizionario
+            score = 0
+        return StrengthReport(entropy, score, breach_count)
@@ -1,43 +1,328 @@
+import os
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Set
+
+from flask import g, has_app_context
+
 from config import Config
+from .core import metrics
+from .core.cache import TTLCache
+from .migrations import MigrationManager
+
+# Nome dello shard che coincide con il database principale (Config.DATABASE)
+MAIN_SHARD = ''
+
+# Modalità di assegnazione dei nuovi utenti agli shard (Config.DB_SHARD_MODE)
+SHARD_MODES = ('nessuno', 'utente', 'hash')
+
+# Ampiezza dell'intervallo di id delle voci riservato a ogni shard hash: le voci create
+# nello shard non collidono con quelle spostate dal database principale o da altri shard
+SHARD_ID_RANGE = 1 << 40
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connessione che attribuisce alla fase 'db' il tempo delle istruzioni eseguite.
+    Usata solo con le metriche attive; le righe lette dopo execute (fetch) non sono incluse.
+    """
+    
+    @metrics.instrumented('db', 'password_manager_db_queries_total')
+    def execute(self, *args, **kwargs):
+        return super().execute(*args, **kwargs)
+    
+    @metrics.instrumented('db', 'password_manager_db_queries_total')
+    def executemany(self, *args, **kwargs):
+        return super().executemany(*args, **kwargs)
+    
+    @metrics.instrumented('db')
+    def commit(self):
+        return super().commit()
+
+
+class ConnectionPool:
+    """Pool limitato di connessioni SQLite persistenti verso un singolo database"""
+    
+    def __init__(self, database: str, size: int, timeout: float):
+        self.database = database
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+        # Un pool chiuso (es. scartato perché poco usato) chiude le connessioni che gli vengono restituite
+        self.closed = False
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Preleva una connessione dal pool, aprendone una nuova se non ce ne sono di libere"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Nessuna connessione al database disponibile")
+        metrics.increment('password_manager_db_pool_acquisitions_total')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return DatabaseManager.open_connection(self.database)
+            except Exception:
+                self._slots.release()
+                raise
+    
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Restituisce una connessione al pool annullando eventuali transazioni rimaste aperte"""
+        try:
+            if self.closed:
+                conn.close()
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except sqlite3.Error:
+            # Connessione non più utilizzabile: la scartiamo
+            conn.close()
+        finally:
+            self._slots.release()
+    
+    def close_all(self) -> None:
+        """Chiude tutte le connessioni inattive del pool; quelle in uso verranno chiuse al rilascio"""
+        self.closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
 
 class DatabaseManager:
-    """Gestisce le operazioni del database"""
+    """
+    Gestisce le operazioni del database.
+    
+    I dati di ogni utente (riga in `utenti`, voci, indice di ricerca, revisioni, ri-crittografie)
+    stanno in un unico shard: il database principale o un file in DB_SHARD_DIRECTORY. Il database
+    principale contiene anche la directory degli utenti (`directory_utenti`), che associa a ogni
+    utente username e shard, e le sessioni. Con vault in file diversi le scritture di utenti
+    diversi non si contendono più lo stesso lock di scrittura di SQLite.
+    """
+    
+    _pools: "OrderedDict[str, ConnectionPool]" = OrderedDict()
+    _pools_lock = threading.Lock()
+    _thread_local = threading.local()
+    _prepared: Set[str] = set()
+    _prepare_lock = threading.Lock()
+    # Shard di ogni utente: cambia solo quando un vault viene spostato
+    _shards = TTLCache(max_entries=Config.DB_SHARD_CACHE_MAX_ENTRIES, ttl=Config.DB_SHARD_CACHE_TTL)
     
     @staticmethod
     def init_database() -> None:
-        """Inizializza il database con le tabelle necessarie"""
-        with sqlite3.connect(Config.DATABASE) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS utenti (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    encryption_salt BLOB NOT NULL,
-                    data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS password_salvate (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    utente_id INTEGER,
-                    nome_sito TEXT NOT NULL,
-                    username_sito TEXT NOT NULL,
-                    password_sito_encrypted TEXT NOT NULL,
-                    data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (utente_id) REFERENCES utenti (id)
-                )
-            ''')
-            
-            conn.commit()
-    
-    @staticmethod
-    def get_connection() -> sqlite3.Connection:
-        """Ottiene una connessione al database con row factory"""
-        conn = sqlite3.connect(Config.DATABASE)
+        """Inizializza il database portando lo schema all'ultima versione"""
+        MigrationManager.apply_migrations(DatabaseManager.get_connection())
+    
+    @staticmethod
+    def open_connection(database: str) -> sqlite3.Connection:
+        """
+        Apre una nuova connessione configurata per l'uso concorrente (WAL, busy timeout,
+        mmap e cache delle istruzioni preparate)
+        """
+        conn = sqlite3.connect(
+            database,
+            timeout=Config.DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=Config.DB_STATEMENT_CACHE_SIZE,
+            factory=InstrumentedConnection if metrics.enabled() else sqlite3.Connection,
+        )
+        metrics.increment('password_manager_db_connections_opened_total')
         conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(Config.DB_BUSY_TIMEOUT * 1000)}')
+        conn.execute(f'PRAGMA mmap_size = {int(Config.DB_MMAP_SIZE)}')
+        return conn
+    
+    @staticmethod
+    def shard_path(shard: str) -> str:
+        """Percorso del file SQLite di uno shard"""
+        if shard == MAIN_SHARD:
+            return Config.DATABASE
+        return os.path.join(Config.DB_SHARD_DIRECTORY, f'{shard}.db')
+    
+    @staticmethod
+    def choose_shard(user_id: int, mode: Optional[str] = None) -> str:
+        """Shard in cui collocare il vault di un utente secondo la modalità indicata (DB_SHARD_MODE se omessa)"""
+        mode = mode or Config.DB_SHARD_MODE
+        if mode == 'nessuno':
+            return MAIN_SHARD
+        if mode == 'utente':
+            return f'utente-{user_id}'
+        if mode == 'hash':
+            return f'hash-{user_id % Config.DB_SHARD_COUNT:03d}'
+        raise ValueError(f"Modalità di suddivisione sconosciuta: {mode}")
+    
+    @staticmethod
+    def shard_of(user_id: int) -> str:
+        """Shard che contiene i dati dell'utente, secondo la directory"""
+        shard = DatabaseManager._shards.get(user_id)
+        if shard is not None:
+            return shard
+        
+        row = DatabaseManager.get_connection().execute(
+            'SELECT shard FROM directory_utenti WHERE utente_id = ?', (user_id,)
+        ).fetchone()
+        if row is None:
+            # Utente inesistente: le query sul database principale non troveranno nulla
+            return MAIN_SHARD
+        DatabaseManager._shards.set(user_id, row['shard'])
+        return row['shard']
+    
+    @staticmethod
+    def register_user(username: str) -> int:
+        """
+        Riserva nella directory id e shard di un nuovo utente e restituisce l'id.
+        Solleva sqlite3.IntegrityError se lo username è già in uso.
+        """
+        with DatabaseManager.get_connection() as conn:
+            user_id = conn.execute(
+                'INSERT INTO directory_utenti (username) VALUES (?) RETURNING utente_id', (username,)
+            ).fetchone()[0]
+            conn.execute(
+                'UPDATE directory_utenti SET shard = ? WHERE utente_id = ?',
+                (DatabaseManager.choose_shard(user_id), user_id)
+            )
+        return user_id
+    
+    @staticmethod
+    def unregister_user(user_id: int) -> None:
+        """Rimuove un utente dalla directory (es. se la creazione nel suo shard non è riuscita)"""
+        with DatabaseManager.get_connection() as conn:
+            conn.execute('DELETE FROM directory_utenti WHERE utente_id = ?', (user_id,))
+        DatabaseManager._shards.pop(user_id)
+    
+    @staticmethod
+    def find_user_id(username: str) -> Optional[int]:
+        """Id dell'utente con questo username, dalla directory"""
+        row = DatabaseManager.get_connection().execute(
+            'SELECT utente_id FROM directory_utenti WHERE username = ?', (username,)
+        ).fetchone()
+        return row['utente_id'] if row else None
+    
+    @staticmethod
+    def set_shard(conn: sqlite3.Connection, user_id: int, shard: str) -> None:
+        """
+        Aggiorna nella directory lo shard dell'utente, dopo averne copiato i dati. Non fa commit:
+        `conn` è una connessione al database principale, nella transazione dello spostamento.
+        """
+        conn.execute('UPDATE directory_utenti SET shard = ? WHERE utente_id = ?', (shard, user_id))
+        DatabaseManager._shards.pop(user_id)
+    
+    @staticmethod
+    def list_shards() -> List[str]:
+        """Tutti gli shard in uso, a partire dal database principale"""
+        rows = DatabaseManager.get_connection().execute(
+            'SELECT DISTINCT shard FROM directory_utenti WHERE shard != ? ORDER BY shard', (MAIN_SHARD,)
+        ).fetchall()
+        return [MAIN_SHARD] + [row['shard'] for row in rows]
+    
+    @staticmethod
+    def prepare_database(database: str) -> None:
+        """
+        Crea, se serve, il file di uno shard e ne porta lo schema all'ultima versione.
+        Ogni processo lo fa una sola volta per database, alla prima connessione.
+        """
+        if database in DatabaseManager._prepared:
+            return
+        with DatabaseManager._prepare_lock:
+            if database in DatabaseManager._prepared:
+                return
+            directory = os.path.dirname(database)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = DatabaseManager.open_connection(database)
+            try:
+                MigrationManager.apply_migrations(conn)
+                DatabaseManager._reserve_id_range(conn, database)
+            finally:
+                conn.close()
+            DatabaseManager._prepared.add(database)
+    
+    @staticmethod
+    def _reserve_id_range(conn: sqlite3.Connection, database: str) -> None:
+        """Fa partire gli id delle voci di uno shard hash dall'intervallo riservato a quello shard"""
+        shard = os.path.splitext(os.path.basename(database))[0]
+        if database == Config.DATABASE or not shard.startswith('hash-'):
+            return
+        first_id = (int(shard[len('hash-'):]) + 1) * SHARD_ID_RANGE
+        with conn:
+            updated = conn.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'password_salvate'", (first_id,)
+            ).rowcount
+            if not updated:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('password_salvate', ?)", (first_id,))
+    
+    @staticmethod
+    def get_pool(database: Optional[str] = None) -> ConnectionPool:
+        """
+        Restituisce il pool di connessioni del database, creandolo al primo utilizzo.
+        Restano aperti al più DB_MAX_OPEN_POOLS pool: quelli usati meno di recente vengono chiusi.
+        """
+        database = database or Config.DATABASE
+        with DatabaseManager._pools_lock:
+            pool = DatabaseManager._pools.get(database)
+            if pool is not None:
+                DatabaseManager._pools.move_to_end(database)
+                return pool
+        
+        DatabaseManager.prepare_database(database)
+        with DatabaseManager._pools_lock:
+            pool = DatabaseManager._pools.get(database)
+            if pool is None:
+                pool = ConnectionPool(database, Config.DB_POOL_SIZE, Config.DB_POOL_TIMEOUT)
+                DatabaseManager._pools[database] = pool
+                while len(DatabaseManager._pools) > Config.DB_MAX_OPEN_POOLS:
+                    DatabaseManager._pools.popitem(last=False)[1].close_all()
+            return pool
+    
+    @staticmethod
+    def get_connection(user_id: Optional[int] = None) -> sqlite3.Connection:
+        """
+        Ottiene una connessione con row factory allo shard dell'utente indicato,
+        o al database principale (directory e sessioni) se l'utente è omesso.
+        
+        Dentro una richiesta Flask la connessione viene presa dal pool e condivisa
+        tramite l'app context fino al teardown; fuori dal contesto (script, thread
+        di lavoro) ogni thread riutilizza una propria connessione persistente per
+        ciascuno degli ultimi DB_THREAD_CONNECTIONS database usati.
+        """
+        database = Config.DATABASE if user_id is None else DatabaseManager.shard_path(DatabaseManager.shard_of(user_id))
+        if has_app_context():
+            connections = g.setdefault('db_connections', {})
+            entry = connections.get(database)
+            if entry is None:
+                pool = DatabaseManager.get_pool(database)
+                entry = connections[database] = (pool, pool.acquire())
+            return entry[1]
+        
+        connections = getattr(DatabaseManager._thread_local, 'connections', None)
+        if connections is None:
+            connections = DatabaseManager._thread_local.connections = OrderedDict()
+        conn = connections.get(database)
+        if conn is None:
+            DatabaseManager.prepare_database(database)
+            conn = connections[database] = DatabaseManager.open_connection(database)
+            while len(connections) > Config.DB_THREAD_CONNECTIONS:
+                connections.popitem(last=False)[1].close()
+        else:
+            connections.move_to_end(database)
         return conn
+    
+    @staticmethod
+    def release_connections(exception: Optional[BaseException] = None) -> None:
+        """Restituisce ai rispettivi pool le connessioni usate nell'app context corrente"""
+        connections = g.pop('db_connections', {})
+        for pool, conn in connections.values():
+            pool.release(conn)
+    
+    @staticmethod
+    def close_all() -> None:
+        """Chiude le connessioni inattive di tutti i pool (es. prima di un fork)"""
+        with DatabaseManager._pools_lock:
+            for pool in DatabaseManager._pools.values():
+                pool.close_all()
+            DatabaseManager._pools.clear()
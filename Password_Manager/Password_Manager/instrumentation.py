@@ -0,0 +1,124 @@
+import cProfile
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from flask import Flask, Response, abort, g, request
+from flask.signals import before_render_template, template_rendered
+
+from config import Config
+from .core import metrics
+
+# Una sola richiesta profilata alla volta: cProfile registra un profilatore globale per processo
+_profiler_lock = threading.Lock()
+_profile_sequence = itertools.count(1)
+
+
+def init_instrumentation(app: Flask) -> None:
+    """
+    Attiva, se configurate, la profilazione a campione (PROFILE_SAMPLE_RATE) e le
+    metriche delle richieste (METRICS_ENABLED): tempi per fase nell'header Server-Timing,
+    contatori e istogrammi esposti in formato Prometheus su /metrics.
+    """
+    if Config.PROFILE_SAMPLE_RATE > 0:
+        # Registrato per primo, così il profilo comprende anche gli altri hook
+        app.before_request(_start_profile)
+        app.teardown_request(_stop_profile)
+
+    if not Config.METRICS_ENABLED:
+        return
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_abort_request)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_finish_template, app)
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+
+def _start_request() -> None:
+    g.metrics_token = metrics.start_request()
+    g.metrics_start = time.perf_counter()
+
+
+def _finish_request(response: Response) -> Response:
+    token = g.pop('metrics_token', None)
+    if token is None:
+        return response
+
+    duration = time.perf_counter() - g.pop('metrics_start')
+    phases = metrics.finish_request(token)
+    _record_request(response.status_code, duration)
+
+    timings = [f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in sorted(phases.items())]
+    timings.append(f'totale;dur={duration * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+def _abort_request(exception: Optional[BaseException] = None) -> None:
+    # after_request non viene chiamato se la vista solleva un'eccezione non gestita
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.finish_request(token)
+        _record_request(500, time.perf_counter() - g.pop('metrics_start'))
+
+
+def _record_request(status_code: int, duration: float) -> None:
+    # L'endpoint (non il percorso) tiene limitato il numero di serie: gli id non finiscono nelle etichette
+    endpoint = request.endpoint or 'nessuna_route'
+    metrics.registry.increment('password_manager_requests_total', endpoint=endpoint, stato=str(status_code))
+    metrics.registry.observe('password_manager_request_duration_seconds', duration, endpoint=endpoint)
+
+
+def _start_template(sender: Flask, template, context, **extra) -> None:
+    g.metrics_template_start = time.perf_counter()
+
+
+def _finish_template(sender: Flask, template, context, **extra) -> None:
+    start = g.pop('metrics_template_start', None)
+    if start is not None:
+        metrics.record_phase('template', time.perf_counter() - start)
+
+
+def _metrics_view() -> Response:
+    """Metriche del processo in formato Prometheus, solo per gli indirizzi ammessi"""
+    if request.remote_addr not in Config.METRICS_ALLOWED_ADDRESSES:
+        abort(404)
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _start_profile() -> None:
+    if random.random() >= Config.PROFILE_SAMPLE_RATE or not _profiler_lock.acquire(blocking=False):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Un altro strumento di profilazione è già attivo nel processo
+        _profiler_lock.release()
+        return
+    g.profiler = profiler
+
+
+def _stop_profile(exception: Optional[BaseException] = None) -> None:
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        os.makedirs(Config.PROFILE_DIRECTORY, exist_ok=True)
+        path = os.path.join(
+            Config.PROFILE_DIRECTORY,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_sequence)}-{request.endpoint or 'nessuna_route'}.prof"
+        )
+        # Da esaminare con `python -m pstats FILE` o snakeviz
+        profiler.dump_stats(path)
+    except OSError as e:
+        logging.error(f"Impossibile salvare il profilo della richiesta: {e}")
+    finally:
+        _profiler_lock.release()
@@ -0,0 +1,226 @@
+import json
+import logging
+import sqlite3
+from typing import Callable, List, NamedTuple, Sequence, Union
+
+from config import Config
+
+# Un passo di migrazione è un'istruzione SQL o una funzione che riceve la connessione
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+class Migration(NamedTuple):
+    """Singola versione dello schema del database"""
+    version: int
+    description: str
+    steps: Sequence[MigrationStep]
+
+
+def _set_legacy_kdf_parameters(conn: sqlite3.Connection) -> None:
+    """Registra per gli utenti esistenti la KDF con cui sono state derivate le loro chiavi"""
+    conn.execute(
+        'UPDATE utenti SET kdf_algoritmo = ?, kdf_parametri = ? WHERE kdf_algoritmo IS NULL',
+        ('pbkdf2_sha512', json.dumps({'iterations': Config.PBKDF2_ITERATIONS}))
+    )
+
+
+# Elenco ordinato delle migrazioni: le versioni già applicate non vanno mai modificate,
+# ogni cambiamento dello schema si aggiunge in coda con un nuovo numero di versione
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'Schema iniziale', (
+        '''
+        CREATE TABLE IF NOT EXISTS utenti (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            encryption_salt BLOB NOT NULL,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS password_salvate (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            utente_id INTEGER,
+            nome_sito TEXT NOT NULL,
+            username_sito TEXT NOT NULL,
+            password_sito_encrypted TEXT NOT NULL,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (utente_id) REFERENCES utenti (id)
+        )
+        ''',
+    )),
+    Migration(2, 'Indice sulle password per utente e nome sito', (
+        # Copre il filtro per utente_id e l'ordinamento per nome_sito della dashboard
+        'CREATE INDEX IF NOT EXISTS idx_password_salvate_utente_sito '
+        'ON password_salvate (utente_id, nome_sito, id)',
+    )),
+    Migration(3, 'Stato delle ri-crittografie in corso', (
+        # La nuova chiave è salvata cifrata con la vecchia: chi conosce la vecchia
+        # password master può riprendere una ri-crittografia interrotta
+        '''
+        CREATE TABLE IF NOT EXISTS rekey_jobs (
+            utente_id INTEGER PRIMARY KEY,
+            nuova_chiave_cifrata TEXT NOT NULL,
+            nuovo_password_hash TEXT,
+            nuovo_salt BLOB,
+            ultimo_id INTEGER NOT NULL DEFAULT 0,
+            data_inizio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (utente_id) REFERENCES utenti (id)
+        )
+        ''',
+    )),
+    Migration(4, 'Chiave dati per utente cifrata con la password master', (
+        # NULL indica un vault non ancora migrato, cifrato direttamente con la chiave derivata
+        'ALTER TABLE utenti ADD COLUMN chiave_dati_cifrata TEXT',
+        # Un job con questo flag installa la nuova chiave come chiave dati dell'utente
+        'ALTER TABLE rekey_jobs ADD COLUMN installa_chiave_dati INTEGER NOT NULL DEFAULT 0',
+    )),
+    Migration(5, 'Algoritmo e costi della KDF salvati per utente', (
+        'ALTER TABLE utenti ADD COLUMN kdf_algoritmo TEXT',
+        'ALTER TABLE utenti ADD COLUMN kdf_parametri TEXT',
+        _set_legacy_kdf_parameters,
+    )),
+    Migration(6, 'Sessioni lato server condivise tra i worker', (
+        '''
+        CREATE TABLE IF NOT EXISTS sessioni (
+            id_hash BLOB PRIMARY KEY,
+            dati BLOB NOT NULL,
+            scadenza REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sessioni_scadenza ON sessioni (scadenza)',
+    )),
+    Migration(7, 'Metadati delle voci cifrati e indice cieco per la ricerca', (
+        # Nome sito e username cifrati insieme; le colonne in chiaro restano vuote
+        # dopo la conversione, che avviene al login perché richiede la chiave dell'utente
+        'ALTER TABLE password_salvate ADD COLUMN metadati_cifrati BLOB',
+        '''
+        CREATE TABLE IF NOT EXISTS indice_ricerca (
+            utente_id INTEGER NOT NULL,
+            token BLOB NOT NULL,
+            voce_id INTEGER NOT NULL,
+            PRIMARY KEY (utente_id, token, voce_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_indice_ricerca_voce ON indice_ricerca (voce_id)',
+        # Senza nome sito in chiaro l'elenco è ordinato per id
+        'DROP INDEX IF EXISTS idx_password_salvate_utente_sito',
+        'CREATE INDEX IF NOT EXISTS idx_password_salvate_utente ON password_salvate (utente_id, id)',
+    )),
+    Migration(8, 'Impronte delle password per il controllo dei riutilizzi', (
+        # HMAC della password con una chiave derivata da quella del vault; NULL finché la voce
+        # non viene convertita al login. I due indici coprono le aggregazioni del controllo
+        'ALTER TABLE password_salvate ADD COLUMN impronta_password BLOB',
+        'CREATE INDEX IF NOT EXISTS idx_password_salvate_impronta ON password_salvate (utente_id, impronta_password)',
+        'CREATE INDEX IF NOT EXISTS idx_password_salvate_modifica ON password_salvate (utente_id, data_modifica)',
+    )),
+    Migration(9, 'Revisioni del vault e voci eliminate per la sincronizzazione', (
+        'ALTER TABLE utenti ADD COLUMN revisione INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE password_salvate ADD COLUMN revisione INTEGER NOT NULL DEFAULT 0',
+        # Le voci esistenti ricevono revisioni distinte (i loro id) e il contatore
+        # di ogni utente riparte dalla più alta
+        'UPDATE password_salvate SET revisione = id',
+        'UPDATE utenti SET revisione = COALESCE((SELECT MAX(id) FROM password_salvate WHERE utente_id = utenti.id), 0)',
+        '''
+        CREATE TABLE IF NOT EXISTS voci_eliminate (
+            utente_id INTEGER NOT NULL,
+            revisione INTEGER NOT NULL,
+            voce_id INTEGER NOT NULL,
+            PRIMARY KEY (utente_id, revisione)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_password_salvate_revisione ON password_salvate (utente_id, revisione)',
+    )),
+    Migration(10, 'Directory degli utenti per la suddivisione dei vault in shard', (
+        # Usata solo nel database principale: associa username e shard a ogni utente e
+        # assegna gli id, unici tra tutti gli shard. Gli utenti esistenti restano nel principale ('')
+        '''
+        CREATE TABLE IF NOT EXISTS directory_utenti (
+            utente_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            shard TEXT NOT NULL DEFAULT ''
+        )
+        ''',
+        'INSERT INTO directory_utenti (utente_id, username) SELECT id, username FROM utenti',
+    )),
+    Migration(11, 'Epoca delle sessioni per revocarle al cambio della password master', (
+        # Salvata nella sessione al login: quando cambia, le sessioni aperte non sono più valide
+        'ALTER TABLE utenti ADD COLUMN epoca_sessioni INTEGER NOT NULL DEFAULT 0',
+    )),
+]
+
+# Tabelle con i dati di un utente e colonna che lo identifica: sono le righe che
+# vengono spostate insieme quando un vault cambia shard. Da aggiornare quando una
+# migrazione aggiunge una tabella con dati per utente
+USER_TABLES = (
+    ('utenti', 'id'),
+    ('password_salvate', 'utente_id'),
+    ('indice_ricerca', 'utente_id'),
+    ('voci_eliminate', 'utente_id'),
+    ('rekey_jobs', 'utente_id'),
+)
+
+
+class MigrationManager:
+    """Applica in modo incrementale le migrazioni dello schema"""
+    
+    @staticmethod
+    def ensure_version_table(conn: sqlite3.Connection) -> None:
+        """Crea la tabella che registra le versioni applicate"""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versione INTEGER PRIMARY KEY,
+                descrizione TEXT NOT NULL,
+                data_applicazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+    
+    @staticmethod
+    def current_version(conn: sqlite3.Connection) -> int:
+        """Restituisce l'ultima versione dello schema applicata (0 se nessuna)"""
+        row = conn.execute('SELECT MAX(versione) FROM schema_version').fetchone()
+        return row[0] or 0
+    
+    @staticmethod
+    def apply_migrations(conn: sqlite3.Connection) -> List[int]:
+        """
+        Applica le migrazioni mancanti, ciascuna in una propria transazione.
+        Restituisce le versioni applicate.
+        """
+        MigrationManager.ensure_version_table(conn)
+        applied = []
+        
+        for migration in MIGRATIONS:
+            if migration.version <= MigrationManager.current_version(conn):
+                continue
+            
+            # BEGIN IMMEDIATE acquisisce subito il lock di scrittura: se più processi
+            # partono insieme, solo uno applica la migrazione e gli altri la trovano fatta
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if migration.version <= MigrationManager.current_version(conn):
+                    conn.rollback()
+                    continue
+                
+                for step in migration.steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                
+                conn.execute(
+                    'INSERT INTO schema_version (versione, descrizione) VALUES (?, ?)',
+                    (migration.version, migration.description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logging.error(f"Migrazione {migration.version} ({migration.description}) fallita", exc_info=True)
+                raise
+            
+            logging.info(f"Applicata migrazione {migration.version}: {migration.description}")
+            applied.append(migration.version)
+        
+        return applied
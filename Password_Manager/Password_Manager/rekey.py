@@ -0,0 +1,290 @@
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from config import Config
+from .database import DatabaseManager
+from .core import metrics
+from .core.blind_index import BlindIndex
+from .core.cryptography import CipherContext
+from .search_index import SearchIndex
+
+# Callback di avanzamento: (voci elaborate, voci totali)
+ProgressCallback = Callable[[int, int], None]
+
+# Voce ri-cifrata: (password, metadati o None se in chiaro, impronta della password, id, token dell'indice o None)
+ReencryptedEntry = Tuple[bytes, Optional[bytes], bytes, int, Optional[Iterable[bytes]]]
+
+# Un solo thread per le migrazioni di formato in background, per non competere con le richieste
+_background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='migrazione-formato')
+
+
+class RekeyResult(NamedTuple):
+    """Esito di una ri-crittografia del vault"""
+    processed: int
+    skipped: int
+    password_changed: bool = False
+
+
+class RekeyService:
+    """
+    Ri-crittografa il vault di un utente da una chiave a un'altra a blocchi.
+    
+    Ogni blocco viene aggiornato con executemany in una transazione breve, così il
+    lock di scrittura non resta occupato per tutta la durata dell'operazione.
+    L'avanzamento è salvato in `rekey_jobs`: se il processo si interrompe, la
+    ri-crittografia può essere ripresa conoscendo la vecchia chiave.
+    """
+    
+    @staticmethod
+    def has_pending(user_id: int) -> bool:
+        """Indica se l'utente ha una ri-crittografia interrotta da completare"""
+        with DatabaseManager.get_connection(user_id) as conn:
+            return conn.execute(
+                'SELECT 1 FROM rekey_jobs WHERE utente_id = ?', (user_id,)
+            ).fetchone() is not None
+    
+    @staticmethod
+    def change_master_key(user_id: int, old_key: bytes, new_key: bytes,
+                          new_password_hash: Optional[str] = None, new_salt: Optional[bytes] = None,
+                          install_data_key: bool = False,
+                          progress: Optional[ProgressCallback] = None) -> RekeyResult:
+        """
+        Avvia e completa la ri-crittografia del vault da `old_key` a `new_key`.
+        Al termine aggiorna hash della password e salt dell'utente, se forniti; con
+        `install_data_key` la nuova chiave diventa la chiave dati dell'utente, cifrata con `old_key`.
+        """
+        if RekeyService.has_pending(user_id):
+            raise ValueError("Esiste già una ri-crittografia in corso per questo utente")
+        
+        with DatabaseManager.get_connection(user_id) as conn:
+            conn.execute(
+                'INSERT INTO rekey_jobs (utente_id, nuova_chiave_cifrata, nuovo_password_hash, nuovo_salt, installa_chiave_dati) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (user_id, CipherContext(old_key).encrypt(new_key.decode()), new_password_hash, new_salt, int(install_data_key))
+            )
+        
+        return RekeyService.resume(user_id, old_key, progress=progress)
+    
+    @staticmethod
+    def resume(user_id: int, old_key: bytes, progress: Optional[ProgressCallback] = None) -> RekeyResult:
+        """
+        Riprende (o esegue) la ri-crittografia registrata per l'utente.
+        Solleva ValueError se `old_key` non è la chiave con cui è stata avviata.
+        """
+        conn = DatabaseManager.get_connection(user_id)
+        with conn:
+            job = conn.execute('SELECT * FROM rekey_jobs WHERE utente_id = ?', (user_id,)).fetchone()
+        if job is None:
+            return RekeyResult(0, 0)
+        
+        old_cipher = CipherContext(old_key)
+        new_key = old_cipher.decrypt(job['nuova_chiave_cifrata']).encode()
+        new_cipher = CipherContext(new_key)
+        # Metadati, impronte e token dell'indice cieco dipendono dalla chiave: vanno rifatti insieme alle password
+        new_index = BlindIndex(new_key)
+        
+        with conn:
+            total = conn.execute(
+                'SELECT COUNT(*) FROM password_salvate WHERE utente_id = ?', (user_id,)
+            ).fetchone()[0]
+            done = conn.execute(
+                'SELECT COUNT(*) FROM password_salvate WHERE utente_id = ? AND id <= ?', (user_id, job['ultimo_id'])
+            ).fetchone()[0]
+        
+        last_id = job['ultimo_id']
+        skipped = 0
+        executor = ThreadPoolExecutor(max_workers=Config.REKEY_WORKERS) if Config.REKEY_WORKERS > 1 else None
+        try:
+            while True:
+                with conn:
+                    rows = RekeyService._fetch_batch(conn, user_id, last_id)
+                if not rows:
+                    break
+                
+                updates, batch_skipped = RekeyService._reencrypt_batch(rows, old_cipher, new_cipher, new_index, executor)
+                last_id = rows[-1]['id']
+                with conn:
+                    RekeyService._store_batch(conn, user_id, updates, last_id)
+                
+                done += len(rows)
+                skipped += batch_skipped
+                if progress:
+                    progress(done, total)
+            
+            # Le voci aggiunte nel frattempo vengono elaborate sotto lock, insieme alla
+            # conclusione del job, così nessuna resta cifrata con la vecchia chiave
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = RekeyService._fetch_batch(conn, user_id, last_id, limit=-1)
+                if rows:
+                    updates, batch_skipped = RekeyService._reencrypt_batch(rows, old_cipher, new_cipher, new_index, executor)
+                    RekeyService._store_batch(conn, user_id, updates, rows[-1]['id'])
+                    done += len(rows)
+                    skipped += batch_skipped
+                    if progress:
+                        progress(done, total)
+                
+                if job['nuovo_password_hash'] is not None:
+                    conn.execute(
+                        'UPDATE utenti SET password_hash = ?, encryption_salt = ?, '
+                        'epoca_sessioni = epoca_sessioni + 1 WHERE id = ?',
+                        (job['nuovo_password_hash'], job['nuovo_salt'], user_id)
+                    )
+                if job['installa_chiave_dati']:
+                    # La nuova chiave, già cifrata con la vecchia, è esattamente la chiave dati incapsulata
+                    conn.execute(
+                        'UPDATE utenti SET chiave_dati_cifrata = ? WHERE id = ?',
+                        (job['nuova_chiave_cifrata'], user_id)
+                    )
+                conn.execute('DELETE FROM rekey_jobs WHERE utente_id = ?', (user_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        finally:
+            if executor:
+                executor.shutdown()
+        
+        if skipped:
+            logging.warning(f"Ri-crittografia utente {user_id}: {skipped} voci non decifrabili lasciate invariate")
+        return RekeyResult(done - skipped, skipped, job['nuovo_password_hash'] is not None)
+    
+    @staticmethod
+    def upgrade_storage_format(user_id: int, key: bytes) -> int:
+        """
+        Porta al formato attuale le voci dell'utente ancora in un formato precedente, a
+        blocchi e senza cambiare chiave: password nel formato compatto e con impronta,
+        nome sito e username cifrati e indicizzati. Restituisce il numero di voci convertite.
+        """
+        cipher = CipherContext(key)
+        index = BlindIndex(key)
+        conn = DatabaseManager.get_connection(user_id)
+        last_id = 0
+        converted = 0
+        
+        while True:
+            with conn:
+                rows = conn.execute(
+                    "SELECT id, nome_sito, username_sito, password_sito_encrypted, metadati_cifrati FROM password_salvate "
+                    "WHERE utente_id = ? AND id > ? AND (typeof(password_sito_encrypted) = 'text' "
+                    "OR metadati_cifrati IS NULL OR impronta_password IS NULL) ORDER BY id LIMIT ?",
+                    (user_id, last_id, Config.REKEY_BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                break
+            
+            updates = []
+            for row in rows:
+                try:
+                    encrypted_password = row['password_sito_encrypted']
+                    password = cipher.decrypt(encrypted_password)
+                    if CipherContext.is_legacy(encrypted_password):
+                        encrypted_password = cipher.encrypt(password)
+                except ValueError:
+                    continue
+                fingerprint = index.password_fingerprint(password)
+                if row['metadati_cifrati'] is None:
+                    metadata = (row['nome_sito'], row['username_sito'])
+                    updates.append((row, encrypted_password, cipher.encrypt_metadata(*metadata), fingerprint,
+                                    index.entry_tokens(*metadata)))
+                else:
+                    updates.append((row, encrypted_password, row['metadati_cifrati'], fingerprint, None))
+            
+            with conn:
+                # La condizione sui vecchi valori evita di sovrascrivere una modifica concorrente
+                cursor = conn.executemany(
+                    "UPDATE password_salvate SET password_sito_encrypted = ?, metadati_cifrati = ?, "
+                    "impronta_password = ?, nome_sito = '', username_sito = '' "
+                    "WHERE id = ? AND utente_id = ? AND password_sito_encrypted = ? AND metadati_cifrati IS ?",
+                    [(encrypted_password, encrypted_metadata, fingerprint, row['id'], user_id,
+                      row['password_sito_encrypted'], row['metadati_cifrati'])
+                     for row, encrypted_password, encrypted_metadata, fingerprint, _ in updates]
+                )
+                converted += max(cursor.rowcount, 0)
+                
+                # Token solo per le voci effettivamente convertite: i metadati appena cifrati
+                # (nonce casuale) sono ancora nella riga solo se l'UPDATE non è stato saltato
+                new_metadata = {row['id']: (encrypted_metadata, tokens)
+                                for row, _, encrypted_metadata, _, tokens in updates if tokens is not None}
+                if new_metadata:
+                    placeholders = ', '.join('?' * len(new_metadata))
+                    stored = conn.execute(
+                        f'SELECT id, metadati_cifrati FROM password_salvate WHERE utente_id = ? AND id IN ({placeholders})',
+                        (user_id, *new_metadata)
+                    ).fetchall()
+                    SearchIndex.replace_tokens(conn, user_id, [
+                        (entry['id'], new_metadata[entry['id']][1]) for entry in stored
+                        if entry['metadati_cifrati'] == new_metadata[entry['id']][0]
+                    ])
+            last_id = rows[-1]['id']
+        
+        return converted
+    
+    @staticmethod
+    def schedule_format_upgrade(user_id: int, key: bytes) -> None:
+        """Avvia in background la conversione al formato attuale del vault dell'utente"""
+        def run() -> None:
+            try:
+                if RekeyService.has_pending(user_id):
+                    return
+                converted = RekeyService.upgrade_storage_format(user_id, key)
+                if converted:
+                    logging.info(f"Convertite al formato attuale {converted} voci dell'utente {user_id}")
+            except Exception:
+                logging.error(f"Migrazione di formato fallita per l'utente {user_id}", exc_info=True)
+        
+        _background_executor.submit(run)
+    
+    @staticmethod
+    def _fetch_batch(conn: sqlite3.Connection, user_id: int, after_id: int,
+                     limit: Optional[int] = None) -> List[sqlite3.Row]:
+        """Legge il blocco successivo di voci cifrate in ordine di id"""
+        return conn.execute(
+            'SELECT id, password_sito_encrypted, metadati_cifrati FROM password_salvate '
+            'WHERE utente_id = ? AND id > ? ORDER BY id LIMIT ?',
+            (user_id, after_id, limit or Config.REKEY_BATCH_SIZE)
+        ).fetchall()
+    
+    @staticmethod
+    def _reencrypt_batch(rows: List[sqlite3.Row], old_cipher: CipherContext, new_cipher: CipherContext,
+                         new_index: BlindIndex,
+                         executor: Optional[ThreadPoolExecutor]) -> Tuple[List[ReencryptedEntry], int]:
+        """Ri-cifra un blocco di voci; restituisce le voci ri-cifrate e il numero di voci illeggibili"""
+        
+        def reencrypt(row: sqlite3.Row) -> Tuple[Optional[ReencryptedEntry], bool]:
+            try:
+                password = old_cipher.decrypt(row['password_sito_encrypted'])
+                metadata = old_cipher.decrypt_metadata(row['metadati_cifrati']) if row['metadati_cifrati'] is not None else None
+            except ValueError:
+                # Una voce già cifrata con la nuova chiave (job ripreso) non va toccata;
+                # una voce illeggibile con entrambe le chiavi viene lasciata com'è
+                try:
+                    new_cipher.decrypt(row['password_sito_encrypted'])
+                    return None, False
+                except ValueError:
+                    return None, True
+            fingerprint = new_index.password_fingerprint(password)
+            if metadata is None:
+                return (new_cipher.encrypt(password), None, fingerprint, row['id'], None), False
+            return (new_cipher.encrypt(password), new_cipher.encrypt_metadata(*metadata), fingerprint, row['id'],
+                    new_index.entry_tokens(*metadata)), False
+        
+        results = list(executor.map(metrics.propagate(reencrypt), rows) if executor else map(reencrypt, rows))
+        updates = [update for update, _ in results if update is not None]
+        return updates, sum(1 for _, unreadable in results if unreadable)
+    
+    @staticmethod
+    def _store_batch(conn: sqlite3.Connection, user_id: int, updates: List[ReencryptedEntry], last_id: int) -> None:
+        """Scrive un blocco ri-cifrato e registra l'avanzamento nella stessa transazione"""
+        conn.executemany(
+            'UPDATE password_salvate SET password_sito_encrypted = ?, metadati_cifrati = COALESCE(?, metadati_cifrati), '
+            'impronta_password = ? WHERE id = ? AND utente_id = ?',
+            [(encrypted_password, encrypted_metadata, fingerprint, entry_id, user_id)
+             for encrypted_password, encrypted_metadata, fingerprint, entry_id, _ in updates]
+        )
+        SearchIndex.replace_tokens(
+            conn, user_id, [(entry_id, tokens) for _, _, _, entry_id, tokens in updates if tokens is not None]
+        )
+        conn.execute('UPDATE rekey_jobs SET ultimo_id = ? WHERE utente_id = ?', (last_id, user_id))
@@ -0,0 +1,52 @@
+import sqlite3
+from typing import List, Sequence, Tuple
+
+
+class RevisionLog:
+    """
+    Contatore delle revisioni del vault di ogni utente (`utenti.revisione`) e registro
+    delle voci eliminate (`voci_eliminate`), su cui si basa la sincronizzazione incrementale.
+
+    Ogni scrittura riceve una revisione nuova e distinta, crescente per utente: un client
+    che conosce la revisione della sua ultima sincronizzazione chiede solo ciò che è
+    cambiato dopo. Le funzioni non fanno commit: vanno chiamate nella stessa transazione
+    che modifica le voci, così contatore e voci cambiano insieme.
+    """
+
+    @staticmethod
+    def allocate(conn: sqlite3.Connection, user_id: int, count: int = 1) -> int:
+        """
+        Riserva `count` revisioni consecutive e restituisce la prima.
+        L'UPDATE prende il lock di scrittura: le revisioni non si sovrappongono tra processi.
+        """
+        last = conn.execute(
+            'UPDATE utenti SET revisione = revisione + ? WHERE id = ? RETURNING revisione', (count, user_id)
+        ).fetchone()[0]
+        return last - count + 1
+
+    @staticmethod
+    def record_deletions(conn: sqlite3.Connection, user_id: int, entry_ids: Sequence[int]) -> None:
+        """Registra l'eliminazione delle voci indicate, ciascuna con una propria revisione"""
+        if not entry_ids:
+            return
+        first = RevisionLog.allocate(conn, user_id, len(entry_ids))
+        conn.executemany(
+            'INSERT INTO voci_eliminate (utente_id, revisione, voce_id) VALUES (?, ?, ?)',
+            [(user_id, first + offset, entry_id) for offset, entry_id in enumerate(entry_ids)]
+        )
+
+    @staticmethod
+    def current(conn: sqlite3.Connection, user_id: int) -> int:
+        """Revisione corrente del vault dell'utente (0 se mai modificato)"""
+        row = conn.execute('SELECT revisione FROM utenti WHERE id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def deletions_since(conn: sqlite3.Connection, user_id: int, since: int, until: int,
+                        limit: int) -> List[Tuple[int, int]]:
+        """Eliminazioni con revisione in (since, until], come coppie (revisione, id voce)"""
+        return [tuple(row) for row in conn.execute(
+            'SELECT revisione, voce_id FROM voci_eliminate WHERE utente_id = ? AND revisione > ? AND revisione <= ? '
+            'ORDER BY revisione LIMIT ?',
+            (user_id, since, until, limit)
+        )]
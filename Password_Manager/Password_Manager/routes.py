@@ -1,16 +1,25 @@
+import io
 import os
+import csv
+import json
+import base64
 import signal
 import logging
 import sqlite3
+from typing import Optional
 from flask import (
-    Blueprint, render_template, request, redirect, url_for, session, flash
+    Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app,
+    Response, stream_with_context
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 
 from .services import UserManager, PasswordService
+from .core.auth_pool import AuthBusyError, AuthWorkerPool
 from .core.password_generator import PasswordGenerator
-from .core.cryptography import CryptographyManager
-from .database import DatabaseManager
+from .core.passphrase_generator import SEPARATORS, PassphraseGenerator
+from .core.strength import PasswordStrength
+from .audit import VaultAuditService
+from .rekey import RekeyService
+from .transfer import VaultTransferService
 from config import Config
 
 # Inizializza il blueprint
@@ -26,18 +35,80 @@ def handle_internal_server_error(e):
     # Mostra una pagina di errore generica e user-friendly all'utente.
     return render_template("500.html"), 500
 
+@main.app_errorhandler(AuthBusyError)
+def handle_auth_busy(e):
+    """Il pool di autenticazione è saturo: si chiede di riprovare invece di accodare all'infinito."""
+    logging.warning(f"Richiesta di autenticazione rifiutata: {e}")
+    if request.path.startswith('/api/'):
+        response = jsonify(errore='Server occupato, riprova tra qualche istante')
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    # Per le pagine si torna al modulo mostrando il messaggio (i browser non seguono un 503)
+    flash('Il server è momentaneamente occupato, riprova tra qualche istante.', 'error')
+    return redirect(request.path)
+
 # Decoratori per l'autenticazione
 def login_required(f):
     """Decoratore per richiedere l'autenticazione."""
+    def unauthenticated_response():
+        if request.path.startswith('/api/'):
+            return jsonify(errore='Autenticazione richiesta'), 401
+        flash('Per favore, effettua il login per accedere a questa pagina.', 'error')
+        return redirect(url_for('main.login'))
+    
+    def is_authenticated():
+        if 'utente_id' not in session or 'chiave_master' not in session:
+            return False
+        # Una ricerca per chiave primaria a richiesta: anche le sessioni salvate da altri worker
+        # smettono di valere appena la password master cambia
+        if session.get('epoca_sessioni') != UserManager.get_session_epoch(session['utente_id']):
+            session.clear()
+            return False
+        return True
+    
     def decorated_function(*args, **kwargs):
-        if 'utente_id' not in session or 'user_password' not in session:
-            flash('Per favore, effettua il login per accedere a questa pagina.', 'error')
-            return redirect(url_for('main.login'))
+        if not is_authenticated():
+            return unauthenticated_response()
         return f(*args, **kwargs)
     decorated_function.__name__ = f.__name__
     return decorated_function
 
 
+def get_session_master_key() -> bytes:
+    """Restituisce la chiave del vault sbloccata al login, conservata nella sessione lato server."""
+    return session['chiave_master']
+
+
+def encode_cursor(cursor: int) -> str:
+    """Codifica il cursore di paginazione (id dell'ultima voce) in una stringa per l'URL."""
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(value: str) -> Optional[int]:
+    """Decodifica il cursore di paginazione; restituisce None se assente o non valido."""
+    if not value:
+        return None
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(value.encode())))
+    except (ValueError, TypeError):
+        return None
+
+
+def flash_strength_warning(password: str) -> None:
+    """Avvisa, senza impedire il salvataggio, se la password è debole o compare in violazioni note."""
+    try:
+        report = PasswordStrength.check(password)
+    except (ValueError, OSError) as e:
+        logging.error(f"Verifica della robustezza non riuscita: {e}")
+        return
+    
+    if report.is_breached:
+        flash(f'Attenzione: questa password compare {report.breach_count} volte in violazioni note. Ti consigliamo di cambiarla.', 'error')
+    elif report.is_weak:
+        flash(f'Attenzione: la password è {report.label}. Ti consigliamo di usarne una più lunga o generata.', 'info')
+
+
 # Route dell'applicazione
 @main.route('/')
 def index():
@@ -60,10 +131,34 @@ def login():
         
         user = UserManager.get_user_by_username(username)
         
-        if user and check_password_hash(user['password_hash'], password):
+        if user and AuthWorkerPool.check_password_hash(user['password_hash'], password):
+            if RekeyService.has_pending(user['id']):
+                response = complete_pending_rekey(user['id'], password)
+                if response is not None:
+                    return response
+            
+            try:
+                # Al primo accesso dopo l'aggiornamento il vault passa alla cifratura con chiave dati,
+                # poi hash e KDF vengono portati ai costi configurati se sono cambiati
+                UserManager.ensure_data_key(user['id'], password)
+                UserManager.upgrade_credentials(user['id'], password)
+            except (ValueError, sqlite3.Error) as e:
+                logging.error(f"Migrazione alla chiave dati fallita per l'utente {user['id']}: {e}")
+                flash('Errore durante l\'aggiornamento del vault. Riprova ad accedere.', 'error')
+                return render_template('login.html')
+            
+            # Nuovo identificativo di sessione a ogni login; la chiave del vault viene derivata
+            # una sola volta qui e resta sul server, mai nel cookie
+            session.clear()
+            session.regenerate()
             session['utente_id'] = user['id']
             session['username'] = user['username']
-            session['user_password'] = password
+            session['chiave_master'] = UserManager.get_master_key(user['id'], password)
+            session['epoca_sessioni'] = UserManager.get_session_epoch(user['id'])
+            
+            if Config.FORMAT_MIGRATION_IN_BACKGROUND:
+                # Le voci ancora nel vecchio formato vengono riscritte senza bloccare la richiesta
+                RekeyService.schedule_format_upgrade(user['id'], get_session_master_key())
             flash('Accesso effettuato con successo!', 'success')
             return redirect(url_for('main.dashboard'))
         else:
@@ -72,6 +167,27 @@ def login():
     return render_template('login.html')
 
 
+def complete_pending_rekey(user_id: int, current_password: str):
+    """
+    Completa una ri-crittografia rimasta interrotta. Restituisce la risposta da inviare
+    se l'utente deve accedere di nuovo, altrimenti None.
+    """
+    try:
+        result = RekeyService.resume(user_id, UserManager.get_master_key(user_id, current_password))
+    except (ValueError, sqlite3.Error) as e:
+        logging.error(f"Impossibile riprendere la ri-crittografia per l'utente {user_id}: {e}")
+        flash('Impossibile completare il cambio della password master rimasto in sospeso. Contatta il supporto.', 'error')
+        return redirect(url_for('main.login'))
+    
+    logging.info(f"Ri-crittografia ripresa e completata per l'utente {user_id}: {result.processed} voci")
+    if not result.password_changed:
+        return None
+    
+    session.clear()
+    flash('Il cambio della password master era stato interrotto ed è stato completato. Accedi con la nuova password.', 'info')
+    return redirect(url_for('main.login'))
+
+
 @main.route('/registrazione', methods=['GET', 'POST'])
 def registrazione():
     """Gestisce la registrazione di nuovi utenti."""
@@ -108,18 +224,97 @@ def registrazione():
 @main.route('/dashboard')
 @login_required
 def dashboard():
-    """Dashboard principale con elenco password."""
+    """Dashboard principale con elenco paginato e ricerca delle password (solo metadati)."""
+    search = request.args.get('q', '').strip()
+    cursor = decode_cursor(request.args.get('dopo', ''))
+    password_list, next_cursor = PasswordService.get_user_passwords_page(
+        session['utente_id'], get_session_master_key(), after=cursor, search=search
+    )
+    return render_template(
+        'dashboard.html',
+        password_salvate=password_list,
+        ricerca=search,
+        pagina_successiva=encode_cursor(next_cursor) if next_cursor else None,
+        prima_pagina=cursor is None,
+        igiene=PasswordService.get_vault_hygiene(session['utente_id']),
+    )
+
+
+@main.route('/api/password')
+@login_required
+def api_elenco_password():
+    """
+    Elenco paginato delle voci in JSON (solo metadati), con la stessa ricerca della dashboard.
+    Con il parametro `sito` restituisce invece le voci con quel nome del sito esatto.
+    """
+    site_name = request.args.get('sito', '').strip()
+    if site_name:
+        password_list = PasswordService.find_by_site_name(
+            session['utente_id'], site_name, get_session_master_key()
+        )
+        return jsonify(voci=password_list, pagina_successiva=None)
+    
+    cursor = decode_cursor(request.args.get('dopo', ''))
+    password_list, next_cursor = PasswordService.get_user_passwords_page(
+        session['utente_id'], get_session_master_key(), after=cursor, search=request.args.get('q', '').strip()
+    )
+    return jsonify(
+        voci=password_list,
+        pagina_successiva=encode_cursor(next_cursor) if next_cursor else None,
+    )
+
+
+@main.route('/api/password/<int:password_id>')
+@login_required
+def api_rivela_password(password_id):
+    """Decrittografa su richiesta una singola password (pulsanti Mostra/Copia della dashboard)."""
     try:
-        master_key = UserManager.get_master_key(session['utente_id'], session['user_password'])
-        password_list = PasswordService.get_user_passwords(session['utente_id'], master_key)
-        return render_template('dashboard.html', password_salvate=password_list)
-        
+        master_key = get_session_master_key()
+        password_decrypted = PasswordService.get_decrypted_password(password_id, session['utente_id'], master_key)
     except ValueError as e:
-        # Errore SPECIFICO: molto probabilmente un errore di decrittografia su una o più password.
-        logging.error(f"Errore di decrittografia per l'utente {session['utente_id']}: {e}")
-        flash('Errore durante la decrittografia di una o più password salvate. Verifica la tua password master o contatta il supporto.', 'error')
-        # Il logout qui è una scelta di design: se la master key non funziona, l'utente deve riloggarsi.
-        return redirect(url_for('main.logout'))
+        logging.error(f"Errore di decrittografia della password ID {password_id} per l'utente {session['utente_id']}: {e}")
+        return jsonify(errore='Impossibile decifrare la password'), 422
+    
+    if password_decrypted is None:
+        return jsonify(errore='Password non trovata'), 404
+    
+    response = jsonify(id=password_id, password_sito=password_decrypted)
+    # La password in chiaro non deve finire in nessuna cache
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@main.route('/api/sync')
+@login_required
+def api_sincronizza():
+    """
+    Sincronizzazione incrementale per i client (estensione, CLI): con `dal` uguale alla
+    revisione ricevuta l'ultima volta restituisce solo le voci cambiate e gli id di quelle
+    eliminate; se `altro` è vero si ripete la richiesta con la nuova `revisione`.
+    L'ETag dipende dalla revisione del vault e dai parametri: ripetendo la stessa richiesta
+    con If-None-Match, se il vault non è cambiato risponde 304 senza leggere né decifrare le voci.
+    """
+    since = request.args.get('dal', 0, type=int)
+    limit = request.args.get('limite', Config.SYNC_PAGE_SIZE, type=int)
+    if since < 0 or not 1 <= limit <= Config.SYNC_PAGE_SIZE:
+        return jsonify(errore=f'dal deve essere >= 0 e limite tra 1 e {Config.SYNC_PAGE_SIZE}'), 400
+    
+    user_id = session['utente_id']
+    etag = f'{PasswordService.get_vault_revision(user_id)}-{since}-{limit}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        changes = PasswordService.get_changes_since(user_id, get_session_master_key(), since, limit)
+        response = jsonify(
+            revisione=changes.revision,
+            altro=changes.more,
+            voci=changes.entries,
+            eliminate=changes.deleted,
+        )
+    response.set_etag(etag)
+    # Le risposte contengono password in chiaro: il client le conserva a modo suo, nessuna cache HTTP
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 @main.route('/aggiungi', methods=['GET', 'POST'])
@@ -150,10 +345,11 @@ def aggiungi_password():
             return render_template('aggiungi.html')
         
         try:
-            master_key = UserManager.get_master_key(session['utente_id'], session['user_password'])
+            master_key = get_session_master_key()
             
             if PasswordService.add_password(session['utente_id'], site_name, site_username, site_password, master_key):
                 flash('Password aggiunta e crittografata con successo!', 'success')
+                flash_strength_warning(site_password)
                 return redirect(url_for('main.dashboard'))
             else:
                 # Questo è un caso generico di fallimento dal service layer.
@@ -176,22 +372,19 @@ def aggiungi_password():
 def modifica_password(password_id):
     """Modifica una password esistente."""
     try:
-        master_key = UserManager.get_master_key(session['utente_id'], session['user_password'])
-        password_entry_raw = PasswordService.get_password_by_id(password_id, session['utente_id'])
-        
-        if not password_entry_raw:
-            flash('Password non trovata.', 'error')
-            return redirect(url_for('main.dashboard'))
+        master_key = get_session_master_key()
         
         # Gestiamo qui l'errore di decrittografia in modo specifico
         try:
-            password_decrypted = CryptographyManager.decrypt_password(password_entry_raw['password_sito_encrypted'], master_key)
+            password_entry = PasswordService.get_decrypted_entry(password_id, session['utente_id'], master_key)
         except ValueError:
             logging.error(f"Impossibile decifrare la password con ID {password_id} per la modifica.")
             flash('Impossibile decifrare la password per la modifica. La password master potrebbe essere errata.', 'error')
             return redirect(url_for('main.dashboard'))
-
-        password_entry = {'id': password_entry_raw['id'], 'nome_sito': password_entry_raw['nome_sito'], 'username_sito': password_entry_raw['username_sito'], 'password_sito': password_decrypted}
+        
+        if not password_entry:
+            flash('Password non trovata.', 'error')
+            return redirect(url_for('main.dashboard'))
         
         if request.method == 'POST':
             site_name = request.form.get('nome_sito', '').strip()
@@ -204,6 +397,7 @@ def modifica_password(password_id):
             
             if PasswordService.update_password(password_id, session['utente_id'], site_name, site_username, site_password, master_key):
                 flash('Password modificata e crittografata con successo!', 'success')
+                flash_strength_warning(site_password)
                 return redirect(url_for('main.dashboard'))
             else:
                 flash('Errore durante la modifica della password.', 'error')
@@ -230,7 +424,7 @@ def elimina_password(password_id):
 
 @main.route('/logout')
 def logout():
-    """Effettua il logout pulendo la sessione."""
+    """Effettua il logout eliminando la sessione dal server."""
     session.clear()
     flash('Logout effettuato con successo', 'success')
     return redirect(url_for('main.login'))
@@ -239,7 +433,7 @@ def logout():
 @main.route('/cambia_password_master', methods=['GET', 'POST'])
 @login_required
 def cambia_password_master():
-    """Cambia la password master dell'utente ri-crittografando tutte le password."""
+    """Cambia la password master dell'utente ri-cifrando la sua chiave dati."""
     if request.method == 'POST':
         current_password = request.form.get('password_attuale', '')
         new_password = request.form.get('nuova_password', '')
@@ -254,40 +448,29 @@ def cambia_password_master():
             return render_template('cambia_password.html')
         
         user = UserManager.get_user_by_id(session['utente_id'])
-        if not user or not check_password_hash(user['password_hash'], current_password):
+        if not user or not AuthWorkerPool.check_password_hash(user['password_hash'], current_password):
             flash('Password attuale non corretta.', 'error')
             return render_template('cambia_password.html')
         
+        if RekeyService.has_pending(session['utente_id']):
+            response = complete_pending_rekey(session['utente_id'], current_password)
+            if response is not None:
+                return response
+        
         try:
-            # Questa operazione è critica e va eseguita come una transazione
-            with DatabaseManager.get_connection() as conn:
-                old_master_key = UserManager.get_master_key(session['utente_id'], current_password)
-                saved_passwords = conn.execute('SELECT * FROM password_salvate WHERE utente_id = ?', (session['utente_id'],)).fetchall()
-                
-                passwords_decrypted = []
-                for row in saved_passwords:
-                    password_decrypted = CryptographyManager.decrypt_password(row['password_sito_encrypted'], old_master_key)
-                    passwords_decrypted.append({'id': row['id'], 'password': password_decrypted})
-                
-                new_salt = CryptographyManager.generate_salt()
-                new_password_hash = generate_password_hash(new_password)
-                new_master_key = CryptographyManager.derive_key(new_password, new_salt)
-                
-                conn.execute('UPDATE utenti SET password_hash = ?, encryption_salt = ? WHERE id = ?', (new_password_hash, new_salt, session['utente_id']))
-                
-                for pwd_data in passwords_decrypted:
-                    new_encrypted_password = CryptographyManager.encrypt_password(pwd_data['password'], new_master_key)
-                    conn.execute('UPDATE password_salvate SET password_sito_encrypted = ? WHERE id = ?', (new_encrypted_password, pwd_data['id']))
-                
-                # Il commit è gestito automaticamente dal context manager 'with'. Se c'è un errore, viene fatto un rollback.
+            # Viene ri-cifrata solo la chiave dati: le password salvate restano invariate
+            data_key = UserManager.change_master_password(session['utente_id'], current_password, new_password)
             
-            session['user_password'] = new_password
-            flash('Password master cambiata con successo! Tutte le password sono state ri-crittografate.', 'success')
+            # Le altre sessioni sono state revocate; questa prosegue con un nuovo identificativo
+            session.regenerate()
+            session['chiave_master'] = data_key
+            session['epoca_sessioni'] = UserManager.get_session_epoch(session['utente_id'])
+            flash('Password master cambiata con successo!', 'success')
             return redirect(url_for('main.dashboard'))
             
         except ValueError as e:
             logging.error(f"Errore di decrittografia durante il cambio della master password: {e}")
-            flash('Errore durante la decrittografia delle vecchie password. Operazione annullata.', 'error')
+            flash('Errore durante la decrittografia della chiave del vault. Operazione annullata.', 'error')
         except sqlite3.Error as e:
             logging.error(f"Errore database durante il cambio della master password: {e}")
             flash('Errore del database. Operazione annullata.', 'error')
@@ -297,18 +480,181 @@ def cambia_password_master():
     return render_template('cambia_password.html')
 
 
+@main.route('/importa_esporta')
+@login_required
+def importa_esporta():
+    """Pagina di importazione ed esportazione del vault."""
+    return render_template('importa_esporta.html')
+
+
+@main.route('/importa', methods=['POST'])
+@login_required
+def importa():
+    """Importa le voci da un CSV di un altro gestore o da un'esportazione cifrata."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Seleziona un file da importare.', 'error')
+        return redirect(url_for('main.importa_esporta'))
+    
+    # Il file viene letto in streaming, senza caricarlo tutto in memoria
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        if request.form.get('formato') == 'json':
+            result = VaultTransferService.import_encrypted(
+                session['utente_id'], stream, get_session_master_key(), request.form.get('passphrase', '')
+            )
+        else:
+            result = VaultTransferService.import_csv(session['utente_id'], stream, get_session_master_key())
+    except (ValueError, csv.Error) as e:
+        flash(f'Importazione non riuscita: {e}', 'error')
+        return redirect(url_for('main.importa_esporta'))
+    except sqlite3.Error as e:
+        logging.error(f"Errore database durante l'importazione: {e}")
+        flash('Errore del database durante l\'importazione. Le voci già inserite sono state salvate.', 'error')
+        return redirect(url_for('main.importa_esporta'))
+    
+    if result.skipped:
+        flash(f'Importate {result.imported} voci, {result.skipped} righe incomplete saltate.', 'info')
+    else:
+        flash(f'Importate {result.imported} voci.', 'success')
+    return redirect(url_for('main.dashboard'))
+
+
+@main.route('/esporta', methods=['POST'])
+@login_required
+def esporta():
+    """Scarica il vault cifrato con una passphrase scelta per l'esportazione."""
+    passphrase = request.form.get('passphrase', '')
+    if len(passphrase) < Config.MIN_PASSWORD_LENGTH:
+        flash(f'La passphrase deve essere di almeno {Config.MIN_PASSWORD_LENGTH} caratteri.', 'error')
+        return redirect(url_for('main.importa_esporta'))
+    if passphrase != request.form.get('conferma_passphrase', ''):
+        flash('Le passphrase non corrispondono.', 'error')
+        return redirect(url_for('main.importa_esporta'))
+    
+    lines = VaultTransferService.export_encrypted(session['utente_id'], get_session_master_key(), passphrase)
+    # La prima riga (derivazione della chiave) si calcola subito, così gli errori diventano una risposta normale
+    header = next(lines)
+    
+    def generate():
+        yield header
+        yield from lines
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=vault_esportato.jsonl'}
+    )
+
+
 @main.route('/genera_password', methods=['GET', 'POST'])
 @login_required
 def genera_password():
-    """Pagina dedicata per la generazione di password."""
+    """Pagina dedicata per la generazione di password e passphrase."""
     password_generata = None
+    entropia = None
+    modalita = request.form.get('modalita', 'password')
     if request.method == 'POST':
-        length = int(request.form.get('lunghezza', 16))
-        use_special_chars = request.form.get('caratteri_speciali') == 'on'
-        use_uppercase = request.form.get('usa_maiuscole', 'on') == 'on'
-        use_numbers = request.form.get('usa_numeri', 'on') == 'on'
-        password_generata = PasswordGenerator.generate_secure_password(length=length, use_special_chars=use_special_chars, use_uppercase=use_uppercase, use_numbers=use_numbers)
-    return render_template('genera_password.html', password=password_generata)
+        if modalita == 'passphrase':
+            try:
+                passphrase = PassphraseGenerator.generate(
+                    words=int(request.form.get('parole', Config.PASSPHRASE_DEFAULT_WORDS)),
+                    separator=request.form.get('separatore', '-'),
+                    capitalize=request.form.get('maiuscole_iniziali') == 'on',
+                    add_number=request.form.get('aggiungi_numero') == 'on',
+                )
+                password_generata, entropia = passphrase.text, passphrase.entropy_bits
+            except ValueError:
+                flash('Opzioni della passphrase non valide.', 'error')
+        else:
+            length = int(request.form.get('lunghezza', 16))
+            use_special_chars = request.form.get('caratteri_speciali') == 'on'
+            use_uppercase = request.form.get('usa_maiuscole', 'on') == 'on'
+            use_numbers = request.form.get('usa_numeri', 'on') == 'on'
+            password_generata = PasswordGenerator.generate_secure_password(length=length, use_special_chars=use_special_chars, use_uppercase=use_uppercase, use_numbers=use_numbers)
+            entropia = PasswordStrength.estimate_entropy(password_generata)
+    return render_template('genera_password.html', password=password_generata, entropia=entropia,
+                           modalita=modalita, opzioni=request.form, separatori=SEPARATORS)
+
+
+@main.route('/api/genera_password', methods=['POST'])
+@login_required
+def api_genera_password():
+    """
+    Genera in blocco password casuali (es. per creare account di servizio).
+    Accetta JSON: quantita, lunghezza, caratteri_speciali, usa_maiuscole, usa_numeri.
+    """
+    options = request.get_json(silent=True) or {}
+    try:
+        count = int(options.get('quantita', 1))
+        length = int(options.get('lunghezza', 16))
+    except (TypeError, ValueError):
+        return jsonify(errore='quantita e lunghezza devono essere numeri interi'), 400
+    
+    if not 1 <= count <= Config.PASSWORD_BATCH_MAX:
+        return jsonify(errore=f'quantita deve essere tra 1 e {Config.PASSWORD_BATCH_MAX}'), 400
+    
+    passwords = PasswordGenerator.generate_batch(
+        count,
+        length=length,
+        use_special_chars=bool(options.get('caratteri_speciali', True)),
+        use_uppercase=bool(options.get('usa_maiuscole', True)),
+        use_numbers=bool(options.get('usa_numeri', True)),
+    )
+    response = jsonify(password=passwords)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@main.route('/api/verifica_password', methods=['POST'])
+@login_required
+def api_verifica_password():
+    """Valuta una password (JSON: password) senza salvarla: entropia stimata, punteggio e violazioni note."""
+    password = (request.get_json(silent=True) or {}).get('password')
+    if not isinstance(password, str) or not password:
+        return jsonify(errore='password mancante'), 400
+    
+    try:
+        report = PasswordStrength.check(password)
+    except (ValueError, OSError) as e:
+        logging.error(f"Verifica della robustezza non riuscita: {e}")
+        return jsonify(errore='Verifica della password non disponibile'), 503
+    response = jsonify(
+        entropia=round(report.entropy_bits, 1),
+        punteggio=report.score,
+        valutazione=report.label,
+        violazioni=report.breach_count,
+    )
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@main.route('/controllo_sicurezza')
+@login_required
+def controllo_sicurezza():
+    """Controllo di tutto il vault: password deboli, compromesse, riutilizzate o vecchie."""
+    total = 0
+    findings = []
+    try:
+        for finding in VaultAuditService.audit_vault(session['utente_id'], get_session_master_key()):
+            total += 1
+            if finding.has_issues:
+                findings.append(finding)
+    except (ValueError, OSError) as e:
+        logging.error(f"Controllo di sicurezza non riuscito per l'utente {session['utente_id']}: {e}")
+        flash('Impossibile completare il controllo di sicurezza.', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    return render_template(
+        'controllo_sicurezza.html',
+        totale=total,
+        segnalazioni=findings,
+        compromesse=sum(1 for finding in findings if finding.report.is_breached),
+        riutilizzate=sum(1 for finding in findings if finding.reused),
+        vecchie=sum(1 for finding in findings if finding.stale),
+        giorni_validita=Config.PASSWORD_MAX_AGE_DAYS,
+        corpus_disponibile=PasswordStrength.corpus() is not None,
+    )
 
 
 @main.route('/shutdown')
@@ -316,6 +662,11 @@ def genera_password():
 def shutdown():
     """Spegne il server (solo per richieste locali)."""
     if request.remote_addr in ('127.0.0.1', 'localhost', '::1'):
-        os.kill(os.getpid(), signal.SIGINT)
+        master_pid = current_app.config.get('SERVER_MASTER_PID')
+        if master_pid:
+            # Avviato con serve.py: il processo master ferma i worker in modo ordinato
+            os.kill(master_pid, signal.SIGTERM)
+        else:
+            os.kill(os.getpid(), signal.SIGINT)
         return "Server in fase di spegnimento..."
     return "Operazione non permessa", 403
\ No newline at end of file
@@ -0,0 +1,40 @@
+import sqlite3
+from typing import Iterable, List, Sequence, Tuple
+
+
+class SearchIndex:
+    """
+    Accesso alla tabella `indice_ricerca`, che associa i token dell'indice cieco
+    (vedi BlindIndex) alle voci del vault. Le funzioni non fanno commit: vanno
+    chiamate nella stessa transazione che scrive la voce.
+    """
+
+    @staticmethod
+    def replace_tokens(conn: sqlite3.Connection, user_id: int,
+                       entries: Iterable[Tuple[int, Iterable[bytes]]]) -> None:
+        """Sostituisce i token delle voci indicate, date come coppie (id voce, token)"""
+        entries = list(entries)
+        SearchIndex.delete_tokens(conn, [entry_id for entry_id, _ in entries])
+        conn.executemany(
+            'INSERT OR IGNORE INTO indice_ricerca (utente_id, token, voce_id) VALUES (?, ?, ?)',
+            [(user_id, token, entry_id) for entry_id, tokens in entries for token in tokens]
+        )
+
+    @staticmethod
+    def delete_tokens(conn: sqlite3.Connection, entry_ids: Sequence[int]) -> None:
+        """Elimina i token delle voci indicate"""
+        conn.executemany('DELETE FROM indice_ricerca WHERE voce_id = ?', [(entry_id,) for entry_id in entry_ids])
+
+    @staticmethod
+    def search_condition(user_id: int, tokens: List[bytes]) -> Tuple[str, list]:
+        """
+        Condizione SQL (con i relativi parametri) vera per le voci che hanno tutti i token,
+        da combinare con una query su `password_salvate`
+        """
+        placeholders = ', '.join('?' * len(tokens))
+        return (
+            f'id IN (SELECT voce_id FROM indice_ricerca WHERE utente_id = ? AND token IN ({placeholders}) '
+            'GROUP BY voce_id HAVING COUNT(*) = ?)',
+            [user_id, *tokens, len(tokens)],
+        )
+
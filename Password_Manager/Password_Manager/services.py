@@ -1,9 +1,49 @@
+import hashlib
+import hmac
+import json
+import logging
 import sqlite3
-from typing import Dict, List, Optional
-from werkzeug.security import generate_password_hash, check_password_hash
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 
+from config import Config
 from .database import DatabaseManager
-from .core.cryptography import CryptographyManager
+from .core import metrics
+from .core.auth_pool import AuthWorkerPool
+from .core.blind_index import NGRAM_LENGTH, BlindIndex
+from .core.cache import TTLCache
+from .core.cryptography import CipherContext, CryptographyManager
+from .core.kdf import KeyDerivation
+from .rekey import RekeyService
+from .revisions import RevisionLog
+from .search_index import SearchIndex
+
+
+class VaultHygiene(NamedTuple):
+    """Riepilogo di password riutilizzate e vecchie, calcolato senza decifrare il vault"""
+    reused_entries: int  # voci la cui password compare anche in altre voci
+    reused_groups: int  # password distinte usate in più voci
+    stale_entries: int  # voci non modificate da più di PASSWORD_MAX_AGE_DAYS giorni
+    unchecked_entries: int  # voci senza impronta, in attesa della conversione al login
+    
+    @property
+    def has_issues(self) -> bool:
+        return bool(self.reused_entries or self.stale_entries)
+
+
+class VaultChanges(NamedTuple):
+    """Modifiche al vault successive a una revisione, per la sincronizzazione dei client"""
+    revision: int  # revisione da cui ripartire alla prossima richiesta
+    entries: List[Dict]  # voci aggiunte o modificate, decifrate
+    deleted: List[int]  # id delle voci eliminate
+    more: bool  # altre modifiche oltre il limite: richiedere di nuovo da `revision`
+
+
+# Riepiloghi per utente: invalidati dalle scritture di questo processo, scadono per le altre
+_hygiene_cache = TTLCache(max_entries=Config.AUDIT_CACHE_MAX_ENTRIES, ttl=Config.AUDIT_CACHE_TTL)
+
+# Pagine di metadati già decifrate, per utente: (revisione del vault, impronta della chiave, pagine).
+# Contengono solo nomi dei siti, username e date, mai le password
+_page_cache = TTLCache(max_entries=Config.PAGE_CACHE_MAX_USERS, ttl=Config.PAGE_CACHE_TTL)
 
 
 class UserManager:
@@ -11,75 +51,211 @@ class UserManager:
     
     @staticmethod
     def get_user_by_username(username: str) -> Optional[sqlite3.Row]:
-        """Recupera un utente dal database tramite username"""
-        with DatabaseManager.get_connection() as conn:
-            return conn.execute(
-                'SELECT * FROM utenti WHERE username = ?', (username,)
-            ).fetchone()
+        """Recupera un utente tramite username: la directory indica id e shard in cui cercarlo"""
+        user_id = DatabaseManager.find_user_id(username)
+        if user_id is None:
+            return None
+        return UserManager.get_user_by_id(user_id)
     
     @staticmethod
     def get_user_by_id(user_id: int) -> Optional[sqlite3.Row]:
         """Recupera un utente dal database tramite ID"""
-        with DatabaseManager.get_connection() as conn:
+        with DatabaseManager.get_connection(user_id) as conn:
             return conn.execute(
                 'SELECT * FROM utenti WHERE id = ?', (user_id,)
             ).fetchone()
     
+    @staticmethod
+    def get_session_epoch(user_id: int) -> Optional[int]:
+        """
+        Epoca corrente delle sessioni dell'utente (None se l'utente non esiste): aumenta a ogni
+        cambio della password master e invalida le sessioni aperte con un valore precedente
+        """
+        with DatabaseManager.get_connection(user_id) as conn:
+            row = conn.execute('SELECT epoca_sessioni FROM utenti WHERE id = ?', (user_id,)).fetchone()
+        return row['epoca_sessioni'] if row is not None else None
+    
     @staticmethod
     def create_user(username: str, password: str) -> bool:
         """
         Crea un nuovo utente nel database
         """
+        password_hash = AuthWorkerPool.generate_password_hash(password)
+        encryption_salt, kdf_algorithm, kdf_params, wrapped_data_key = UserManager._protect_data_key(
+            CryptographyManager.generate_data_key(), password
+        )
+        
         try:
-            password_hash = generate_password_hash(password)
-            encryption_salt = CryptographyManager.generate_salt()
-            
-            with DatabaseManager.get_connection() as conn:
-                conn.execute(
-                    'INSERT INTO utenti (username, password_hash, encryption_salt) VALUES (?, ?, ?)',
-                    (username, password_hash, encryption_salt)
-                )
-                conn.commit()
-            return True
+            user_id = DatabaseManager.register_user(username)
         except sqlite3.IntegrityError:
             return False
+        
+        try:
+            with DatabaseManager.get_connection(user_id) as conn:
+                conn.execute(
+                    'INSERT INTO utenti (id, username, password_hash, encryption_salt, chiave_dati_cifrata, kdf_algoritmo, kdf_parametri) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (user_id, username, password_hash, encryption_salt, wrapped_data_key, kdf_algorithm, kdf_params)
+                )
+        except Exception:
+            # Lo username torna disponibile: la directory non deve indicare un utente inesistente
+            DatabaseManager.unregister_user(user_id)
+            raise
+        return True
     
     @staticmethod
     def get_master_key(user_id: int, password: str) -> bytes:
         """
-        Ottiene la chiave master dell'utente per la crittografia
+        Ottiene la chiave con cui sono cifrate le password dell'utente.
+        
+        È la chiave dati dell'utente, decifrata con la chiave derivata dalla password master;
+        per i vault non ancora migrati è direttamente la chiave derivata.
+        """
+        user = UserManager.get_user_by_id(user_id)
+        if not user:
+            raise ValueError("Utente non trovato")
+        
+        key_encryption_key = UserManager._derive_key_encryption_key(user, password)
+        if user['chiave_dati_cifrata'] is None:
+            return key_encryption_key
+        return CryptographyManager.unwrap_key(user['chiave_dati_cifrata'], key_encryption_key)
+    
+    @staticmethod
+    def ensure_data_key(user_id: int, password: str) -> None:
+        """
+        Migra un vault esistente alla cifratura con chiave dati: genera la chiave dati e
+        ri-crittografa una sola volta tutte le password dell'utente con essa
         """
         user = UserManager.get_user_by_id(user_id)
         if not user:
             raise ValueError("Utente non trovato")
+        if user['chiave_dati_cifrata'] is not None:
+            return
         
-        return CryptographyManager.derive_key(password, user['encryption_salt'])
+        key_encryption_key = UserManager._derive_key_encryption_key(user, password)
+        RekeyService.change_master_key(
+            user_id, key_encryption_key, CryptographyManager.generate_data_key(), install_data_key=True
+        )
+        PasswordService.invalidate_user_caches(user_id)
+    
+    @staticmethod
+    def change_master_password(user_id: int, current_password: str, new_password: str) -> bytes:
+        """
+        Cambia la password master ri-cifrando soltanto la chiave dati dell'utente:
+        le password salvate non vengono toccate. Le altre sessioni dell'utente vengono
+        revocate (la chiave dati non cambia, quindi resterebbero valide). Restituisce la chiave dati.
+        """
+        UserManager.ensure_data_key(user_id, current_password)
+        data_key = UserManager.get_master_key(user_id, current_password)
+        
+        new_password_hash = AuthWorkerPool.generate_password_hash(new_password)
+        UserManager._store_data_key(user_id, data_key, new_password, new_password_hash, revoke_sessions=True)
+        PasswordService.invalidate_user_caches(user_id)
+        return data_key
+    
+    @staticmethod
+    def upgrade_credentials(user_id: int, password: str) -> bool:
+        """
+        Aggiorna al login hash della password e parametri della KDF se quelli configurati
+        sono cambiati. Grazie alla chiave dati basta ri-cifrare un solo valore.
+        Restituisce True se le credenziali sono state aggiornate.
+        """
+        user = UserManager.get_user_by_id(user_id)
+        if not user or user['chiave_dati_cifrata'] is None:
+            return False
+        
+        hash_outdated = not user['password_hash'].startswith(Config.PASSWORD_HASH_METHOD + '$')
+        kdf_outdated = (
+            user['kdf_algoritmo'] != KeyDerivation.default_algorithm()
+            or json.loads(user['kdf_parametri']) != KeyDerivation.default_params()
+        )
+        if not hash_outdated and not kdf_outdated:
+            return False
+        
+        data_key = UserManager.get_master_key(user_id, password)
+        new_password_hash = (
+            AuthWorkerPool.generate_password_hash(password)
+            if hash_outdated else user['password_hash']
+        )
+        UserManager._store_data_key(user_id, data_key, password, new_password_hash)
+        return True
+    
+    @staticmethod
+    def _derive_key_encryption_key(user: sqlite3.Row, password: str) -> bytes:
+        """Deriva dalla password la chiave che protegge la chiave dati, con i costi salvati per l'utente"""
+        return AuthWorkerPool.derive_key(
+            password, user['encryption_salt'], user['kdf_algoritmo'], json.loads(user['kdf_parametri'])
+        )
+    
+    @staticmethod
+    def _protect_data_key(data_key: bytes, password: str) -> Tuple[bytes, str, str, bytes]:
+        """
+        Cifra la chiave dati con una chiave derivata dalla password con un nuovo salt e i costi
+        correnti. Restituisce salt, algoritmo, parametri (JSON) e chiave dati cifrata.
+        """
+        salt = CryptographyManager.generate_salt()
+        algorithm = KeyDerivation.default_algorithm()
+        params = KeyDerivation.default_params()
+        wrapped_data_key = CryptographyManager.wrap_key(
+            data_key, AuthWorkerPool.derive_key(password, salt, algorithm, params)
+        )
+        return salt, algorithm, json.dumps(params), wrapped_data_key
+    
+    @staticmethod
+    def _store_data_key(user_id: int, data_key: bytes, password: str, password_hash: str,
+                        revoke_sessions: bool = False) -> None:
+        """
+        Salva la chiave dati protetta dalla password indicata insieme al suo hash di login;
+        con `revoke_sessions` aumenta nella stessa transazione l'epoca delle sessioni
+        """
+        salt, kdf_algorithm, kdf_params, wrapped_data_key = UserManager._protect_data_key(data_key, password)
+        with DatabaseManager.get_connection(user_id) as conn:
+            conn.execute(
+                'UPDATE utenti SET password_hash = ?, encryption_salt = ?, chiave_dati_cifrata = ?, '
+                'kdf_algoritmo = ?, kdf_parametri = ?, epoca_sessioni = epoca_sessioni + ? WHERE id = ?',
+                (password_hash, salt, wrapped_data_key, kdf_algorithm, kdf_params, int(revoke_sessions), user_id)
+            )
 
 
 class PasswordService:
-    """Servizio per la gestione delle password salvate"""
+    """
+    Servizio per la gestione delle password salvate.
+    
+    Nome del sito e username sono salvati cifrati (`metadati_cifrati`); la ricerca usa
+    l'indice cieco in `indice_ricerca` e non richiede di decifrare l'intero vault.
+    """
+    
+    @staticmethod
+    def entry_metadata(entry: sqlite3.Row, cipher: CipherContext) -> Tuple[str, str]:
+        """
+        Restituisce (nome del sito, username) di una voce, decifrando i metadati
+        o leggendo le colonne in chiaro se la voce non è ancora stata convertita
+        """
+        if entry['metadati_cifrati'] is None:
+            return entry['nome_sito'], entry['username_sito']
+        return cipher.decrypt_metadata(entry['metadati_cifrati'])
     
     @staticmethod
     def get_user_passwords(user_id: int, master_key: bytes) -> List[Dict]:
         """
         Recupera e decrittografa tutte le password di un utente
         """
-        with DatabaseManager.get_connection() as conn:
+        with DatabaseManager.get_connection(user_id) as conn:
             password_entries = conn.execute(
-                'SELECT * FROM password_salvate WHERE utente_id = ? ORDER BY nome_sito',
+                'SELECT * FROM password_salvate WHERE utente_id = ? ORDER BY id',
                 (user_id,)
             ).fetchall()
         
+        cipher = CipherContext(master_key)
         decrypted_passwords = []
         for entry in password_entries:
             try:
-                decrypted_password = CryptographyManager.decrypt_password(
-                    entry['password_sito_encrypted'], master_key
-                )
+                site_name, site_username = PasswordService.entry_metadata(entry, cipher)
+                decrypted_password = cipher.decrypt(entry['password_sito_encrypted'])
                 decrypted_passwords.append({
                     'id': entry['id'],
-                    'nome_sito': entry['nome_sito'],
-                    'username_sito': entry['username_sito'],
+                    'nome_sito': site_name,
+                    'username_sito': site_username,
                     'password_sito': decrypted_password,
                     'data_creazione': entry['data_creazione'],
                     'data_modifica': entry['data_modifica']
@@ -89,19 +265,247 @@ class PasswordService:
         
         return decrypted_passwords
     
+    @staticmethod
+    def get_user_passwords_page(user_id: int, master_key: bytes, after: Optional[int] = None,
+                                search: str = '', limit: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Recupera una pagina di voci in ordine di id, decifrando solo i metadati.
+        
+        La paginazione è a cursore: `after` è l'id dell'ultima voce della pagina precedente.
+        La ricerca filtra per nome sito o username tramite l'indice cieco: sottostringa
+        per ricerche di almeno tre caratteri, prefisso per quelle più corte.
+        Restituisce le voci della pagina e il cursore della pagina successiva (None se è l'ultima).
+        
+        Le pagine restano in cache finché la revisione del vault non cambia: la revisione si
+        legge con una ricerca per chiave primaria, quindi anche le scritture fatte da altri
+        worker rendono subito obsolete le pagine salvate.
+        """
+        limit = limit or Config.DASHBOARD_PAGE_SIZE
+        page_key = (after, search, limit)
+        key_digest = hashlib.sha256(master_key).digest()
+        query = ('SELECT id, nome_sito, username_sito, metadati_cifrati, data_creazione, data_modifica '
+                 'FROM password_salvate WHERE utente_id = ? AND id > ?')
+        search_params: list = []
+        
+        if search:
+            condition, condition_params = SearchIndex.search_condition(
+                user_id, BlindIndex(master_key).search_tokens(search)
+            )
+            # Le voci non ancora convertite non hanno token: per loro si cerca nelle colonne in chiaro
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            query += (f" AND ({condition} OR (metadati_cifrati IS NULL AND "
+                      "(nome_sito LIKE ? ESCAPE '\\' OR username_sito LIKE ? ESCAPE '\\')))")
+            search_params.extend(condition_params)
+            search_params.extend((pattern, pattern))
+        
+        query += ' ORDER BY id LIMIT ?'
+        
+        conn = DatabaseManager.get_connection(user_id)
+        with conn:
+            # Letta prima delle voci: una scrittura concorrente può solo rendere la pagina più
+            # recente della revisione a cui è associata, mai più vecchia
+            revision = RevisionLog.current(conn, user_id)
+            cached = PasswordService._cached_pages(user_id, revision, key_digest)
+            if page_key in cached:
+                metrics.increment('password_manager_cache_requests_total', cache='pagine', esito='hit')
+                page, next_cursor = cached[page_key]
+                return list(page), next_cursor
+        metrics.increment('password_manager_cache_requests_total', cache='pagine', esito='miss')
+        
+        cipher = CipherContext(master_key)
+        page = []
+        last_id = after or 0
+        # Le voci non decifrabili o scartate dal filtro sul testo decifrato non occupano posto:
+        # si legge a blocchi finché la pagina ha una voce in più del limite (che dice se esiste
+        # una pagina successiva) o le righe sono finite
+        while len(page) <= limit:
+            with conn:
+                password_entries = conn.execute(query, [user_id, last_id, *search_params, limit + 1]).fetchall()
+            for entry in password_entries:
+                try:
+                    site_name, site_username = PasswordService.entry_metadata(entry, cipher)
+                except ValueError:
+                    continue
+                # Gli n-grammi trovati possono non essere contigui: si verifica sul testo decifrato
+                if search and not PasswordService._matches(search, site_name, site_username):
+                    continue
+                page.append({
+                    'id': entry['id'],
+                    'nome_sito': site_name,
+                    'username_sito': site_username,
+                    'data_creazione': entry['data_creazione'],
+                    'data_modifica': entry['data_modifica'],
+                })
+                if len(page) > limit:
+                    break
+            if len(password_entries) <= limit:
+                break
+            last_id = password_entries[-1]['id']
+        
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = page[-1]['id']
+        
+        # Copia della mappa: chi la sta leggendo in un altro thread non la vede cambiare
+        pages = dict(cached)
+        if len(pages) >= Config.PAGE_CACHE_PAGES_PER_USER:
+            pages.pop(next(iter(pages)))
+        pages[page_key] = (page, next_cursor)
+        _page_cache.set(user_id, (revision, key_digest, pages))
+        return list(page), next_cursor
+    
+    @staticmethod
+    def _cached_pages(user_id: int, revision: int, key_digest: bytes) -> Dict[tuple, Tuple[List[Dict], Optional[int]]]:
+        """Pagine in cache dell'utente, se ancora valide per questa revisione e questa chiave"""
+        cached = _page_cache.get(user_id)
+        if cached is None:
+            return {}
+        cached_revision, cached_digest, pages = cached
+        if cached_revision != revision or not hmac.compare_digest(cached_digest, key_digest):
+            return {}
+        return pages
+    
+    @staticmethod
+    def find_by_site_name(user_id: int, site_name: str, master_key: bytes) -> List[Dict]:
+        """Recupera le voci con esattamente questo nome del sito (senza distinzione di maiuscole)"""
+        with DatabaseManager.get_connection(user_id) as conn:
+            password_entries = conn.execute(
+                'SELECT p.id, p.nome_sito, p.username_sito, p.metadati_cifrati, p.data_creazione, p.data_modifica '
+                'FROM indice_ricerca i JOIN password_salvate p ON p.id = i.voce_id '
+                'WHERE i.utente_id = ? AND i.token = ? ORDER BY p.id',
+                (user_id, BlindIndex(master_key).site_token(site_name))
+            ).fetchall()
+        
+        cipher = CipherContext(master_key)
+        entries = []
+        for entry in password_entries:
+            try:
+                found_site_name, site_username = PasswordService.entry_metadata(entry, cipher)
+            except ValueError:
+                continue
+            entries.append({
+                'id': entry['id'],
+                'nome_sito': found_site_name,
+                'username_sito': site_username,
+                'data_creazione': entry['data_creazione'],
+                'data_modifica': entry['data_modifica'],
+            })
+        return entries
+    
+    @staticmethod
+    def get_vault_revision(user_id: int) -> int:
+        """Revisione corrente del vault: cambia a ogni aggiunta, modifica o eliminazione"""
+        with DatabaseManager.get_connection(user_id) as conn:
+            return RevisionLog.current(conn, user_id)
+    
+    @staticmethod
+    def get_changes_since(user_id: int, master_key: bytes, since: int = 0,
+                          limit: Optional[int] = None) -> VaultChanges:
+        """
+        Restituisce le voci aggiunte o modificate e quelle eliminate dopo la revisione `since`
+        (0 per l'intero vault), in ordine di revisione e al massimo `limit` modifiche.
+        Vengono lette e decifrate solo le voci cambiate.
+        """
+        limit = limit or Config.SYNC_PAGE_SIZE
+        with DatabaseManager.get_connection(user_id) as conn:
+            # La revisione corrente va letta per prima: le scritture successive hanno revisioni
+            # più alte e restano escluse, così le due letture sono coerenti tra loro
+            current = RevisionLog.current(conn, user_id)
+            changed = conn.execute(
+                'SELECT id, nome_sito, username_sito, metadati_cifrati, password_sito_encrypted, '
+                'data_creazione, data_modifica, revisione FROM password_salvate '
+                'WHERE utente_id = ? AND revisione > ? AND revisione <= ? ORDER BY revisione LIMIT ?',
+                (user_id, since, current, limit + 1)
+            ).fetchall()
+            deleted = RevisionLog.deletions_since(conn, user_id, since, current, limit + 1)
+        
+        # Voci e cancellazioni hanno revisioni distinte: si uniscono in ordine e si tagliano al limite
+        changes = sorted([(entry['revisione'], entry, None) for entry in changed] +
+                         [(revision, None, entry_id) for revision, entry_id in deleted], key=lambda change: change[0])
+        more = len(changes) > limit
+        changes = changes[:limit]
+        
+        cipher = CipherContext(master_key)
+        entries = []
+        deleted_ids = []
+        for revision, entry, entry_id in changes:
+            if entry is None:
+                deleted_ids.append(entry_id)
+                continue
+            try:
+                site_name, site_username = PasswordService.entry_metadata(entry, cipher)
+                site_password = cipher.decrypt(entry['password_sito_encrypted'])
+            except ValueError:
+                logging.warning(f"Sincronizzazione utente {user_id}: voce {entry['id']} non decifrabile saltata")
+                continue
+            entries.append({
+                'id': entry['id'],
+                'nome_sito': site_name,
+                'username_sito': site_username,
+                'password_sito': site_password,
+                'data_creazione': entry['data_creazione'],
+                'data_modifica': entry['data_modifica'],
+                'revisione': revision,
+            })
+        
+        return VaultChanges(changes[-1][0] if more else current, entries, deleted_ids, more)
+    
+    @staticmethod
+    def get_decrypted_password(password_id: int, user_id: int, master_key: bytes) -> Optional[str]:
+        """
+        Decrittografa la password di una singola voce dell'utente.
+        Restituisce None se la voce non esiste; solleva ValueError se la decrittografia fallisce.
+        """
+        with DatabaseManager.get_connection(user_id) as conn:
+            entry = conn.execute(
+                'SELECT password_sito_encrypted FROM password_salvate WHERE id = ? AND utente_id = ?',
+                (password_id, user_id)
+            ).fetchone()
+        
+        if entry is None:
+            return None
+        return CryptographyManager.decrypt_password(entry['password_sito_encrypted'], master_key)
+    
+    @staticmethod
+    def get_decrypted_entry(password_id: int, user_id: int, master_key: bytes) -> Optional[Dict]:
+        """
+        Recupera una voce dell'utente con metadati e password decifrati.
+        Restituisce None se la voce non esiste; solleva ValueError se la decrittografia fallisce.
+        """
+        entry = PasswordService.get_password_by_id(password_id, user_id)
+        if entry is None:
+            return None
+        
+        cipher = CipherContext(master_key)
+        site_name, site_username = PasswordService.entry_metadata(entry, cipher)
+        return {
+            'id': entry['id'],
+            'nome_sito': site_name,
+            'username_sito': site_username,
+            'password_sito': cipher.decrypt(entry['password_sito_encrypted']),
+        }
+    
     @staticmethod
     def add_password(user_id: int, site_name: str, site_username: str, 
                     site_password: str, master_key: bytes) -> bool:
         """Aggiunge una nuova password crittografata"""
         try:
-            encrypted_password = CryptographyManager.encrypt_password(site_password, master_key)
+            cipher = CipherContext(master_key)
+            index = BlindIndex(master_key)
             
-            with DatabaseManager.get_connection() as conn:
-                conn.execute(
-                    'INSERT INTO password_salvate (utente_id, nome_sito, username_sito, password_sito_encrypted) VALUES (?, ?, ?, ?)',
-                    (user_id, site_name, site_username, encrypted_password)
+            with DatabaseManager.get_connection(user_id) as conn:
+                cursor = conn.execute(
+                    "INSERT INTO password_salvate (utente_id, nome_sito, username_sito, password_sito_encrypted, "
+                    "metadati_cifrati, impronta_password, revisione) VALUES (?, '', '', ?, ?, ?, ?)",
+                    (user_id, cipher.encrypt(site_password), cipher.encrypt_metadata(site_name, site_username),
+                     index.password_fingerprint(site_password), RevisionLog.allocate(conn, user_id))
+                )
+                SearchIndex.replace_tokens(
+                    conn, user_id, [(cursor.lastrowid, index.entry_tokens(site_name, site_username))]
                 )
                 conn.commit()
+            PasswordService.invalidate_user_caches(user_id)
             return True
         except Exception:
             return False
@@ -109,7 +513,7 @@ class PasswordService:
     @staticmethod
     def get_password_by_id(password_id: int, user_id: int) -> Optional[sqlite3.Row]:
         """Recupera una password specifica dell'utente"""
-        with DatabaseManager.get_connection() as conn:
+        with DatabaseManager.get_connection(user_id) as conn:
             return conn.execute(
                 'SELECT * FROM password_salvate WHERE id = ? AND utente_id = ?',
                 (password_id, user_id)
@@ -120,14 +524,29 @@ class PasswordService:
                        site_username: str, site_password: str, master_key: bytes) -> bool:
         """Aggiorna una password esistente"""
         try:
-            encrypted_password = CryptographyManager.encrypt_password(site_password, master_key)
+            cipher = CipherContext(master_key)
+            index = BlindIndex(master_key)
             
-            with DatabaseManager.get_connection() as conn:
-                conn.execute(
-                    'UPDATE password_salvate SET nome_sito = ?, username_sito = ?, password_sito_encrypted = ?, data_modifica = CURRENT_TIMESTAMP WHERE id = ? AND utente_id = ?',
-                    (site_name, site_username, encrypted_password, password_id, user_id)
+            with DatabaseManager.get_connection(user_id) as conn:
+                cursor = conn.execute(
+                    "UPDATE password_salvate SET nome_sito = '', username_sito = '', password_sito_encrypted = ?, "
+                    "metadati_cifrati = ?, impronta_password = ?, data_modifica = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND utente_id = ?",
+                    (cipher.encrypt(site_password), cipher.encrypt_metadata(site_name, site_username),
+                     index.password_fingerprint(site_password), password_id, user_id)
                 )
+                if cursor.rowcount == 1:
+                    # Revisione assegnata solo se la voce esiste, nella stessa transazione: un id
+                    # estraneo o inesistente non fa avanzare il vault né invalida le cache dei client
+                    conn.execute(
+                        'UPDATE password_salvate SET revisione = ? WHERE id = ?',
+                        (RevisionLog.allocate(conn, user_id), password_id)
+                    )
+                    SearchIndex.replace_tokens(
+                        conn, user_id, [(password_id, index.entry_tokens(site_name, site_username))]
+                    )
                 conn.commit()
+            PasswordService.invalidate_user_caches(user_id)
             return True
         except Exception:
             return False
@@ -136,12 +555,74 @@ class PasswordService:
     def delete_password(password_id: int, user_id: int) -> bool:
         """Elimina una password"""
         try:
-            with DatabaseManager.get_connection() as conn:
-                conn.execute(
+            with DatabaseManager.get_connection(user_id) as conn:
+                cursor = conn.execute(
                     'DELETE FROM password_salvate WHERE id = ? AND utente_id = ?',
                     (password_id, user_id)
                 )
+                if cursor.rowcount:
+                    SearchIndex.delete_tokens(conn, [password_id])
+                    RevisionLog.record_deletions(conn, user_id, [password_id])
                 conn.commit()
+            PasswordService.invalidate_user_caches(user_id)
             return True
         except Exception:
             return False
+    
+    @staticmethod
+    def get_vault_hygiene(user_id: int) -> VaultHygiene:
+        """
+        Conta password riutilizzate e vecchie dell'utente. Il riutilizzo è un GROUP BY sulle
+        impronte e l'età un confronto su data_modifica, entrambi coperti da indici; il
+        risultato resta in cache finché il vault non cambia.
+        """
+        hygiene = _hygiene_cache.get(user_id)
+        if hygiene is not None:
+            return hygiene
+        
+        with DatabaseManager.get_connection(user_id) as conn:
+            reused_groups, reused_entries = conn.execute(
+                'SELECT COUNT(*), TOTAL(voci) FROM ('
+                'SELECT COUNT(*) AS voci FROM password_salvate WHERE utente_id = ? AND impronta_password IS NOT NULL '
+                'GROUP BY impronta_password HAVING COUNT(*) > 1)',
+                (user_id,)
+            ).fetchone()
+            stale_entries = conn.execute(
+                "SELECT COUNT(*) FROM password_salvate WHERE utente_id = ? AND data_modifica < datetime('now', ?)",
+                (user_id, f'-{Config.PASSWORD_MAX_AGE_DAYS} days')
+            ).fetchone()[0]
+            unchecked_entries = conn.execute(
+                'SELECT COUNT(*) FROM password_salvate WHERE utente_id = ? AND impronta_password IS NULL',
+                (user_id,)
+            ).fetchone()[0]
+        
+        hygiene = VaultHygiene(int(reused_entries), reused_groups, stale_entries, unchecked_entries)
+        # Con voci ancora da convertire il conteggio cambierà a breve: meglio ricalcolarlo
+        if not unchecked_entries:
+            _hygiene_cache.set(user_id, hygiene)
+        return hygiene
+    
+    @staticmethod
+    def get_reused_fingerprints(user_id: int) -> Set[bytes]:
+        """Impronte delle password usate in più di una voce dell'utente"""
+        with DatabaseManager.get_connection(user_id) as conn:
+            return {row[0] for row in conn.execute(
+                'SELECT impronta_password FROM password_salvate WHERE utente_id = ? AND impronta_password IS NOT NULL '
+                'GROUP BY impronta_password HAVING COUNT(*) > 1',
+                (user_id,)
+            )}
+    
+    @staticmethod
+    def invalidate_user_caches(user_id: int) -> None:
+        """Scarta riepilogo e pagine in cache dell'utente dopo una modifica del vault o della chiave"""
+        _hygiene_cache.pop(user_id)
+        _page_cache.pop(user_id)
+    
+    @staticmethod
+    def _matches(search: str, site_name: str, site_username: str) -> bool:
+        """Verifica sul testo in chiaro la corrispondenza trovata tramite l'indice"""
+        search = BlindIndex.normalize(search)
+        fields = (BlindIndex.normalize(site_name), BlindIndex.normalize(site_username))
+        if len(search) < NGRAM_LENGTH:
+            return any(field.startswith(search) for field in fields)
+        return any(search in field for field in fields)
@@ -0,0 +1,205 @@
+import hashlib
+import random
+import secrets
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from flask import Flask, Request, Response
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from config import Config
+from .core.cache import TTLCache
+from .database import DatabaseManager
+
+NONCE_LENGTH = 12
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Sessione i cui dati restano sul server: il client conserva solo l'identificativo"""
+    
+    def __init__(self, initial: Optional[Dict[str, Any]] = None, sid: Optional[str] = None,
+                 expires_at: float = 0.0):
+        def on_update(session: 'ServerSideSession') -> None:
+            session.modified = True
+        
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.previous_sid: Optional[str] = None
+        self.modified = False
+    
+    def regenerate(self) -> None:
+        """Assegna un nuovo identificativo (da usare al login, contro la session fixation)"""
+        if self.sid is not None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class SessionStore(ABC):
+    """Archivio dei dati di sessione lato server"""
+    
+    @abstractmethod
+    def load(self, sid: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Restituisce i dati della sessione e la sua scadenza, o None se assente o scaduta"""
+    
+    @abstractmethod
+    def save(self, sid: str, data: Dict[str, Any], expires_at: float) -> None:
+        """Salva i dati della sessione fino alla scadenza indicata"""
+    
+    @abstractmethod
+    def delete(self, sid: str) -> None:
+        """Elimina una sessione"""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessioni nella memoria del processo, con scadenza per inattività ed eviction LRU.
+    Adatto a un singolo processo (server di sviluppo o worker unico).
+    """
+    
+    def __init__(self, max_entries: int, idle_timeout: float):
+        self._cache = TTLCache(max_entries=max_entries, ttl=idle_timeout)
+    
+    def load(self, sid: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        entry = self._cache.get(sid)
+        if entry is None:
+            return None
+        data, expires_at = entry
+        return dict(data), expires_at
+    
+    def save(self, sid: str, data: Dict[str, Any], expires_at: float) -> None:
+        self._cache.set(sid, (dict(data), expires_at))
+    
+    def delete(self, sid: str) -> None:
+        self._cache.pop(sid)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessioni nel database, condivise da tutti i processi worker.
+    
+    Nel database non finiscono né l'identificativo né i dati in chiaro: la riga è
+    indicizzata dall'hash dell'identificativo e i dati sono cifrati con una chiave
+    derivata dall'identificativo stesso, che possiede solo il client.
+    """
+    
+    serializer = TaggedJSONSerializer()
+    
+    def load(self, sid: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with DatabaseManager.get_connection() as conn:
+            row = conn.execute(
+                'SELECT dati, scadenza FROM sessioni WHERE id_hash = ?', (self._hash_sid(sid),)
+            ).fetchone()
+        if row is None or row['scadenza'] <= time.time():
+            return None
+        
+        encrypted_data = row['dati']
+        try:
+            plaintext = self._cipher(sid).decrypt(encrypted_data[:NONCE_LENGTH], encrypted_data[NONCE_LENGTH:], None)
+        except Exception:
+            return None
+        return self.serializer.loads(plaintext.decode()), row['scadenza']
+    
+    def save(self, sid: str, data: Dict[str, Any], expires_at: float) -> None:
+        nonce = secrets.token_bytes(NONCE_LENGTH)
+        encrypted_data = nonce + self._cipher(sid).encrypt(nonce, self.serializer.dumps(data).encode(), None)
+        with DatabaseManager.get_connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessioni (id_hash, dati, scadenza) VALUES (?, ?, ?)',
+                (self._hash_sid(sid), encrypted_data, expires_at)
+            )
+            # Pulizia occasionale delle sessioni scadute, senza un job dedicato
+            if random.random() < Config.SESSION_CLEANUP_PROBABILITY:
+                conn.execute('DELETE FROM sessioni WHERE scadenza <= ?', (time.time(),))
+    
+    def delete(self, sid: str) -> None:
+        with DatabaseManager.get_connection() as conn:
+            conn.execute('DELETE FROM sessioni WHERE id_hash = ?', (self._hash_sid(sid),))
+    
+    @staticmethod
+    def _hash_sid(sid: str) -> bytes:
+        return hashlib.sha256(sid.encode()).digest()
+    
+    @staticmethod
+    def _cipher(sid: str) -> AESGCM:
+        return AESGCM(HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'password-manager/sessione',
+        ).derive(sid.encode()))
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Interfaccia di sessione Flask basata su un SessionStore: il cookie contiene solo
+    un identificativo casuale, i dati scadono dopo SESSION_IDLE_TIMEOUT di inattività.
+    """
+    
+    def __init__(self, store: SessionStore, idle_timeout: float):
+        self.store = store
+        self.idle_timeout = idle_timeout
+    
+    def open_session(self, app: Flask, request: Request) -> ServerSideSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self.store.load(sid)
+            if stored is not None:
+                data, expires_at = stored
+                return ServerSideSession(data, sid=sid, expires_at=expires_at)
+        return ServerSideSession()
+    
+    def save_session(self, app: Flask, session: ServerSideSession, response: Response) -> None:
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+        
+        if not session:
+            if session.modified and session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+        
+        # Con l'inattività la scadenza si sposta in avanti, ma la sessione viene
+        # riscritta solo se è cambiata o ha consumato metà del suo tempo
+        now = time.time()
+        needs_refresh = session.expires_at - now < self.idle_timeout / 2
+        if not session.modified and not needs_refresh:
+            return
+        
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires_at = now + self.idle_timeout
+        self.store.save(session.sid, dict(session), session.expires_at)
+        
+        response.set_cookie(
+            cookie_name,
+            session.sid,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path,
+        )
+
+
+def init_sessions(app: Flask) -> None:
+    """Configura l'archivio di sessione scelto in SESSION_BACKEND ('memory' o 'sqlite')"""
+    if Config.SESSION_BACKEND == 'sqlite':
+        store: SessionStore = SQLiteSessionStore()
+    elif Config.SESSION_BACKEND == 'memory':
+        store = MemorySessionStore(Config.SESSION_MAX_ENTRIES, Config.SESSION_IDLE_TIMEOUT)
+    else:
+        raise ValueError(f"Archivio di sessione non supportato: {Config.SESSION_BACKEND}")
+    app.session_interface = ServerSideSessionInterface(store, Config.SESSION_IDLE_TIMEOUT)
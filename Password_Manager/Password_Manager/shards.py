@@ -0,0 +1,202 @@
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional
+
+from config import Config
+from .database import MAIN_SHARD, DatabaseManager
+from .migrations import USER_TABLES
+
+# Operazione di manutenzione su uno shard: riceve il nome dello shard e restituisce un esito leggibile
+ShardOperation = Callable[[str], str]
+
+
+class SplitResult(NamedTuple):
+    """Esito della suddivisione del database principale in shard"""
+    moved_users: int
+    moved_entries: int
+    failed_users: List[int]
+
+
+class MaintenanceResult(NamedTuple):
+    """Esito di un'operazione di manutenzione su un singolo shard"""
+    shard: str
+    ok: bool
+    detail: str
+
+
+def shard_label(shard: str) -> str:
+    """Nome dello shard da mostrare all'utente"""
+    return shard or 'principale'
+
+
+class ShardMigrationService:
+    """
+    Sposta i vault tra gli shard copiando le righe di tutte le tabelle in USER_TABLES.
+
+    Durante la copia l'origine resta bloccata in scrittura, poi la directory viene aggiornata
+    e solo alla fine le righe vengono eliminate dall'origine: un'interruzione lascia al più
+    copie orfane, che la directory non indica e che uno spostamento successivo sovrascrive.
+    Gli altri worker tengono in cache lo shard di ogni utente per DB_SHARD_CACHE_TTL secondi:
+    gli spostamenti vanno eseguiti a servizio fermo.
+    """
+
+    @staticmethod
+    def move_user(user_id: int, target: str) -> int:
+        """
+        Sposta il vault dell'utente nello shard `target` e restituisce il numero di voci spostate.
+        Solleva ValueError se lo shard di destinazione contiene già voci con gli stessi id.
+        """
+        source = DatabaseManager.shard_of(user_id)
+        if source == target:
+            return 0
+
+        target_path = DatabaseManager.shard_path(target)
+        DatabaseManager.prepare_database(target_path)
+        source_conn = DatabaseManager.open_connection(DatabaseManager.shard_path(source))
+        target_conn = DatabaseManager.open_connection(target_path)
+        try:
+            source_conn.execute('BEGIN IMMEDIATE')
+            try:
+                moved = ShardMigrationService._copy_user(source_conn, target_conn, user_id)
+                if source == MAIN_SHARD:
+                    # Directory e righe di origine nello stesso database: un'unica transazione
+                    DatabaseManager.set_shard(source_conn, user_id, target)
+                else:
+                    with DatabaseManager.get_connection() as conn:
+                        DatabaseManager.set_shard(conn, user_id, target)
+                for table, column in USER_TABLES:
+                    source_conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (user_id,))
+                source_conn.commit()
+            except Exception:
+                source_conn.rollback()
+                raise
+        finally:
+            source_conn.close()
+            target_conn.close()
+        return moved
+
+    @staticmethod
+    def split_database(mode: Optional[str] = None,
+                       progress: Optional[Callable[[int, int], None]] = None) -> SplitResult:
+        """
+        Sposta negli shard della modalità indicata (DB_SHARD_MODE se omessa) i vault ancora
+        nel database principale. Un utente che non si riesce a spostare resta dov'è.
+        """
+        with DatabaseManager.get_connection() as conn:
+            user_ids = [row['utente_id'] for row in conn.execute(
+                'SELECT utente_id FROM directory_utenti WHERE shard = ? ORDER BY utente_id', (MAIN_SHARD,)
+            )]
+
+        moved_users = moved_entries = 0
+        failed_users = []
+        for done, user_id in enumerate(user_ids, 1):
+            target = DatabaseManager.choose_shard(user_id, mode)
+            try:
+                if target != MAIN_SHARD:
+                    moved_entries += ShardMigrationService.move_user(user_id, target)
+                    moved_users += 1
+            except (ValueError, sqlite3.Error) as e:
+                logging.error(f"Spostamento dell'utente {user_id} nello shard {target} non riuscito: {e}")
+                failed_users.append(user_id)
+            if progress:
+                progress(done, len(user_ids))
+        return SplitResult(moved_users, moved_entries, failed_users)
+
+    @staticmethod
+    def _copy_user(source_conn: sqlite3.Connection, target_conn: sqlite3.Connection, user_id: int) -> int:
+        """Copia e conferma nella destinazione le righe dell'utente; restituisce le voci copiate"""
+        moved = 0
+        try:
+            with target_conn:
+                for table, column in USER_TABLES:
+                    # Resti di uno spostamento interrotto: la directory indica ancora l'origine
+                    target_conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (user_id,))
+                for table, column in USER_TABLES:
+                    copied = ShardMigrationService._copy_rows(source_conn, target_conn, table, column, user_id)
+                    if table == 'password_salvate':
+                        moved = copied
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Lo shard di destinazione contiene già righe con gli stessi id: {e}") from e
+        return moved
+
+    @staticmethod
+    def _copy_rows(source_conn: sqlite3.Connection, target_conn: sqlite3.Connection,
+                   table: str, column: str, user_id: int) -> int:
+        cursor = source_conn.execute(f'SELECT * FROM {table} WHERE {column} = ?', (user_id,))
+        columns = [description[0] for description in cursor.description]
+        insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        copied = 0
+        while True:
+            rows = cursor.fetchmany(Config.TRANSFER_BATCH_SIZE)
+            if not rows:
+                break
+            target_conn.executemany(insert, [tuple(row) for row in rows])
+            copied += len(rows)
+        return copied
+
+
+class ShardMaintenance:
+    """
+    Operazioni di manutenzione eseguite in parallelo sugli shard, ciascuno con una propria
+    connessione: file diversi non condividono lock, quindi i thread non si attendono a vicenda.
+    """
+
+    @staticmethod
+    def run(operation: ShardOperation, shards: Optional[List[str]] = None,
+            workers: Optional[int] = None) -> List[MaintenanceResult]:
+        """Esegue `operation` su tutti gli shard (o su quelli indicati) e ne raccoglie gli esiti"""
+        shards = DatabaseManager.list_shards() if shards is None else shards
+
+        def run_one(shard: str) -> MaintenanceResult:
+            try:
+                return MaintenanceResult(shard, True, operation(shard))
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f"Manutenzione dello shard {shard_label(shard)} non riuscita: {e}")
+                return MaintenanceResult(shard, False, str(e))
+
+        with ThreadPoolExecutor(max_workers=workers or Config.DB_MAINTENANCE_WORKERS,
+                                thread_name_prefix='manutenzione-shard') as executor:
+            return list(executor.map(run_one, shards))
+
+    @staticmethod
+    def backup(destination: str) -> ShardOperation:
+        """Copia coerente di ogni shard in `destination` con l'API di backup di SQLite, senza fermare le scritture"""
+        def backup_shard(shard: str) -> str:
+            os.makedirs(destination, exist_ok=True)
+            path = os.path.join(destination, f'{shard_label(shard)}.db')
+            source = DatabaseManager.open_connection(DatabaseManager.shard_path(shard))
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            return f'{path} ({os.path.getsize(path)} byte)'
+        return backup_shard
+
+    @staticmethod
+    def vacuum(shard: str) -> str:
+        """Ricompatta il file dello shard e tronca il WAL"""
+        path = DatabaseManager.shard_path(shard)
+        size_before = os.path.getsize(path)
+        conn = DatabaseManager.open_connection(path)
+        try:
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        return f'{size_before} -> {os.path.getsize(path)} byte'
+
+    @staticmethod
+    def check(shard: str) -> str:
+        """Verifica l'integrità del file dello shard"""
+        conn = DatabaseManager.open_connection(DatabaseManager.shard_path(shard))
+        try:
+            problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        finally:
+            conn.close()
+        if problems != ['ok']:
+            raise sqlite3.DatabaseError('; '.join(problems[:5]))
+        return 'integro'
@@ -59,7 +59,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Logica per la pagina CAMBIA PASSWORD MASTER
     const changeMasterPasswordForm = document.querySelector('form[action="/cambia_password_master"]');
     if (changeMasterPasswordForm) {
-        showPopup('Attenzione: Cambiando la password master, tutte le password salvate verranno ri-crittografate.', 'info');
+        showPopup('Attenzione: dopo il cambio dovrai usare la nuova password master per accedere.', 'info');
         changeMasterPasswordForm.addEventListener('submit', function(event) {
             // Logica di validazione simile a quella della registrazione...
         });
@@ -68,8 +68,26 @@ document.addEventListener('DOMContentLoaded', () => {
     // Logica per la pagina DASHBOARD
     const dashboardTable = document.querySelector('table'); // Un modo per identificare la dashboard
     if (dashboardTable) {
+        // Le password non sono incluse nella pagina: vengono decrittografate dal server solo
+        // quando l'utente le mostra o le copia, e poi tenute in memoria finché la pagina è aperta
+        const revealedPasswords = new Map();
+
+        async function fetchPassword(id) {
+            if (revealedPasswords.has(id)) return revealedPasswords.get(id);
+
+            const response = await fetch('/api/password/' + id, {
+                headers: { 'Accept': 'application/json' },
+                credentials: 'same-origin'
+            });
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.errore || 'Errore durante il recupero della password');
+
+            revealedPasswords.set(id, data.password_sito);
+            return data.password_sito;
+        }
+
         // Aggiungiamo gli event listener ai bottoni usando la delegazione di eventi per efficienza
-        dashboardTable.addEventListener('click', function(event) {
+        dashboardTable.addEventListener('click', async function(event) {
             const target = event.target.closest('button');
             if (!target) return;
 
@@ -85,6 +103,12 @@ document.addEventListener('DOMContentLoaded', () => {
                     visibleElement.classList.add('hidden');
                     toggleText.textContent = 'Mostra';
                 } else {
+                    try {
+                        visibleElement.textContent = await fetchPassword(id);
+                    } catch (error) {
+                        showPopup(error.message, 'error');
+                        return;
+                    }
                     hiddenElement.classList.add('hidden');
                     visibleElement.classList.remove('hidden');
                     toggleText.textContent = 'Nascondi';
@@ -93,17 +117,31 @@ document.addEventListener('DOMContentLoaded', () => {
             
             // Logica per Copia password
             if (target.id.startsWith('copy-btn-')) {
-                const passwordToCopy = target.dataset.password;
-                navigator.clipboard.writeText(passwordToCopy).then(() => {
-                    const originalText = target.textContent;
-                    target.textContent = 'Copiato!';
-                    setTimeout(() => { target.textContent = originalText; }, 2000);
-                });
+                const id = target.id.replace('copy-btn-', '');
+                try {
+                    const passwordToCopy = await fetchPassword(id);
+                    await navigator.clipboard.writeText(passwordToCopy);
+                } catch (error) {
+                    showPopup(error.message, 'error');
+                    return;
+                }
+                const originalText = target.textContent;
+                target.textContent = 'Copiato!';
+                setTimeout(() => { target.textContent = originalText; }, 2000);
             }
         });
     }
 
     // Logica per la pagina GENERA PASSWORD
+    // Mostra solo le opzioni del tipo scelto (password o passphrase)
+    const modalitaSelect = document.getElementById('modalita');
+    if (modalitaSelect) {
+        modalitaSelect.addEventListener('change', function() {
+            document.getElementById('opzioni-password').style.display = this.value === 'passphrase' ? 'none' : '';
+            document.getElementById('opzioni-passphrase').style.display = this.value === 'passphrase' ? '' : 'none';
+        });
+    }
+
     const copyGeneratedBtn = document.getElementById('copy-generated-btn');
     if (copyGeneratedBtn) {
         copyGeneratedBtn.addEventListener('click', function() {
@@ -0,0 +1,237 @@
+import base64
+import csv
+import json
+import logging
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple
+
+from config import Config
+from .database import DatabaseManager
+from .core.auth_pool import AuthWorkerPool
+from .core.blind_index import BlindIndex
+from .core.cryptography import CipherContext, CryptographyManager
+from .core.kdf import KeyDerivation
+from .revisions import RevisionLog
+from .search_index import SearchIndex
+from .services import PasswordService
+
+# Intestazione dei file esportati (JSON Lines: una riga di intestazione, poi una riga per voce)
+EXPORT_FORMAT = 'password-manager-export'
+EXPORT_VERSION = 1
+# Testo noto cifrato nell'intestazione: una passphrase sbagliata viene rifiutata prima di importare
+EXPORT_CHECK = 'password-manager-export-check'
+
+# Nomi di colonna riconosciuti nei CSV esportati dai gestori più diffusi
+# (Chrome, Firefox, Bitwarden, KeePass, LastPass, 1Password), in ordine di preferenza
+CSV_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    'nome_sito': ('nome_sito', 'name', 'title', 'url', 'login_uri', 'website', 'origin'),
+    'username_sito': ('username_sito', 'username', 'login_username', 'login', 'user', 'email'),
+    'password_sito': ('password_sito', 'password', 'login_password'),
+}
+
+# Riga pronta per l'inserimento: (nome_sito, username_sito, password in chiaro)
+PlainEntry = Tuple[str, str, str]
+# Riga cifrata: (password, metadati, impronta della password, token dell'indice cieco)
+EncryptedEntry = Tuple[bytes, bytes, bytes, Set[bytes]]
+
+
+class TransferResult(NamedTuple):
+    """Esito di un'importazione"""
+    imported: int
+    skipped: int
+
+
+class VaultTransferService:
+    """
+    Importazione ed esportazione del vault in streaming.
+
+    Le righe vengono lette, cifrate e scritte a blocchi di TRANSFER_BATCH_SIZE voci,
+    ognuno inserito con executemany in una sola transazione: la memoria usata non
+    dipende dalla dimensione del file e il lock di scrittura resta occupato poco.
+    """
+
+    @staticmethod
+    def import_csv(user_id: int, stream: TextIO, master_key: bytes) -> TransferResult:
+        """
+        Importa le voci da un CSV con intestazione. Le righe senza nome sito,
+        username o password vengono saltate. Solleva ValueError se mancano le colonne.
+        """
+        reader = csv.DictReader(stream)
+        columns = VaultTransferService._map_csv_columns(reader.fieldnames or [])
+
+        def entries() -> Iterator[Optional[PlainEntry]]:
+            for row in reader:
+                # La password non viene ripulita dagli spazi: possono farne parte
+                entry = (
+                    (row.get(columns['nome_sito']) or '').strip(),
+                    (row.get(columns['username_sito']) or '').strip(),
+                    row.get(columns['password_sito']) or '',
+                )
+                yield entry if all(entry) else None
+
+        return VaultTransferService._import_entries(user_id, entries(), master_key)
+
+    @staticmethod
+    def export_encrypted(user_id: int, master_key: bytes, passphrase: str) -> Iterator[str]:
+        """
+        Genera, riga per riga, l'esportazione cifrata del vault con una chiave derivata
+        da `passphrase`. Nome sito, username e password di ogni voce sono cifrati insieme.
+        """
+        salt = CryptographyManager.generate_salt()
+        algorithm, params = KeyDerivation.default_algorithm(), KeyDerivation.default_params()
+        export_cipher = CipherContext(AuthWorkerPool.derive_key(passphrase, salt, algorithm, params))
+        vault_cipher = CipherContext(master_key)
+
+        yield json.dumps({
+            'formato': EXPORT_FORMAT,
+            'versione': EXPORT_VERSION,
+            'kdf': {'algoritmo': algorithm, 'parametri': params},
+            'salt': base64.b64encode(salt).decode(),
+            'verifica': base64.b64encode(export_cipher.encrypt(EXPORT_CHECK)).decode(),
+        }) + '\n'
+
+        conn = DatabaseManager.get_connection(user_id)
+        last_id = 0
+        skipped = 0
+        while True:
+            with conn:
+                rows = conn.execute(
+                    'SELECT id, nome_sito, username_sito, metadati_cifrati, password_sito_encrypted, data_creazione, data_modifica '
+                    'FROM password_salvate WHERE utente_id = ? AND id > ? ORDER BY id LIMIT ?',
+                    (user_id, last_id, Config.TRANSFER_BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            lines = []
+            for row in rows:
+                try:
+                    site_name, site_username = PasswordService.entry_metadata(row, vault_cipher)
+                    site_password = vault_cipher.decrypt(row['password_sito_encrypted'])
+                except ValueError:
+                    skipped += 1
+                    continue
+                entry = json.dumps({
+                    'nome_sito': site_name,
+                    'username_sito': site_username,
+                    'password_sito': site_password,
+                    'data_creazione': row['data_creazione'],
+                    'data_modifica': row['data_modifica'],
+                })
+                lines.append(json.dumps({'dati': base64.b64encode(export_cipher.encrypt(entry)).decode()}) + '\n')
+            yield ''.join(lines)
+
+        if skipped:
+            logging.warning(f"Esportazione utente {user_id}: {skipped} voci non decifrabili escluse")
+
+    @staticmethod
+    def import_encrypted(user_id: int, stream: TextIO, master_key: bytes, passphrase: str) -> TransferResult:
+        """
+        Importa un file prodotto da export_encrypted. Solleva ValueError se il file
+        non è valido o la passphrase è errata, prima di inserire qualsiasi voce.
+        """
+        try:
+            header = json.loads(stream.readline())
+            if header.get('formato') != EXPORT_FORMAT or header.get('versione') != EXPORT_VERSION:
+                raise ValueError("Formato di esportazione non supportato")
+            salt = base64.b64decode(header['salt'])
+            check = base64.b64decode(header['verifica'])
+            algorithm = header['kdf']['algoritmo']
+            params = header['kdf']['parametri']
+        except (KeyError, TypeError, AttributeError, json.JSONDecodeError) as e:
+            raise ValueError("Intestazione del file di esportazione non valida") from e
+        # I costi arrivano dal file caricato: vanno controllati prima di derivare
+        KeyDerivation.validate(algorithm, params)
+
+        export_cipher = CipherContext(AuthWorkerPool.derive_key(passphrase, salt, algorithm, params))
+        try:
+            export_cipher.decrypt(check)
+        except ValueError as e:
+            raise ValueError("Passphrase errata") from e
+
+        def entries() -> Iterator[Optional[PlainEntry]]:
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(export_cipher.decrypt(base64.b64decode(json.loads(line)['dati'])))
+                    entry = (data['nome_sito'], data['username_sito'], data['password_sito'])
+                except (KeyError, TypeError, ValueError):
+                    yield None
+                    continue
+                yield entry if all(entry) else None
+
+        return VaultTransferService._import_entries(user_id, entries(), master_key)
+
+    @staticmethod
+    def _import_entries(user_id: int, entries: Iterable[Optional[PlainEntry]], master_key: bytes) -> TransferResult:
+        """Cifra, indicizza e inserisce le voci a blocchi; None indica una riga da saltare"""
+        cipher = CipherContext(master_key)
+        index = BlindIndex(master_key)
+        conn = DatabaseManager.get_connection(user_id)
+        batch: List[EncryptedEntry] = []
+        imported = 0
+        skipped = 0
+
+        for entry in entries:
+            if entry is None:
+                skipped += 1
+                continue
+            site_name, site_username, site_password = entry
+            batch.append((
+                cipher.encrypt(site_password),
+                cipher.encrypt_metadata(site_name, site_username),
+                index.password_fingerprint(site_password),
+                index.entry_tokens(site_name, site_username),
+            ))
+            if len(batch) >= Config.TRANSFER_BATCH_SIZE:
+                VaultTransferService._insert_batch(conn, user_id, batch)
+                imported += len(batch)
+                batch = []
+
+        if batch:
+            VaultTransferService._insert_batch(conn, user_id, batch)
+            imported += len(batch)
+
+        PasswordService.invalidate_user_caches(user_id)
+        if skipped:
+            logging.warning(f"Importazione utente {user_id}: {skipped} righe incomplete o non valide saltate")
+        return TransferResult(imported, skipped)
+
+    @staticmethod
+    def _insert_batch(conn, user_id: int, batch: List[EncryptedEntry]) -> None:
+        """Inserisce un blocco di voci e i relativi token in una sola transazione"""
+        # Con il lock di scrittura preso subito nessun altro inserisce nel frattempo:
+        # le voci del blocco sono quelle con id successivo all'ultimo esistente
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            last_id = conn.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM password_salvate WHERE utente_id = ?', (user_id,)
+            ).fetchone()[0]
+            first_revision = RevisionLog.allocate(conn, user_id, len(batch))
+            conn.executemany(
+                "INSERT INTO password_salvate (utente_id, nome_sito, username_sito, password_sito_encrypted, "
+                "metadati_cifrati, impronta_password, revisione) VALUES (?, '', '', ?, ?, ?, ?)",
+                [(user_id, encrypted_password, encrypted_metadata, fingerprint, first_revision + offset)
+                 for offset, (encrypted_password, encrypted_metadata, fingerprint, _) in enumerate(batch)]
+            )
+            entry_ids = [row[0] for row in conn.execute(
+                'SELECT id FROM password_salvate WHERE utente_id = ? AND id > ? ORDER BY id', (user_id, last_id)
+            )]
+            SearchIndex.replace_tokens(conn, user_id, zip(entry_ids, (tokens for _, _, _, tokens in batch)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def _map_csv_columns(fieldnames: List[str]) -> Dict[str, str]:
+        """Associa ogni campo del vault alla colonna del CSV che lo contiene"""
+        available = {name.strip().lower(): name for name in fieldnames if name}
+        columns = {}
+        for field, aliases in CSV_COLUMNS.items():
+            column = next((available[alias] for alias in aliases if alias in available), None)
+            if column is None:
+                raise ValueError(f"Colonna mancante nel CSV: {field} (attese: {', '.join(aliases)})")
+            columns[field] = column
+        return columns
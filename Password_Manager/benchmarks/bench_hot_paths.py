@@ -0,0 +1,329 @@
+"""
+Benchmark dei percorsi più frequenti delle richieste, eseguiti tramite il client di test di Flask:
+login, dashboard (elenco e ricerca), lettura di una password, aggiunta, modifica ed
+eliminazione di voci, cambio della password master e generazione di password.
+
+Ogni scenario corrisponde a una configurazione della KDF e usa un database temporaneo
+nuovo, con un utente sintetico per ogni dimensione di vault richiesta. I dati sono
+generati con un seme fisso, quindi due esecuzioni sulla stessa macchina sono confrontabili.
+Per ogni operazione vengono riportati i percentili di latenza e il throughput; la
+dashboard viene misurata anche con più client concorrenti (--concorrenza), come carico.
+
+Esempi (dalla cartella del progetto):
+    python benchmarks/bench_hot_paths.py
+    python benchmarks/bench_hot_paths.py --vault 100 --vault 10000 --kdf scrypt --kdf 'pbkdf2_sha512:{"iterations": 600000}'
+    python benchmarks/bench_hot_paths.py --json base.json
+    python benchmarks/bench_hot_paths.py --confronta base.json --tolleranza 25
+
+Con --confronta il processo termina con codice 1 se la mediana di un'operazione è
+peggiorata oltre la tolleranza rispetto al file indicato.
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+# Chiave di firma fissa: il benchmark non deve creare instance/secret_key nel progetto
+os.environ.setdefault('PASSWORD_MANAGER_SECRET_KEY', 'benchmark')
+
+from config import Config  # noqa: E402
+from Password_Manager import create_app  # noqa: E402
+from Password_Manager.core.auth_pool import AuthWorkerPool  # noqa: E402
+from Password_Manager.database import DatabaseManager  # noqa: E402
+from Password_Manager.services import UserManager  # noqa: E402
+from Password_Manager.transfer import VaultTransferService  # noqa: E402
+
+MASTER_PASSWORDS = ('benchmark-master-1', 'benchmark-master-2')
+SEED = 20240601
+
+
+class Measurement(NamedTuple):
+    """Risultato di un'operazione misurata"""
+    scenario: str
+    vault: int
+    operation: str
+    samples: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    throughput: float  # operazioni al secondo, eseguite in sequenza
+
+
+def parse_kdf(value: str) -> Tuple[str, str, Dict[str, int]]:
+    """Interpreta 'algoritmo' o 'algoritmo:{parametri JSON}' (senza parametri: quelli di config.py)"""
+    algorithm, _, params = value.partition(':')
+    if params:
+        try:
+            return value, algorithm, json.loads(params)
+        except json.JSONDecodeError as e:
+            raise argparse.ArgumentTypeError(f'parametri KDF non validi: {e}')
+    if algorithm == Config.KDF_ALGORITHM:
+        return algorithm, algorithm, dict(Config.KDF_PARAMS)
+    raise argparse.ArgumentTypeError(f'indicare i parametri per {algorithm}, es. {algorithm}:{{"iterations": 600000}}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark dei percorsi principali del Password Manager.')
+    parser.add_argument('--vault', type=int, action='append',
+                        help='voci nel vault dell\'utente di prova, ripetibile (default: 100 e 2000)')
+    parser.add_argument('--kdf', type=parse_kdf, action='append',
+                        help='configurazione KDF da provare, ripetibile (default: quella di config.py)')
+    parser.add_argument('--ripetizioni', type=int, default=50,
+                        help='campioni per le operazioni veloci (default: %(default)s)')
+    parser.add_argument('--ripetizioni-kdf', type=int, default=5,
+                        help='campioni per login e cambio della password master (default: %(default)s)')
+    parser.add_argument('--concorrenza', type=int, default=4,
+                        help='client simultanei per la prova di carico della dashboard (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE', help='salva i risultati in formato JSON')
+    parser.add_argument('--confronta', metavar='FILE', help='confronta con i risultati JSON di un\'esecuzione precedente')
+    parser.add_argument('--tolleranza', type=float, default=20.0,
+                        help='peggioramento percentuale della mediana tollerato con --confronta (default: %(default)s)')
+    return parser.parse_args()
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Percentile con il metodo nearest-rank su campioni già ordinati"""
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+def measure(scenario: str, vault: int, operation: str, repetitions: int,
+            run: Callable[[int], None], warmup: int = 1) -> Measurement:
+    """Esegue `run(i)` per `repetitions` volte dopo `warmup` esecuzioni scartate"""
+    for i in range(warmup):
+        run(-1 - i)
+
+    samples = []
+    for i in range(repetitions):
+        start = time.perf_counter()
+        run(i)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    total = sum(samples)
+    return Measurement(
+        scenario, vault, operation, len(samples),
+        percentile(samples, 0.50), percentile(samples, 0.95), percentile(samples, 0.99),
+        total / len(samples), len(samples) / (total / 1000) if total else 0.0,
+    )
+
+
+def measure_concurrent(scenario: str, vault: int, operation: str, repetitions: int,
+                       clients: List, run: Callable[[object, int], None]) -> Measurement:
+    """
+    Esegue `run(client, i)` in parallelo, `repetitions` volte per ogni client, ciascuno
+    nel proprio thread; il throughput è calcolato sul tempo totale trascorso
+    """
+    def worker(client) -> List[float]:
+        samples = []
+        for i in range(repetitions):
+            start = time.perf_counter()
+            run(client, i)
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        samples = sorted(sample for result in executor.map(worker, clients) for sample in result)
+    elapsed = time.perf_counter() - start
+    return Measurement(
+        scenario, vault, operation, len(samples),
+        percentile(samples, 0.50), percentile(samples, 0.95), percentile(samples, 0.99),
+        sum(samples) / len(samples), len(samples) / elapsed,
+    )
+
+
+def expect(response, *status_codes: int) -> None:
+    """Un benchmark che misura errori o redirect al login non ha senso: si ferma subito"""
+    if response.status_code not in status_codes:
+        raise RuntimeError(f'{response.request.method} {response.request.path}: risposta {response.status_code}')
+
+
+def entry_ids(user_id: int) -> List[int]:
+    """Id delle voci dell'utente, in ordine"""
+    return [row[0] for row in DatabaseManager.get_connection(user_id).execute(
+        'SELECT id FROM password_salvate WHERE utente_id = ? ORDER BY id', (user_id,)
+    )]
+
+
+def seed_vault(username: str, entries: int, rng: random.Random) -> int:
+    """Crea l'utente di prova e ne riempie il vault con voci sintetiche; restituisce l'id"""
+    if not UserManager.create_user(username, MASTER_PASSWORDS[0]):
+        raise RuntimeError(f'impossibile creare l\'utente {username}')
+    user_id = UserManager.get_user_by_username(username)['id']
+
+    csv_data = io.StringIO()
+    writer = csv.writer(csv_data)
+    writer.writerow(['name', 'username', 'password'])
+    for i in range(entries):
+        writer.writerow([f'sito{i}.example', f'utente{rng.randrange(entries)}@example.com',
+                         ''.join(rng.choice('abcdefghijkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(16))])
+    csv_data.seek(0)
+    VaultTransferService.import_csv(user_id, csv_data, UserManager.get_master_key(user_id, MASTER_PASSWORDS[0]))
+    return user_id
+
+
+def run_vault(scenario: str, entries: int, args, rng: random.Random) -> List[Measurement]:
+    """Misura tutte le operazioni sul vault di un utente con `entries` voci"""
+    app = create_app()
+    app.config['TESTING'] = True
+    username = f'benchmark{entries}'
+    results = []
+
+    start = time.perf_counter()
+    user_id = seed_vault(username, entries, rng)
+    seeded = entry_ids(user_id)
+    elapsed = time.perf_counter() - start
+    print(f'  vault di {entries} voci creato in {elapsed:.1f} s', file=sys.stderr)
+
+    client = app.test_client()
+    current_password = [MASTER_PASSWORDS[0]]
+
+    def login(_):
+        fresh = app.test_client()
+        expect(fresh.post('/login', data={'username': username, 'password': current_password[0]}), 302)
+
+    results.append(measure(scenario, entries, 'login', args.ripetizioni_kdf, login))
+    expect(client.post('/login', data={'username': username, 'password': current_password[0]}), 302)
+
+    results.append(measure(scenario, entries, 'dashboard', args.ripetizioni,
+                           lambda _: expect(client.get('/dashboard'), 200)))
+    results.append(measure(scenario, entries, 'dashboard_ricerca', args.ripetizioni,
+                           lambda i: expect(client.get(f'/dashboard?q=sito{rng.randrange(entries)}'), 200)))
+    results.append(measure(scenario, entries, 'mostra_password', args.ripetizioni,
+                           lambda _: expect(client.get(f'/api/password/{rng.choice(seeded)}'), 200)))
+
+    if args.concorrenza > 1:
+        clients = [app.test_client() for _ in range(args.concorrenza)]
+        for other in clients:
+            expect(other.post('/login', data={'username': username, 'password': current_password[0]}), 302)
+        results.append(measure_concurrent(
+            scenario, entries, f'dashboard_x{args.concorrenza}', args.ripetizioni, clients,
+            lambda other, _: expect(other.get('/dashboard'), 200)
+        ))
+
+    def add(i):
+        expect(client.post('/aggiungi', data={
+            'nome_sito': f'nuovo{i}.example', 'username_sito': 'benchmark', 'password_sito': f'Nuova-Password-{i}!'
+        }), 302)
+
+    results.append(measure(scenario, entries, 'aggiungi', args.ripetizioni, add))
+    # Si modificano ed eliminano solo le voci appena aggiunte, così il vault iniziale resta invariato
+    added = entry_ids(user_id)[len(seeded):]
+
+    results.append(measure(scenario, entries, 'modifica', args.ripetizioni, lambda i: expect(client.post(
+        f'/modifica/{added[i]}', data={'nome_sito': f'modificato{i}.example', 'username_sito': 'benchmark',
+                                       'password_sito': f'Modificata-{i}!'}
+    ), 302)))
+    results.append(measure(scenario, entries, 'elimina', args.ripetizioni,
+                           lambda i: expect(client.get(f'/elimina/{added[i]}'), 302), warmup=0))
+
+    def change_master(_):
+        new_password = MASTER_PASSWORDS[1] if current_password[0] == MASTER_PASSWORDS[0] else MASTER_PASSWORDS[0]
+        expect(client.post('/cambia_password_master', data={
+            'password_attuale': current_password[0],
+            'nuova_password': new_password,
+            'conferma_nuova_password': new_password,
+        }), 302)
+        current_password[0] = new_password
+
+    results.append(measure(scenario, entries, 'cambio_password_master', args.ripetizioni_kdf, change_master, warmup=0))
+
+    results.append(measure(scenario, entries, 'genera_password', args.ripetizioni,
+                           lambda _: expect(client.post('/api/genera_password', json={'quantita': 1}), 200)))
+    results.append(measure(scenario, entries, 'genera_password_1000', args.ripetizioni,
+                           lambda _: expect(client.post('/api/genera_password', json={'quantita': 1000}), 200)))
+    return results
+
+
+def run_scenario(name: str, algorithm: str, params: Dict[str, int], args, directory: str) -> List[Measurement]:
+    """Esegue il benchmark con una configurazione della KDF su un database nuovo"""
+    print(f'Scenario {name}', file=sys.stderr)
+    Config.DATABASE = os.path.join(directory, f'benchmark-{len(os.listdir(directory))}.db')
+    Config.KDF_ALGORITHM = algorithm
+    Config.KDF_PARAMS = params
+    Config.FORMAT_MIGRATION_IN_BACKGROUND = False
+
+    rng = random.Random(SEED)
+    results = []
+    for entries in args.vault:
+        results.extend(run_vault(name, entries, args, rng))
+    return results
+
+
+def print_table(results: List[Measurement]) -> None:
+    print(f"{'scenario':<36} {'vault':>6} {'operazione':<24} {'n':>4} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'op/s':>9}")
+    for m in results:
+        print(f'{m.scenario[:36]:<36} {m.vault:>6} {m.operation:<24} {m.samples:>4} '
+              f'{m.p50_ms:>9.2f} {m.p95_ms:>9.2f} {m.p99_ms:>9.2f} {m.throughput:>9.1f}')
+
+
+def compare(results: List[Measurement], baseline_path: str, tolerance: float) -> List[str]:
+    """Restituisce le operazioni la cui mediana è peggiorata oltre la tolleranza"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['scenario'], r['vault'], r['operation']): r for r in json.load(f)['risultati']}
+
+    regressions = []
+    for m in results:
+        previous = baseline.get((m.scenario, m.vault, m.operation))
+        if previous is None or not previous['p50_ms']:
+            continue
+        change = (m.p50_ms / previous['p50_ms'] - 1) * 100
+        if change > tolerance:
+            regressions.append(f'{m.scenario} / {m.vault} voci / {m.operation}: '
+                               f"p50 {previous['p50_ms']:.2f} -> {m.p50_ms:.2f} ms (+{change:.0f}%)")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    args.vault = args.vault or [100, 2000]
+    scenarios = args.kdf or [(Config.KDF_ALGORITHM, Config.KDF_ALGORITHM, dict(Config.KDF_PARAMS))]
+
+    results: List[Measurement] = []
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as directory:
+        os.chdir(directory)
+        try:
+            for name, algorithm, params in scenarios:
+                results.extend(run_scenario(name, algorithm, params, args, directory))
+        finally:
+            AuthWorkerPool.shutdown()
+            os.chdir(PROJECT_DIR)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'ambiente': {
+                    'python': platform.python_version(),
+                    'piattaforma': platform.platform(),
+                    'cpu': os.cpu_count(),
+                    'auth_workers': Config.AUTH_WORKERS,
+                    'hash_login': Config.PASSWORD_HASH_METHOD,
+                },
+                'risultati': [m._asdict() for m in results],
+            }, f, indent=2)
+
+    if args.confronta:
+        regressions = compare(results, args.confronta, args.tolleranza)
+        for regression in regressions:
+            print(f'PEGGIORAMENTO {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,132 @@
 import os
 
+# Cartella del progetto (quella di config.py): i file creati dall'applicazione non
+# dipendono dalla cartella da cui viene avviata
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+INSTANCE_DIRECTORY = os.path.join(PROJECT_DIRECTORY, 'instance')
+
+
+def load_secret_key() -> bytes:
+    """
+    Chiave di firma delle sessioni, identica per tutti i processi: dalla variabile
+    d'ambiente PASSWORD_MANAGER_SECRET_KEY o da un file creato al primo avvio in
+    instance/secret_key, leggibile solo dal proprietario
+    """
+    if os.environ.get('PASSWORD_MANAGER_SECRET_KEY'):
+        return os.environ['PASSWORD_MANAGER_SECRET_KEY'].encode()
+    
+    path = os.environ.get('PASSWORD_MANAGER_SECRET_KEY_FILE') or os.path.join(INSTANCE_DIRECTORY, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        # Scrittura in un file temporaneo e link atomico: se più processi partono
+        # insieme, il primo crea la chiave e gli altri leggono la stessa
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    elif os.name == 'posix' and os.stat(path).st_mode & 0o077:
+        # File creato da una versione precedente con i permessi predefiniti
+        os.chmod(path, 0o600)
+    
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 class Config:
     """Configurazione centralizzata dell'applicazione"""
-    SECRET_KEY = os.urandom(24)
+    SECRET_KEY = load_secret_key()
     DATABASE = 'password_manager.db'
-    PBKDF2_ITERATIONS = 100
+    DB_POOL_SIZE = 8
+    DB_POOL_TIMEOUT = 10  # secondi di attesa per una connessione libera
+    DB_BUSY_TIMEOUT = 5  # secondi di attesa sui lock di scrittura
+    DB_MMAP_SIZE = 64 * 1024 * 1024
+    DB_STATEMENT_CACHE_SIZE = 256
+
+    # Suddivisione dei vault in più file SQLite (shard); directory degli utenti e sessioni restano in DATABASE
+    DB_SHARD_MODE = 'nessuno'  # nuovi utenti: 'nessuno' in DATABASE, 'utente' un file ciascuno, 'hash' in DB_SHARD_COUNT file
+    DB_SHARD_DIRECTORY = 'shard'
+    DB_SHARD_COUNT = 16
+    DB_SHARD_CACHE_TTL = 60  # secondi; dopo lo spostamento di un vault gli altri worker se ne accorgono al più dopo questo intervallo
+    DB_SHARD_CACHE_MAX_ENTRIES = 100000
+    DB_MAX_OPEN_POOLS = 64  # pool di connessioni aperti contemporaneamente, uno per shard usato
+    DB_THREAD_CONNECTIONS = 8  # connessioni persistenti per thread fuori dalle richieste
+    DB_MAINTENANCE_WORKERS = 4  # shard elaborati in parallelo da backup, vacuum e verifiche
+
+    # Backup online e incrementali (flask backup, flask ripristina-backup)
+    BACKUP_DIRECTORY = 'backup'
+    BACKUP_COMPRESSION_LEVEL = 6  # zlib, 0 = nessuna compressione
+    BACKUP_CHUNK_PAGES = 256  # pagine per blocco compresso e cifrato
+    BACKUP_MAX_CHAIN = 7  # backup di una catena (il completo e i successivi incrementali) prima di ripartire con un completo
+    PBKDF2_ITERATIONS = 100  # costo degli utenti creati prima della KDF configurabile
+    # Derivazione della chiave dalla password master per nuovi utenti e aggiornamento al login
+    # ('pbkdf2_sha512', 'scrypt' o 'argon2id'); usare `flask calibra-kdf` per scegliere i costi
+    KDF_ALGORITHM = 'scrypt'
+    KDF_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+    # Parametri letti da file esterni (importazione): al più KDF_MAX_COST_FACTOR volte il costo di
+    # riferimento (KDF_PARAMS per KDF_ALGORITHM, altrimenti KDF_REFERENCE_PARAMS) e mai oltre
+    # KDF_MAX_MEMORY byte di memoria per derivazione
+    KDF_REFERENCE_PARAMS = {
+        'pbkdf2_sha512': {'iterations': 600_000},
+        'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1},
+        'argon2id': {'iterations': 3, 'memory_cost': 64 * 1024, 'lanes': 4},
+    }
+    KDF_MAX_COST_FACTOR = 4
+    KDF_MAX_MEMORY = 256 * 1024 * 1024
+    # Metodo werkzeug per l'hash di login, riapplicato al login quando cambia
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    # Pool di processi per hash e KDF (0 = esecuzione nel thread della richiesta)
+    AUTH_WORKERS = os.cpu_count() or 1
+    AUTH_MAX_PENDING = 4 * AUTH_WORKERS  # operazioni accettate tra esecuzione e coda
+    AUTH_QUEUE_TIMEOUT = 2  # secondi di attesa di un posto in coda prima di rispondere 503
     SALT_LENGTH = 32
     MIN_PASSWORD_LENGTH = 8
-    MAX_PASSWORD_LENGTH = 128
\ No newline at end of file
+    MAX_PASSWORD_LENGTH = 128
+    PASSWORD_BATCH_MAX = 10000  # password generate al massimo in una singola richiesta
+    # Passphrase: EFF Large Wordlist (Electronic Frontier Foundation, CC BY 3.0 US), 7776 parole
+    PASSPHRASE_WORDLIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Password_Manager', 'data', 'eff_large_wordlist.txt')
+    PASSPHRASE_DEFAULT_WORDS = 6
+    PASSPHRASE_MIN_WORDS = 3
+    PASSPHRASE_MAX_WORDS = 20
+    DASHBOARD_PAGE_SIZE = 50
+    PAGE_CACHE_TTL = 600  # secondi; le pagine di metadati decifrati restano valide finché il vault non cambia
+    PAGE_CACHE_MAX_USERS = 1000
+    PAGE_CACHE_PAGES_PER_USER = 20  # pagine e ricerche ricordate per ogni utente
+    STATIC_MAX_AGE = 31536000  # secondi; file statici richiesti con l'impronta del contenuto (?v=...)
+    SYNC_PAGE_SIZE = 500  # modifiche restituite al massimo da una richiesta di sincronizzazione
+
+    # Robustezza delle password e corpus locale delle violazioni (preparato con `flask prepara-corpus-violazioni`)
+    BREACH_CORPUS_PATH = 'violazioni_sha1.bin'
+    MIN_PASSWORD_SCORE = 2  # sotto questo punteggio (0-4) la password è segnalata come debole
+    AUDIT_BATCH_SIZE = 500
+    PASSWORD_MAX_AGE_DAYS = 365  # oltre questa età dall'ultima modifica la password è segnalata come vecchia
+    AUDIT_CACHE_TTL = 300  # secondi; le modifiche fatte da altri worker si vedono al più dopo questo intervallo
+    AUDIT_CACHE_MAX_ENTRIES = 10000
+
+    # Metriche e profilazione delle richieste
+    METRICS_ENABLED = False  # tempi per fase (kdf, crypto, db, template) in Server-Timing, contatori e /metrics
+    METRICS_ALLOWED_ADDRESSES = ('127.0.0.1', '::1')  # client ammessi a leggere /metrics
+    PROFILE_SAMPLE_RATE = 0.0  # frazione delle richieste profilate con cProfile (0 = disattivata)
+    PROFILE_DIRECTORY = 'profili'  # dove salvare i profili (.prof) delle richieste campionate
+
+    # Ri-crittografia del vault (cambio password master)
+    REKEY_BATCH_SIZE = 500
+    REKEY_WORKERS = 1  # > 1 per parallelizzare la crittografia su un pool di thread
+    FORMAT_MIGRATION_IN_BACKGROUND = True  # converte al login le voci nel vecchio formato
+
+    # Importazione ed esportazione del vault
+    TRANSFER_BATCH_SIZE = 500  # voci inserite per transazione
+    MAX_CONTENT_LENGTH = 64 * 1024 * 1024  # dimensione massima dei file caricati
+
+    # Sessioni lato server: 'sqlite' è condiviso tra i processi worker (gunicorn, serve.py);
+    # 'memory' vale solo per un singolo processo e lo usa il server di sviluppo (run.py)
+    SESSION_BACKEND = 'sqlite'
+    SESSION_IDLE_TIMEOUT = 1800  # secondi di inattività prima della scadenza
+    SESSION_MAX_ENTRIES = 10000  # solo 'memory': oltre il limite escono le meno usate
+    SESSION_CLEANUP_PROBABILITY = 0.01  # solo 'sqlite': frequenza della pulizia delle scadute
+    SESSION_COOKIE_SAMESITE = 'Lax'
@@ -1,5 +1,8 @@
+from config import Config
 from password_manager import create_app
 
+# Il server di sviluppo è un unico processo: le sessioni possono restare in memoria
+Config.SESSION_BACKEND = 'memory'
 app = create_app()
 
 if __name__ == '__main__':
@@ -0,0 +1,84 @@
+"""
+Avvio di produzione con più processi worker (pre-fork, tramite gunicorn): è il punto
+di ingresso da usare in produzione, run.py serve solo per lo sviluppo.
+
+Ogni richiesta occupa un thread di un worker: la concorrenza viene da --workers e --threads.
+
+L'applicazione viene caricata una sola volta nel processo master e poi condivisa
+dai worker con il fork. Segnali al master:
+    SIGTERM / SIGINT  arresto ordinato (attende le richieste in corso)
+    SIGHUP            riavvio ordinato dei worker
+    SIGTTIN / SIGTTOU un worker in più / in meno
+
+Esempio: python serve.py --workers 4 --bind 0.0.0.0:8000
+"""
+import argparse
+import os
+import sys
+
+from config import Config
+from Password_Manager import create_app
+from Password_Manager.database import DatabaseManager
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Avvia il Password Manager in modalità produzione.')
+    parser.add_argument('--bind', default='127.0.0.1:8000', help='indirizzo:porta di ascolto (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) + 1,
+                        help='numero di processi worker (default: core + 1)')
+    parser.add_argument('--threads', type=int, default=4, help='thread per worker (default: %(default)s)')
+    parser.add_argument('--timeout', type=int, default=60, help='secondi prima di riavviare un worker bloccato')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='secondi concessi alle richieste in corso durante arresto e riavvio')
+    return parser.parse_args()
+
+
+if BaseApplication is not None:
+    class PreforkServer(BaseApplication):
+        """Server gunicorn che usa l'applicazione già caricata nel master."""
+
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def main():
+    if BaseApplication is None:
+        sys.exit('gunicorn non è installato (non disponibile su Windows): usare run.py per lo sviluppo.')
+
+    args = parse_args()
+    # I worker sono processi separati (e con SIGTTIN se ne aggiungono): le sessioni devono
+    # stare in un archivio condiviso anche se la configurazione chiede 'memory'
+    Config.SESSION_BACKEND = 'sqlite'
+    app = create_app()
+    # Il master riceve lo spegnimento richiesto dalla route /shutdown
+    app.config['SERVER_MASTER_PID'] = os.getpid()
+    # Le connessioni SQLite non devono attraversare il fork: ogni worker apre le proprie
+    DatabaseManager.close_all()
+
+    PreforkServer(app, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'preload_app': True,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()